@@ -7,6 +7,33 @@ Autor: @hex686f6c61
 GitHub: https://github.com/686f6c61/Twitter-Xcom-Scraping
 Twitter/X: https://x.com/hex686f6c61
 
+Changelog v0.6:
+- Checkpoints atómicos (archivo temporal + fsync + rename) con respaldos rotativos opcionales
+- Política de checkpoints configurable por tiempo, elementos o MB (CheckpointPolicy)
+- Rango de fechas enviado a la API con los operadores since:/until:
+- Backfill paralelo por franjas de tiempo con límite global de peticiones por segundo
+- Planificador de respuestas: omite tweets sin respuestas, umbrales, top-K y presupuesto
+- Reconstrucción del árbol de respuestas por niveles (respuestas a respuestas)
+- Filtros componibles evaluados en cortocircuito, de la condición más barata a la más cara (TweetFilter)
+- Filtros aplicados durante la paginación: lo descartado no genera peticiones de respuestas
+- Estadísticas incrementales (top usuarios/hashtags, engagement, volumen por hora) en 'analytics'
+- Modo worker con cola de tareas compartida (SQLite o Redis) para varios nodos
+- Pool de API keys (RAPIDAPI_KEYS) con límite por key, cuota, failover y reporte de uso
+- Monitoreo con exportación incremental: solo los datos nuevos se añaden a un JSONL/CSV rotativo
+- Planificador de monitoreo sin deriva, con intervalo adaptativo al ritmo de tweets y a la cuota
+- Monitoreo de varios términos en un proceso con rate limit, cuota y sesión HTTP compartidos
+- Búsquedas combinadas con OR para varios términos, con reparto posterior en un dataset por término
+- Modo de salida con autores normalizados en un mapa 'users' (NORMALIZE_USERS), reconstruible al leer
+- Descarga concurrente de multimedia a un almacén por hash, con reanudación y límite de bytes
+- Índice de texto completo (SQLite FTS5) con comandos index y search
+- Comando compact: fusión de datasets de una búsqueda con merge externo, sin duplicados
+- Índice de offsets (.idx) junto a cada dataset para leer tweets sueltos con mmap
+- Modo de perfilado por fases (PROFILE): cProfile y tracemalloc volcados en scraping/profile_*
+- Salida en streaming (STREAM_OUTPUT): NDJSON a stdout, tubería, socket Unix o función, con contrapresión
+- Monitoreo con refresco de hilos: solo se vuelven a pedir respuestas si su contador creció, con serie temporal de engagement
+- Deduplicación del monitoreo con memoria acotada: IDs int64 por ventana de tiempo, persistidos entre reinicios
+- Archivo de páginas crudas de la API (PAGE_ARCHIVE) con comandos archive y rebuild
+
 Changelog v0.5:
 - Control de interrupciones con Ctrl+C
 - Pregunta si detener definitivamente o continuar
@@ -34,7 +61,27 @@ import json
 import time
 import signal
 import sys
-from datetime import datetime
+import tempfile
+import io
+import threading
+import queue
+import re
+import sqlite3
+import zlib
+import atexit
+import cProfile
+import pstats
+import tracemalloc
+import functools
+import bisect
+import heapq
+import base64
+import hashlib
+from array import array
+from itertools import chain
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
 # Cargar variables de entorno
@@ -72,10 +119,503 @@ def signal_handler(sig, frame):
         print("\n✓ Descarga detenida. El progreso se ha guardado.")
         should_stop = True
 
+def atomic_write_json(filepath, data, backups=0):
+    """
+    Escribe un JSON de forma atómica (archivo temporal + fsync + rename)
+
+    Si el proceso muere a mitad de escritura, el archivo destino conserva
+    su versión anterior completa en lugar de quedar truncado.
+
+    Args:
+        filepath: Ruta del archivo destino
+        data: Datos a guardar
+        backups: Número de generaciones de respaldo a mantener (.bak1, .bak2, ...)
+    """
+    def write(f):
+        text = io.TextIOWrapper(f, encoding='utf-8')
+        json.dump(data, text, ensure_ascii=False, indent=2)
+        text.flush()
+        text.detach()
+
+    _atomic_write(filepath, write, backups)
+
+
+def _atomic_write(filepath, write, backups=0):
+    """
+    Escritura atómica genérica: write(f) recibe el archivo temporal abierto en binario
+
+    Ver atomic_write_json (rotación de respaldos y fsync del directorio incluidos).
+    """
+    directory = os.path.dirname(filepath) or '.'
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(filepath) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Rotar respaldos: .bak1 es el más reciente
+        if backups > 0 and os.path.exists(filepath):
+            for generation in range(backups, 1, -1):
+                older = f"{filepath}.bak{generation - 1}"
+                if os.path.exists(older):
+                    os.replace(older, f"{filepath}.bak{generation}")
+            os.replace(filepath, f"{filepath}.bak1")
+
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    # Persistir la entrada del directorio (no disponible en todos los sistemas)
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+
+
+def load_checkpoint(filepath):
+    """
+    Carga un JSON de checkpoint, recurriendo a sus respaldos si está corrupto
+
+    Args:
+        filepath: Ruta del archivo JSON
+
+    Returns:
+        Tupla (datos, ruta_leída). ruta_leída es la del respaldo usado si el
+        archivo principal no se pudo leer
+
+    Raises:
+        ValueError: Si ni el archivo ni sus respaldos son JSON válidos
+    """
+    candidates = [filepath]
+    generation = 1
+    while os.path.exists(f"{filepath}.bak{generation}"):
+        candidates.append(f"{filepath}.bak{generation}")
+        generation += 1
+
+    for candidate in candidates:
+        try:
+            with open(candidate, 'r', encoding='utf-8') as f:
+                return json.load(f), candidate
+        except (OSError, ValueError) as e:
+            print(f"⚠️  No se pudo leer {candidate}: {e}")
+
+    raise ValueError(f"Checkpoint ilegible y sin respaldos válidos: {filepath}")
+
+
+def parse_date_limit(value):
+    """
+    Convierte un límite de fecha a timestamp Unix (hora local)
+
+    Args:
+        value: 'YYYY-MM-DD' o 'YYYY-MM-DD HH:MM'
+
+    Returns:
+        Timestamp Unix (int)
+    """
+    fmt = '%Y-%m-%d %H:%M' if ' ' in value else '%Y-%m-%d'
+    return int(datetime.strptime(value, fmt).timestamp())
+
+
+def split_date_range(since_date, until_date, slice_hours=24):
+    """
+    Divide el rango [since_date, until_date) en franjas consecutivas
+
+    Args:
+        since_date: Fecha inicial - formato: YYYY-MM-DD o YYYY-MM-DD HH:MM
+        until_date: Fecha final (exclusiva) - mismo formato
+        slice_hours: Tamaño de cada franja en horas
+
+    Returns:
+        Lista de tuplas (since, until) ordenadas de la más reciente a la más
+        antigua. Se usa formato de día si las franjas son de días completos
+    """
+    start = datetime.fromtimestamp(parse_date_limit(since_date))
+    end = datetime.fromtimestamp(parse_date_limit(until_date))
+    step = timedelta(hours=slice_hours)
+    whole_days = slice_hours % 24 == 0 and start.hour == 0 and start.minute == 0 and end.hour == 0 and end.minute == 0
+    fmt = '%Y-%m-%d' if whole_days else '%Y-%m-%d %H:%M'
+
+    slices = []
+    current = start
+    while current < end:
+        slice_end = min(current + step, end)
+        slices.append((current.strftime(fmt), slice_end.strftime(fmt)))
+        current = slice_end
+
+    slices.reverse()
+    return slices
+
+
+class TokenBucket:
+    """
+    Limitador de peticiones por segundo (token bucket), seguro entre hilos
+
+    Permite ráfagas de hasta `capacity` peticiones y una tasa sostenida de
+    `rate` peticiones por segundo.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        Args:
+            rate: Peticiones por segundo permitidas
+            capacity: Tamaño máximo de ráfaga (por defecto = rate)
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """Consume un token si hay disponible. Devuelve True si lo consiguió"""
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        """Espera hasta obtener un token"""
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def atomic_write_dataset(filepath, data, backups=0):
+    """
+    Escribe un dataset de forma atómica con un elemento de 'tweets' por línea
+
+    El archivo sigue siendo un JSON normal, pero cada tweet (con sus
+    respuestas) ocupa un rango de bytes propio. Mientras se escribe se anota
+    ese rango y se guarda en {filepath}.idx (ver DatasetReader), junto con los
+    metadatos del dataset, para poder leer un tweet o comprobar un id sin
+    cargar el archivo entero.
+
+    Args:
+        filepath: Ruta del archivo destino
+        data: Dataset con la estructura de download_full_conversation
+        backups: Generaciones de respaldo a mantener (ver atomic_write_json)
+    """
+    header = {k: v for k, v in data.items() if k != 'tweets'}
+    index = _new_offset_index(header)
+
+    def write(f):
+        f.write(b'{\n')
+        for key, value in header.items():
+            f.write(f'  {json.dumps(key)}: {json.dumps(value, ensure_ascii=False)},\n'.encode('utf-8'))
+        f.write(b'  "tweets": [\n')
+        index['header_end'] = f.tell()
+        for n, item in enumerate(data.get('tweets', [])):
+            if n:
+                f.write(b',\n')
+            raw = json.dumps(item, ensure_ascii=False).encode('utf-8')
+            _index_item(index, item, f.tell(), len(raw))
+            f.write(raw)
+        f.write(b'\n  ]\n}\n')
+
+    _atomic_write(filepath, write, backups)
+    index['size'] = os.path.getsize(filepath)
+    atomic_write_json(f"{filepath}.idx", index)
+
+
+def _new_offset_index(header):
+    return {
+        'version': 1,
+        'size': None,
+        'header_end': None,
+        'items': {},
+        'replies': {},
+        'meta': {
+            'query': header.get('query'),
+            'search_type': header.get('search_type'),
+            'mode': header.get('mode'),
+            'status': header.get('status'),
+            'downloaded_at': header.get('downloaded_at'),
+            'total_main_tweets': header.get('total_main_tweets'),
+            'normalized': 'users' in header,
+            'oldest_date': None
+        }
+    }
+
+
+def _index_item(index, item, offset, length):
+    tweet = item.get('tweet', {})
+    tweet_id = tweet.get('id')
+    if tweet_id:
+        index['items'][tweet_id] = [offset, length]
+        for reply in item.get('replies', []):
+            if reply.get('id'):
+                index['replies'][reply['id']] = tweet_id
+    date = tweet.get('time_parsed')
+    if date and (index['meta']['oldest_date'] is None or date < index['meta']['oldest_date']):
+        index['meta']['oldest_date'] = date
+
+
+def build_offset_index(filepath):
+    """
+    Construye {filepath}.idx recorriendo un dataset con un tweet por línea
+
+    Sirve para archivos escritos en streaming (p. ej. por compact_datasets) o
+    cuyo índice falta o está desfasado. Solo escribe el índice; el dataset no
+    se modifica.
+
+    Returns:
+        El índice, o None si el archivo no tiene un tweet por línea (formato antiguo)
+    """
+    header_lines = []
+    tail_lines = []
+    index = None
+    section = 'header'
+    offset = 0
+    with open(filepath, 'rb') as f:
+        for line in f:
+            if section == 'header':
+                if line == b'  "tweets": [\n':
+                    section = 'items'
+                    header_end = offset + len(line)
+                else:
+                    header_lines.append(line)
+            elif section == 'items':
+                if line.strip() in (b']', b'],'):
+                    section = 'tail'
+                elif line.strip():
+                    raw = line.rstrip(b'\n').rstrip(b',')
+                    try:
+                        item = json.loads(raw)
+                    except ValueError:
+                        return None
+                    if index is None:
+                        index = _new_offset_index({})
+                    _index_item(index, item, offset, len(raw))
+            else:
+                tail_lines.append(line)
+            offset += len(line)
+
+    if section != 'tail':
+        return None
+    try:
+        header = json.loads(b''.join(header_lines).rstrip().rstrip(b',') + b'}') if len(header_lines) > 1 else {}
+        tail = json.loads(b'{' + b''.join(tail_lines)) if tail_lines else {}
+    except ValueError:
+        return None
+
+    items = index or _new_offset_index({})
+    index = _new_offset_index(dict(header, **tail))
+    index['items'] = items['items']
+    index['replies'] = items['replies']
+    index['meta']['oldest_date'] = items['meta']['oldest_date']
+    index['header_end'] = header_end
+    index['size'] = os.path.getsize(filepath)
+    atomic_write_json(f"{filepath}.idx", index)
+    return index
+
+
+def load_offset_index(filepath, rebuild=True, migrate=False):
+    """
+    Índice de offsets de un dataset, reconstruyéndolo si falta o está desfasado
+
+    Args:
+        filepath: Ruta del dataset
+        rebuild: Si True, reconstruye el índice cuando el archivo tiene un tweet
+            por línea. Si False, devuelve None si no hay índice al día
+        migrate: Si True, reescribe los archivos en formato antiguo con un tweet
+            por línea para poder indexarlos (por defecto no se tocan)
+
+    Returns:
+        Diccionario del índice (ver atomic_write_dataset) o None
+    """
+    idx_path = f"{filepath}.idx"
+    if os.path.exists(idx_path):
+        try:
+            with open(idx_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('size') == os.path.getsize(filepath):
+                return index
+        except (OSError, ValueError):
+            pass
+    if not rebuild:
+        return None
+
+    index = build_offset_index(filepath)
+    if index is None and migrate:
+        data, _ = load_checkpoint(filepath)
+        print(f"  ↻ Reescribiendo {os.path.basename(filepath)} con un tweet por línea (índice de offsets)")
+        atomic_write_dataset(filepath, data)
+        with open(idx_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    return index
+
+
+def read_dataset_meta(filepath, tail_bytes=65536):
+    """
+    Metadatos de un dataset (query, status, ...) sin decodificar sus tweets
+
+    Usa el índice de offsets si está al día; si no, lee solo la cabecera
+    (hasta "tweets") y el final del archivo (tras el cierre de la lista), que
+    es donde save_to_json deja status y los totales.
+
+    Args:
+        filepath: Ruta del dataset
+        tail_bytes: Bytes finales a leer buscando el cierre de 'tweets'
+
+    Returns:
+        Diccionario con los campos fuera de 'tweets', o None si no se pueden
+        leer así (formato inesperado o archivo corrupto: usar load_checkpoint)
+    """
+    index = load_offset_index(filepath, rebuild=False)
+    if index:
+        return index['meta']
+
+    try:
+        with open(filepath, 'rb') as f:
+            head = b''
+            while b'\n  "tweets": [\n' not in head:
+                chunk = f.read(65536)
+                if not chunk:
+                    return None
+                head += chunk
+            size = os.path.getsize(filepath)
+            f.seek(max(0, size - tail_bytes))
+            tail = f.read()
+        head = head[:head.index(b'\n  "tweets": [\n')].rstrip().rstrip(b',')
+        end = tail.rfind(b'\n  ]')
+        if end < 0:
+            return None
+        tail = tail[end + len(b'\n  ]'):].lstrip().lstrip(b',')
+        header = json.loads(head + b'}')
+        header.update(json.loads(b'{' + tail))
+        return header
+    except (OSError, ValueError):
+        return None
+
+
+class DatasetReader:
+    """
+    Acceso aleatorio a los tweets de un dataset sin cargarlo entero
+
+    Usa el índice de offsets ({archivo}.idx) y un mmap del archivo: buscar un
+    id es una consulta a un diccionario y leer un tweet solo decodifica su
+    línea. Las respuestas se resuelven a su tweet principal (el hilo). Los
+    JSON en formato antiguo (sin un tweet por línea) se cargan enteros en
+    memoria sin reescribirlos, salvo que se pida migrate.
+    """
+
+    def __init__(self, filepath, migrate=False):
+        """
+        Args:
+            filepath: Ruta del dataset (.json)
+            migrate: Reescribir el archivo con un tweet por línea si está en formato antiguo
+        """
+        import mmap
+
+        self.filepath = filepath
+        self.index = load_offset_index(filepath, migrate=migrate)
+        self._file = self._mmap = self._items = None
+        if self.index is None:
+            data, _ = load_checkpoint(filepath)
+            self._header = {k: v for k, v in data.items() if k != 'tweets'}
+            self._items = data.get('tweets', [])
+            self.index = _new_offset_index(self._header)
+            for n, item in enumerate(self._items):
+                _index_item(self.index, item, n, None)
+        else:
+            self._file = open(filepath, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.meta = self.index['meta']
+        self._users = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._mmap.close()
+            self._file.close()
+
+    def __len__(self):
+        return len(self.index['items'])
+
+    def __contains__(self, tweet_id):
+        return tweet_id in self.index['items'] or tweet_id in self.index['replies']
+
+    def ids(self):
+        """IDs de los tweets principales en orden del archivo"""
+        return list(self.index['items'])
+
+    def header(self):
+        """Campos del dataset fuera de 'tweets' que preceden a la lista (query, modo, users, ...)"""
+        if self._items is not None:
+            return self._header
+        return json.loads(self._mmap[:self.index['header_end']] + b']}')
+
+    def _decode(self, tweet_id):
+        offset, length = self.index['items'][tweet_id]
+        if self._items is not None:
+            item = self._items[offset]
+        else:
+            item = json.loads(self._mmap[offset:offset + length])
+        if self.meta.get('normalized'):
+            if self._users is None:
+                self._users = self.header().get('users', {})
+            item = denormalize_users({'tweets': [item], 'users': self._users})['tweets'][0]
+        return item
+
+    def get(self, tweet_id):
+        """
+        Hilo que contiene un tweet o respuesta
+
+        Returns:
+            Elemento {'tweet': ..., 'replies': [...]} o None si el id no está
+        """
+        parent_id = tweet_id if tweet_id in self.index['items'] else self.index['replies'].get(tweet_id)
+        return self._decode(parent_id) if parent_id else None
+
+    def get_tweet(self, tweet_id):
+        """Tweet o respuesta concretos (None si el id no está)"""
+        item = self.get(tweet_id)
+        if item is None:
+            return None
+        if item['tweet'].get('id') == tweet_id:
+            return item['tweet']
+        return next((r for r in item.get('replies', []) if r.get('id') == tweet_id), None)
+
+    def items(self):
+        """Recorre los elementos en orden decodificando uno a uno"""
+        for tweet_id in self.index['items']:
+            yield self._decode(tweet_id)
+
+
 def find_incomplete_downloads():
     """
     Busca archivos JSON con status 'in_progress' en la carpeta scraping/
 
+    Los datasets con índice de offsets se consultan por sus metadatos, sin
+    cargar el archivo; el dataset elegido se carga después con load_dataset.
+
     Returns:
         Lista de diccionarios con info de archivos incompletos
     """
@@ -89,528 +629,4708 @@ def find_incomplete_downloads():
         if filename.endswith('.json'):
             filepath = os.path.join(scraping_dir, filename)
             try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
+                # Con índice de offsets al día basta con sus metadatos
+                index = load_offset_index(filepath, rebuild=False)
+                if index:
+                    data = index['meta']
+                    oldest_date = data['oldest_date']
+                else:
+                    data, source = load_dataset(filepath)
+                    if source != filepath:
+                        print(f"⚠️  {filename} corrupto, usando respaldo: {os.path.basename(source)}")
 
-                if data.get('status') == 'in_progress':
                     # Extraer fecha del tweet más antiguo
                     oldest_date = None
-                    if data.get('tweets'):
-                        for item in data['tweets']:
-                            tweet = item.get('tweet', {})
-                            tweet_date = tweet.get('time_parsed', '')
-                            if tweet_date:
-                                if not oldest_date or tweet_date < oldest_date:
-                                    oldest_date = tweet_date
+                    for item in data.get('tweets') or []:
+                        tweet = item.get('tweet', {})
+                        tweet_date = tweet.get('time_parsed', '')
+                        if tweet_date:
+                            if not oldest_date or tweet_date < oldest_date:
+                                oldest_date = tweet_date
 
+                if data.get('status') == 'in_progress':
                     incomplete.append({
                         'filename': filename,
                         'filepath': filepath,
-                        'query': data.get('query', 'Unknown'),
-                        'mode': data.get('mode', 'latest'),
-                        'total_tweets': data.get('total_main_tweets', 0),
-                        'downloaded_at': data.get('downloaded_at', ''),
+                        'query': data.get('query') or 'Unknown',
+                        'mode': data.get('mode') or 'latest',
+                        'total_tweets': data.get('total_main_tweets') or 0,
+                        'downloaded_at': data.get('downloaded_at') or '',
                         'oldest_date': oldest_date,
-                        'search_type': data.get('search_type', 'hashtag'),
-                        'data': data
+                        'search_type': data.get('search_type') or 'hashtag'
                     })
             except Exception as e:
+                print(f"⚠️  Se omite {filename}: {e}")
                 continue
 
     return incomplete
 
-class TwitterHashtagScraper:
-    def __init__(self):
-        self.api_key = os.getenv('RAPIDAPI_KEY')
-        self.api_host = os.getenv('RAPIDAPI_HOST')
+class CheckpointPolicy:
+    """
+    Decide cuándo escribir un checkpoint durante la descarga
 
-        if not self.api_key or not self.api_host:
-            raise ValueError("RAPIDAPI_KEY y RAPIDAPI_HOST deben estar definidos en .env")
+    Se dispara en cuanto se cumple cualquiera de los umbrales configurados
+    (tiempo, elementos nuevos o MB nuevos). Sin umbrales, guarda en cada
+    oportunidad (después de cada página y de cada tweet con respuestas).
+    También acumula el coste de los checkpoints para poder reportarlo.
+    """
 
-        self.base_url = f"https://{self.api_host}/v1"
-        self.headers = {
-            'X-RapidAPI-Key': self.api_key,
-            'X-RapidAPI-Host': self.api_host
-        }
+    def __init__(self, every_seconds=None, every_items=None, every_mb=None):
+        """
+        Args:
+            every_seconds: Guardar si han pasado N segundos desde el último checkpoint
+            every_items: Guardar tras N elementos nuevos (tweets o respuestas)
+            every_mb: Guardar tras N MB de datos nuevos
+        """
+        self.every_seconds = every_seconds
+        self.every_items = every_items
+        self.every_mb = every_mb
 
-        print(f"Conectando a: {self.api_host}")
-        print(f"API Key: {self.api_key[:10]}...{self.api_key[-4:]}")
-        print()
+        self.pending_items = 0
+        self.pending_bytes = 0
+        self.last_checkpoint = time.monotonic()
+
+        self.checkpoints = 0
+        self.overhead_seconds = 0.0
+        self.bytes_written = 0
 
-    def search_tweets(self, query, mode='latest', max_tweets=None, is_hashtag=True, until_date=None, since_date=None, incremental_save=False, partial_filename=None):
+    @classmethod
+    def from_env(cls):
         """
-        Busca tweets por hashtag o texto
+        Crea la política a partir de CHECKPOINT_EVERY_SECONDS, CHECKPOINT_EVERY_ITEMS
+        y CHECKPOINT_EVERY_MB. Sin variables definidas: cada 5 elementos nuevos
+        """
+        every_seconds = os.getenv('CHECKPOINT_EVERY_SECONDS')
+        every_items = os.getenv('CHECKPOINT_EVERY_ITEMS')
+        every_mb = os.getenv('CHECKPOINT_EVERY_MB')
+
+        if not (every_seconds or every_items or every_mb):
+            return cls(every_items=5)
+
+        return cls(
+            every_seconds=float(every_seconds) if every_seconds else None,
+            every_items=int(every_items) if every_items else None,
+            every_mb=float(every_mb) if every_mb else None
+        )
+
+    @property
+    def tracks_bytes(self):
+        """True si la política necesita conocer el tamaño de los datos nuevos"""
+        return self.every_mb is not None
+
+    def record(self, items=0, nbytes=0):
+        """Registra elementos (y bytes) descargados desde el último checkpoint"""
+        self.pending_items += items
+        self.pending_bytes += nbytes
+
+    def due(self):
+        """Indica si toca escribir un checkpoint"""
+        if self.pending_items == 0:
+            return False
+
+        if self.every_seconds is None and self.every_items is None and self.every_mb is None:
+            return True
+
+        if self.every_seconds is not None and time.monotonic() - self.last_checkpoint >= self.every_seconds:
+            return True
+        if self.every_items is not None and self.pending_items >= self.every_items:
+            return True
+        if self.every_mb is not None and self.pending_bytes >= self.every_mb * 1024 * 1024:
+            return True
+
+        return False
+
+    def mark(self, elapsed, nbytes_written):
+        """Registra un checkpoint escrito y reinicia los contadores pendientes"""
+        self.checkpoints += 1
+        self.overhead_seconds += elapsed
+        self.bytes_written += nbytes_written
+        self.pending_items = 0
+        self.pending_bytes = 0
+        self.last_checkpoint = time.monotonic()
+
+    def summary(self, total_seconds=None):
+        """
+        Resumen del coste de los checkpoints
 
         Args:
-            query: El término a buscar (hashtag o texto)
-            mode: Modo de búsqueda ('top', 'latest', 'photos', 'videos')
-            max_tweets: Número máximo de tweets a descargar (None = todos disponibles)
-            is_hashtag: Si True, agrega # si no lo tiene. Si False, busca como texto
-            until_date: Fecha límite superior (más reciente) - formato: YYYY-MM-DD
-            since_date: Fecha límite inferior (más antigua) - formato: YYYY-MM-DD
-            incremental_save: Si True, guarda después de cada página
-            partial_filename: Nombre del archivo para guardado incremental
+            total_seconds: Duración total de la descarga, para calcular el porcentaje
 
         Returns:
-            Lista de tweets
+            Diccionario con número de checkpoints, segundos y MB escritos
         """
-        # Procesar query según el tipo de búsqueda
-        if is_hashtag and not query.startswith('#'):
-            search_query = f'#{query}'
-        else:
-            search_query = query
+        summary = {
+            'checkpoints': self.checkpoints,
+            'overhead_seconds': round(self.overhead_seconds, 3),
+            'mb_written': round(self.bytes_written / (1024 * 1024), 2)
+        }
+        if total_seconds:
+            summary['overhead_percent'] = round(100 * self.overhead_seconds / total_seconds, 2)
+        return summary
 
-        all_tweets = []
-        cursor = None
-        tweet_count = 0
-        page_count = 0
-        oldest_date = None
-        newest_date = None
 
-        # Convertir fechas a timestamp si están presentes
-        until_timestamp = None
-        since_timestamp = None
-        if until_date:
-            from datetime import datetime as dt
-            until_timestamp = int(dt.strptime(until_date, '%Y-%m-%d').timestamp())
-        if since_date:
-            from datetime import datetime as dt
-            since_timestamp = int(dt.strptime(since_date, '%Y-%m-%d').timestamp())
+class ReplyFetchPlanner:
+    """
+    Decide para qué tweets merece la pena pedir respuestas
+
+    La búsqueda ya trae el número de respuestas de cada tweet (campo
+    'replies'), así que los tweets con 0 respuestas se omiten sin hacer
+    ninguna petición. Admite umbrales de engagement, un top-K y un
+    presupuesto máximo de peticiones de respuestas por ejecución. Con un
+    EngagementTracker (refresh) los hilos ya descargados solo se vuelven a
+    pedir si su número de respuestas ha crecido.
+    """
 
-        print(f"Buscando tweets para: {search_query}")
-        print(f"Modo: {mode}")
-        if since_date and until_date:
-            print(f"Rango de fechas: desde {since_date} hasta {until_date}")
-        elif until_date:
-            print(f"Hasta fecha: {until_date}")
-        elif since_date:
-            print(f"Desde fecha: {since_date}")
-        print("-" * 50)
+    def __init__(self, min_replies=1, min_likes=None, top_k=None, request_budget=None, refresh=None):
+        """
+        Args:
+            min_replies: Mínimo de respuestas reportadas para pedirlas (tweets sin el
+                campo 'replies' se piden siempre)
+            min_likes: Mínimo de likes del tweet principal
+            top_k: Solo los K tweets con más engagement (likes + retweets + respuestas)
+            request_budget: Máximo de peticiones de respuestas en la ejecución (None = sin límite)
+            refresh: EngagementTracker con el estado de los hilos ya descargados (opcional)
+        """
+        self.min_replies = min_replies
+        self.min_likes = min_likes
+        self.top_k = top_k
+        self.request_budget = request_budget
+        self.refresh = refresh
+
+        self.requests_used = 0
+        self.fetched = 0
+        self.skipped = 0
+        self.unchanged = 0
+        self.fetched_ids = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def engagement(tweet):
+        """Puntuación de engagement para ordenar tweets"""
+        return (tweet.get('likes') or 0) + (tweet.get('retweets') or 0) + (tweet.get('replies') or 0)
+
+    def plan(self, tweets):
+        """
+        Selecciona los tweets cuyas respuestas se van a descargar
 
-        while True:
-            # Verificar si se debe detener
-            global should_stop
-            if should_stop:
-                print("\n⚠️  Descarga interrumpida por el usuario")
-                break
+        Args:
+            tweets: Lista de tweets principales
 
-            # Preparar parámetros
-            params = {
-                'query': search_query,
-                'mode': mode
-            }
+        Returns:
+            Conjunto de IDs seleccionados
+        """
+        candidates = []
+        for tweet in tweets:
+            reply_count = tweet.get('replies')
+            if self.min_replies and isinstance(reply_count, int) and reply_count < self.min_replies:
+                continue
+            if self.min_likes is not None and (tweet.get('likes') or 0) < self.min_likes:
+                continue
+            if self.refresh is not None and not self.refresh.needs_refetch(tweet):
+                self.unchanged += 1
+                continue
+            candidates.append(tweet)
 
-            if cursor:
-                params['cursor'] = cursor
+        if self.top_k is not None:
+            candidates = sorted(candidates, key=self.engagement, reverse=True)[:self.top_k]
 
-            try:
-                # Hacer la petición
-                response = requests.get(
-                    f"{self.base_url}/search/tweets",
-                    headers=self.headers,
-                    params=params
-                )
+        return {t.get('id') for t in candidates if t.get('id')}
 
-                response.raise_for_status()
-                data = response.json()
+    def remaining_requests(self):
+        """Peticiones que quedan en el presupuesto (None = sin límite)"""
+        if self.request_budget is None:
+            return None
+        return max(0, self.request_budget - self.requests_used)
 
-                # Extraer tweets (la API devuelve en data.tweets)
-                if 'data' in data and 'tweets' in data['data']:
-                    tweets = data['data']['tweets']
-                    cursor = data['data'].get('cursor')
-                else:
-                    tweets = data.get('tweets', [])
+    def has_budget(self):
+        """True si queda presupuesto para al menos una petición"""
+        remaining = self.remaining_requests()
+        return remaining is None or remaining > 0
 
-                if not tweets:
-                    print("No se encontraron más tweets.")
-                    break
+    def try_charge(self):
+        """
+        Reserva una petición del presupuesto (seguro entre hilos)
 
-                # Filtrar tweets por rango de fechas si está configurado
-                filtered_tweets = []
-                stop_pagination = False
-
-                page_count += 1
-                for tweet in tweets:
-                    tweet_date = tweet.get('time_parsed', '')
-                    tweet_timestamp = tweet.get('timestamp', 0)
-
-                    # Actualizar fechas más antigua y más nueva
-                    if not oldest_date or (tweet_date and tweet_date < oldest_date):
-                        oldest_date = tweet_date
-                    if not newest_date or (tweet_date and tweet_date > newest_date):
-                        newest_date = tweet_date
-
-                    # Verificar si el tweet está dentro del rango de fechas
-                    if since_timestamp and tweet_timestamp < since_timestamp:
-                        # Ya pasamos la fecha inferior, detener paginación
-                        print(f"\nAlcanzada la fecha límite inferior: {since_date}")
-                        stop_pagination = True
-                        break
+        Returns:
+            True si había presupuesto y se ha descontado
+        """
+        with self.lock:
+            if self.request_budget is not None and self.requests_used >= self.request_budget:
+                return False
+            self.requests_used += 1
+            return True
+
+    def summary(self):
+        """Resumen de la planificación para el dataset"""
+        return {
+            'fetched': self.fetched,
+            'skipped': self.skipped,
+            'unchanged': self.unchanged,
+            'requests_used': self.requests_used,
+            'request_budget': self.request_budget
+        }
 
-                    # Filtrar según el rango
-                    if until_timestamp and tweet_timestamp > until_timestamp:
-                        # Tweet más reciente que el límite superior, saltarlo
-                        continue
 
-                    if since_timestamp and tweet_timestamp < since_timestamp:
-                        # Tweet más antiguo que el límite inferior, saltarlo
-                        continue
+# Coste relativo de evaluar cada columna: las condiciones baratas se comprueban primero
+CONDITION_COST = {'lang': 1, 'text': 2}
 
-                    # Tweet dentro del rango (o sin filtros)
-                    filtered_tweets.append(tweet)
 
-                all_tweets.extend(filtered_tweets)
-                tweet_count = len(all_tweets)
+class TweetFilter:
+    """
+    Filtro de tweets componible con evaluación en cortocircuito
 
-                if stop_pagination:
-                    print(f"Total descargado: {tweet_count} tweets en el rango especificado")
-                    break
+    Las condiciones se ordenan de la más barata (contadores, verificado,
+    multimedia) a la más cara (idioma, regex) y cada una se evalúa solo sobre
+    los tweets que han pasado las anteriores, así una condición selectiva
+    como min_likes deja poco trabajo a la regex. Los filtros se combinan
+    con & (todas las condiciones deben cumplirse).
 
-                print(f"Página {page_count}: {len(filtered_tweets)} tweets añadidos de {len(tweets)} | Total: {tweet_count} tweets | Más antiguo: {oldest_date[:10] if oldest_date else 'N/A'}")
-
-                # Guardado incremental después de cada página
-                if incremental_save and partial_filename and len(filtered_tweets) > 0:
-                    partial_data = {
-                        'query': query,
-                        'search_type': 'hashtag' if is_hashtag else 'text',
-                        'mode': mode,
-                        'downloaded_at': datetime.now().isoformat(),
-                        'status': 'in_progress',
-                        'total_main_tweets': tweet_count,
-                        'tweets': [{'tweet': t, 'replies': []} for t in all_tweets]
-                    }
-                    scraping_dir = 'scraping'
-                    if not os.path.exists(scraping_dir):
-                        os.makedirs(scraping_dir)
-                    filepath = os.path.join(scraping_dir, partial_filename)
-                    with open(filepath, 'w', encoding='utf-8') as f:
-                        json.dump(partial_data, f, ensure_ascii=False, indent=2)
-                    print(f"  💾 Guardado incremental: {tweet_count} tweets")
+    Ejemplo:
+        TweetFilter(min_likes=10) & TweetFilter(lang='es', has_media=True)
+    """
 
-                # Verificar si llegamos al máximo
-                if max_tweets and tweet_count >= max_tweets:
-                    all_tweets = all_tweets[:max_tweets]
-                    print(f"\nAlcanzado el límite de {max_tweets} tweets")
-                    break
+    def __init__(self, min_likes=None, min_retweets=None, min_views=None, verified_only=False,
+                 since_date=None, until_date=None, lang=None, has_media=None, text_regex=None):
+        """
+        Args:
+            min_likes: Mínimo de likes
+            min_retweets: Mínimo de retweets
+            min_views: Mínimo de visualizaciones
+            verified_only: Solo usuarios verificados (legacy o insignia azul)
+            since_date: Fecha mínima (incluida) - formato: YYYY-MM-DD o YYYY-MM-DD HH:MM
+            until_date: Fecha máxima (excluida) - mismo formato
+            lang: Código de idioma o lista de códigos aceptados
+            has_media: True = solo con fotos/vídeos/gifs, False = solo sin multimedia
+            text_regex: Expresión regular que debe aparecer en el texto (sin distinguir mayúsculas)
+        """
+        # Cada condición: (columna, operación, valor)
+        self.conditions = []
+        self._compiled = {}
+        if min_likes is not None:
+            self.conditions.append(('likes', 'ge', min_likes))
+        if min_retweets is not None:
+            self.conditions.append(('retweets', 'ge', min_retweets))
+        if min_views is not None:
+            self.conditions.append(('views', 'ge', min_views))
+        if verified_only:
+            self.conditions.append(('verified', 'eq', True))
+        if since_date:
+            self.conditions.append(('timestamp', 'ge', parse_date_limit(since_date)))
+        if until_date:
+            self.conditions.append(('timestamp', 'lt', parse_date_limit(until_date)))
+        if lang:
+            self.conditions.append(('lang', 'in', {lang} if isinstance(lang, str) else set(lang)))
+        if has_media is not None:
+            self.conditions.append(('has_media', 'eq', bool(has_media)))
+        if text_regex:
+            self.conditions.append(('text', 'regex', re.compile(text_regex, re.IGNORECASE)))
+
+    def __and__(self, other):
+        combined = TweetFilter()
+        combined.conditions = self.conditions + (other.conditions if other else [])
+        return combined
+
+    def __bool__(self):
+        return bool(self.conditions)
+
+    # Expresión de cada condición sobre el tweet t; {v} es el valor de la condición
+    # (las de tipo 'eq' son la expresión del campo booleano, negada si el valor es False)
+    CONDITION_SOURCE = {
+        ('likes', 'ge'): "(t.get('likes') or 0) >= {v}",
+        ('retweets', 'ge'): "(t.get('retweets') or 0) >= {v}",
+        ('views', 'ge'): "int(t.get('views') or 0) >= {v}",
+        ('timestamp', 'ge'): "(t.get('timestamp') or 0) >= {v}",
+        ('timestamp', 'lt'): "(t.get('timestamp') or 0) < {v}",
+        ('verified', 'eq'): "t.get('is_verified') or t.get('is_blue_verified')",
+        ('has_media', 'eq'): "t.get('photos') or t.get('videos') or t.get('gifs')",
+        ('lang', 'in'): "(t.get('lang') or '') in {v}",
+        ('text', 'regex'): "{v}(t.get('text') or '') is not None",
+    }
+
+    def _selector(self, items):
+        """
+        Función que filtra una lista en una sola pasada con las condiciones en cortocircuito
 
-                # Cursor ya se extrajo arriba junto con tweets
+        Las condiciones se unen con 'and' en una única comprensión de lista
+        (compilada una vez y reutilizada mientras no cambien), de la más barata
+        a la más cara: cuesta lo mismo que un bucle escrito a mano y la regex
+        solo se evalúa sobre los tweets que pasan el resto.
 
-                if not cursor:
-                    print("No hay más páginas disponibles.")
-                    break
+        Args:
+            items: Si True, la lista es de elementos {'tweet': ..., 'replies': [...]}
+        """
+        cached = self._compiled.get(items)
+        if cached and cached[0] == self.conditions:
+            return cached[1]
+
+        namespace = {}
+        tests = []
+        ordered = sorted(self.conditions, key=lambda condition: CONDITION_COST.get(condition[0], 0))
+        for n, (column, op, value) in enumerate(ordered):
+            test = self.CONDITION_SOURCE[column, op]
+            if op == 'eq':
+                tests.append(test if value else f'not ({test})')
+                continue
+            namespace[f'v{n}'] = value.search if op == 'regex' else value
+            tests.append(test.format(v=f'v{n}'))
+        source = ' and '.join(f'({test})' for test in tests) or 'True'
+        loop = "row for row in rows for t in (row['tweet'],)" if items else "t for t in rows"
+        selector = eval(f"lambda rows: [{loop} if {source}]", namespace)
+        self._compiled[items] = (list(self.conditions), selector)
+        return selector
 
-                # Pequeña pausa para no saturar la API
-                time.sleep(1)
+    def apply(self, tweets):
+        """Devuelve los tweets que pasan el filtro"""
+        return self._selector(False)(tweets)
 
-            except requests.exceptions.HTTPError as e:
-                print(f"\n❌ Error HTTP: {e}")
-                print(f"Respuesta: {response.text}")
+    def apply_items(self, items):
+        """Como apply, pero sobre elementos {'tweet': ..., 'replies': [...]}"""
+        return self._selector(True)(items)
 
-                if response.status_code == 403:
-                    print("\n⚠️  PROBLEMA DE SUSCRIPCIÓN:")
-                    print("   Tu API key no está suscrita a esta API en RapidAPI.")
-                    print("   Pasos para solucionarlo:")
-                    print("   1. Ve a: https://rapidapi.com/omarmhaimdat/api/twitter-api45")
-                    print("   2. Suscríbete a un plan (hay planes gratuitos)")
-                    print("   3. Actualiza tu API key en .env si es necesario")
 
-                break
-            except Exception as e:
-                print(f"❌ Error: {e}")
-                break
+class HeavyHitters:
+    """
+    Top-K aproximado con memoria acotada (algoritmo Space-Saving)
 
-        return all_tweets
+    Mantiene como máximo `capacity` contadores. Cuando llega una clave nueva
+    y no hay hueco, reemplaza la de menor conteo heredando su valor, de modo
+    que las claves frecuentes nunca se pierden y el error está acotado.
 
-    def get_tweet_replies(self, tweet_id):
-        """
-        Obtiene las respuestas de un tweet específico
+    El mínimo se localiza con un montículo de (conteo, clave) con invalidación
+    perezosa: cada actualización añade una entrada y las obsoletas (conteo
+    distinto del actual) se descartan al buscar el mínimo. El montículo se
+    reconstruye cuando dobla el número de contadores, así que cada add() cuesta
+    O(log capacity) amortizado.
+    """
 
-        Args:
-            tweet_id: ID del tweet
+    def __init__(self, capacity=200):
+        self.capacity = capacity
+        self.counts = {}
+        self._heap = []
 
-        Returns:
-            Lista de respuestas
-        """
-        all_replies = []
-        cursor = None
+    def _push(self, key):
+        heapq.heappush(self._heap, (self.counts[key], key))
+        if len(self._heap) > 2 * self.capacity + 16:
+            self._heap = [(count, k) for k, count in self.counts.items()]
+            heapq.heapify(self._heap)
 
+    def _pop_smallest(self):
         while True:
-            # Verificar si se debe detener
+            count, key = heapq.heappop(self._heap)
+            if self.counts.get(key) == count:
+                return key
+
+    def add(self, key, count=1):
+        if key in self.counts:
+            self.counts[key] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = count
+        else:
+            smallest = self._pop_smallest()
+            self.counts[key] = self.counts.pop(smallest) + count
+        self._push(key)
+
+    def top(self, k):
+        """Lista de (clave, conteo) de las k claves más frecuentes"""
+        return sorted(self.counts.items(), key=lambda kv: kv[1], reverse=True)[:k]
+
+
+class TimeHistogram:
+    """
+    Histograma de volumen por intervalos fijos con número máximo de intervalos
+
+    Si se superan `max_bins`, se descartan los intervalos más antiguos.
+    """
+
+    def __init__(self, bin_seconds=3600, max_bins=24 * 30):
+        self.bin_seconds = bin_seconds
+        self.max_bins = max_bins
+        self.bins = {}
+
+    def add(self, timestamp, count=1):
+        if not timestamp:
+            return
+        start = timestamp - timestamp % self.bin_seconds
+        self.bins[start] = self.bins.get(start, 0) + count
+        if len(self.bins) > self.max_bins:
+            del self.bins[min(self.bins)]
+
+    def as_dict(self):
+        """Intervalos ordenados con clave ISO 8601 (UTC)"""
+        return {
+            time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(start)): self.bins[start]
+            for start in sorted(self.bins)
+        }
+
+
+class StreamingAggregator:
+    """
+    Estadísticas de la conversación calculadas a medida que llegan los datos
+
+    Top usuarios y hashtags (HeavyHitters), totales de engagement e
+    histograma de volumen por hora (TimeHistogram). Memoria acotada e
+    independiente del tamaño del dataset; seguro entre hilos.
+    """
+
+    def __init__(self, top_k=20, capacity=500, bin_seconds=3600, max_bins=24 * 30):
+        """
+        Args:
+            top_k: Número de usuarios/hashtags a reportar
+            capacity: Contadores mantenidos por cada top-K (mayor = más preciso)
+            bin_seconds: Tamaño de cada intervalo del histograma
+            max_bins: Intervalos máximos del histograma
+        """
+        self.top_k = top_k
+        self.users = HeavyHitters(capacity)
+        self.hashtags = HeavyHitters(capacity)
+        self.histogram = TimeHistogram(bin_seconds, max_bins)
+        self.totals = {'tweets': 0, 'replies': 0, 'likes': 0, 'retweets': 0, 'views': 0, 'reported_replies': 0}
+        self.lock = threading.Lock()
+
+    def add_tweets(self, tweets, kind='tweet'):
+        """
+        Incorpora un lote de tweets (una página) o de respuestas
+
+        Args:
+            tweets: Lista de tweets
+            kind: 'tweet' para tweets principales, 'reply' para respuestas
+        """
+        with self.lock:
+            self.totals['tweets' if kind == 'tweet' else 'replies'] += len(tweets)
+            for tweet in tweets:
+                self.totals['likes'] += tweet.get('likes') or 0
+                self.totals['retweets'] += tweet.get('retweets') or 0
+                self.totals['views'] += int(tweet.get('views') or 0)
+                self.totals['reported_replies'] += tweet.get('replies') or 0
+
+                if tweet.get('username'):
+                    self.users.add(tweet['username'])
+                for hashtag in tweet.get('hashtags') or []:
+                    self.hashtags.add(hashtag.lower())
+                self.histogram.add(tweet.get('timestamp'))
+
+    def add_items(self, items):
+        """
+        Incorpora elementos ya agrupados del dataset ({'tweet': ..., 'replies': [...]})
+
+        Args:
+            items: Lista de elementos de conversation['tweets']
+
+        Returns:
+            El propio agregador, para encadenar summary()
+        """
+        self.add_tweets([item['tweet'] for item in items])
+        for item in items:
+            self.add_tweets(item.get('replies', []), kind='reply')
+        return self
+
+    def summary(self):
+        """Diccionario con las estadísticas para guardar en el dataset"""
+        with self.lock:
+            return {
+                'totals': dict(self.totals),
+                'top_users': self.users.top(self.top_k),
+                'top_hashtags': self.hashtags.top(self.top_k),
+                'volume_per_hour': self.histogram.as_dict()
+            }
+
+
+# Longitud máxima de una consulta combinada (el límite de la búsqueda de X es ~500
+# caracteres; se deja margen para los operadores since:/until:)
+MAX_QUERY_LENGTH = 450
+
+
+def combine_terms(terms, is_hashtag=True):
+    """
+    Une varios términos en una sola consulta con OR
+
+    Args:
+        terms: Lista de términos
+        is_hashtag: Si True, agrega # a los términos que no lo tengan
+
+    Returns:
+        Consulta combinada, p. ej. '(#python OR #rust OR (machine learning))'
+    """
+    parts = []
+    for term in terms:
+        part = f'#{term}' if is_hashtag and not term.startswith('#') else term
+        if ' ' in part and not (part.startswith('"') and part.endswith('"')):
+            part = f'({part})'
+        parts.append(part)
+    return parts[0] if len(parts) == 1 else '(' + ' OR '.join(parts) + ')'
+
+
+def batch_queries(terms, is_hashtag=True, max_length=MAX_QUERY_LENGTH):
+    """
+    Agrupa términos en consultas OR que no superan max_length caracteres
+
+    Returns:
+        Lista de lotes (cada lote es una lista de términos)
+    """
+    batches = []
+    current = []
+    for term in terms:
+        if current and len(combine_terms(current + [term], is_hashtag)) > max_length:
+            batches.append(current)
+            current = []
+        current.append(term)
+    if current:
+        batches.append(current)
+    return batches
+
+
+# Bytes máximos del término en los nombres de archivo (el límite del sistema es 255)
+MAX_FILENAME_QUERY_BYTES = 100
+
+
+def query_filename(query):
+    """
+    Parte del nombre de archivo que identifica una búsqueda ({esto}_{fecha}.json)
+
+    Las consultas combinadas (batch_queries) y los términos demasiado largos
+    se reducen al primer término más un hash estable de la consulta completa,
+    así el nombre nunca pasa del límite del sistema de archivos.
+
+    Args:
+        query: Término o consulta combinada
+
+    Returns:
+        Texto sin '#' ni espacios apto para el nombre de archivo
+    """
+    clean = query.replace('#', '').replace(' ', '_')
+    combined = query.startswith('(') and ' OR ' in query
+    if not combined and len(clean.encode('utf-8')) <= MAX_FILENAME_QUERY_BYTES:
+        return clean
+    digest = hashlib.sha1(query.encode('utf-8')).hexdigest()[:10]
+    first = re.findall(r'[^\s()#"]+', query)[0] if combined else clean
+    first = first.encode('utf-8')[:MAX_FILENAME_QUERY_BYTES // 2].decode('utf-8', 'ignore')
+    return f"{first}_OR_{digest}" if combined else f"{first}_{digest}"
+
+
+def term_matcher(term, is_hashtag=True):
+    """
+    Función que indica si un tweet corresponde a un término de una consulta combinada
+
+    Los hashtags se buscan en el campo 'hashtags' y en el texto; las frases
+    entre comillas, literalmente; el resto de textos, palabra por palabra
+    (como hace la búsqueda de X sin comillas). Sin distinguir mayúsculas.
+
+    Returns:
+        Función tweet -> bool
+    """
+    def word(value):
+        return re.compile(r'(?<!\w)' + re.escape(value) + r'(?!\w)', re.IGNORECASE)
+
+    if is_hashtag or term.startswith('#'):
+        tag = term.lstrip('#').lower()
+        pattern = word(f'#{tag}')
+        return lambda tweet: (tag in {h.lstrip('#').lower() for h in tweet.get('hashtags') or []}
+                              or bool(pattern.search(tweet.get('text') or '')))
+
+    if len(term) > 1 and term.startswith('"') and term.endswith('"'):
+        patterns = [word(term[1:-1])]
+    else:
+        patterns = [word(w) for w in term.split()]
+    return lambda tweet: all(p.search(tweet.get('text') or '') for p in patterns)
+
+
+def demux_conversation(conversation, terms, is_hashtag=True):
+    """
+    Reparte una conversación de una consulta combinada en un dataset por término
+
+    Un tweet que coincide con varios términos aparece en todos sus datasets
+    (con sus respuestas, descargadas una sola vez).
+
+    Args:
+        conversation: Resultado de download_full_conversation con la consulta combinada
+        terms: Términos del lote
+        is_hashtag: Tipo de búsqueda de los términos
+
+    Returns:
+        Tupla (lista de conversaciones por término, elementos sin término asignado)
+    """
+    matchers = [(term, term_matcher(term, is_hashtag)) for term in terms]
+    per_term = {term: [] for term in terms}
+    unmatched = []
+    for item in conversation['tweets']:
+        hits = [term for term, matches in matchers if matches(item['tweet'])]
+        for term in hits:
+            per_term[term].append(item)
+        if not hits:
+            unmatched.append(item)
+
+    results = []
+    for term in terms:
+        items = per_term[term]
+        total_replies = sum(len(item.get('replies', [])) for item in items)
+        results.append({
+            'query': term,
+            'search_type': 'hashtag' if is_hashtag else 'text',
+            'mode': conversation['mode'],
+            'downloaded_at': conversation['downloaded_at'],
+            'status': conversation.get('status', 'completed'),
+            'batched_query': conversation['query'],
+            'total_main_tweets': len(items),
+            'tweets': items,
+            'total_replies': total_replies,
+            'total_items': len(items) + total_replies,
+            'analytics': StreamingAggregator().add_items(items).summary()
+        })
+    return results, unmatched
+
+
+class ApiKeyPool:
+    """
+    Conjunto de API keys de RapidAPI con reparto de peticiones y failover
+
+    Cada key tiene su propio token bucket (límite del plan), contadores de uso
+    y la cuota restante que informa RapidAPI en las cabeceras de respuesta.
+    Cada petición se asigna a la key sana con más cuota disponible; una key
+    que recibe 429 se pone en pausa y una que recibe 403 se desactiva.
+    """
+
+    QUOTA_HEADERS = {
+        'limit': 'x-ratelimit-requests-limit',
+        'remaining': 'x-ratelimit-requests-remaining',
+        'reset': 'x-ratelimit-requests-reset'
+    }
+
+    def __init__(self, keys, requests_per_second=None, cooldown_seconds=60):
+        """
+        Args:
+            keys: Lista de API keys
+            requests_per_second: Límite de peticiones por segundo de cada key (None = sin límite)
+            cooldown_seconds: Pausa de una key tras un 429 sin cabecera Retry-After
+        """
+        self.requests_per_second = requests_per_second
+        self.cooldown_seconds = cooldown_seconds
+        self.lock = threading.Lock()
+        self.keys = [
+            {
+                'key': key,
+                'bucket': TokenBucket(requests_per_second) if requests_per_second else None,
+                'status': 'ok',
+                'cooldown_until': 0,
+                'requests': 0,
+                'errors': 0,
+                'rate_limited': 0,
+                'quota_limit': None,
+                'quota_remaining': None,
+                'quota_reset_at': None
+            }
+            for key in keys
+        ]
+
+    def total_rate(self):
+        """Peticiones por segundo agregadas de todas las keys activas (None = sin límite)"""
+        if not self.requests_per_second:
+            return None
+        return self.requests_per_second * sum(1 for state in self.keys if state['status'] != 'disabled')
+
+    def has_available(self):
+        """True si queda alguna key no desactivada"""
+        return any(state['status'] != 'disabled' for state in self.keys)
+
+    def acquire(self):
+        """
+        Elige la key para la siguiente petición (espera si todas están en pausa o sin tokens)
+
+        La espera se hace en tramos cortos que comprueban should_stop: con Ctrl+C
+        se devuelve None para que el llamador guarde su checkpoint y termine.
+        Si todas las keys están en pausa (429 o cuota agotada) se avisa una vez
+        de cuánto falta para que vuelva la primera.
+
+        Returns:
+            Estado de la key elegida (diccionario), o None si se pidió detener
+
+        Raises:
+            RuntimeError: Si todas las keys están desactivadas
+        """
+        announced = False
+        while True:
+            now = time.time()
+            with self.lock:
+                candidates = []
+                for state in self.keys:
+                    if state['status'] == 'cooldown' and now >= state['cooldown_until']:
+                        state['status'] = 'ok'
+                    if state['status'] == 'ok':
+                        candidates.append(state)
+
+                if not candidates and not self.has_available():
+                    raise RuntimeError("Todas las API keys están desactivadas (403)")
+
+                # Más cuota restante primero; a igualdad, la menos usada
+                candidates.sort(key=lambda st: (-(st['quota_remaining'] if st['quota_remaining'] is not None else float('inf')), st['requests']))
+                for state in candidates:
+                    if state['bucket'] is None or state['bucket'].try_acquire():
+                        state['requests'] += 1
+                        return state
+
+                # Sin candidatas: todas en pausa hasta la primera que se reactive
+                next_available = None if candidates else min(
+                    st['cooldown_until'] for st in self.keys if st['status'] == 'cooldown')
+
+            if should_stop:
+                return None
+            if next_available is None:
+                # Solo faltan tokens: la espera es de una fracción de segundo
+                time.sleep(0.05)
+                continue
+            if not announced:
+                wait_seconds = max(0, next_available - now)
+                print(f"⏳ Todas las API keys en pausa; la siguiente vuelve en {wait_seconds:.0f}s "
+                      f"({datetime.fromtimestamp(next_available).strftime('%H:%M:%S')})")
+                announced = True
+            time.sleep(min(0.5, max(0.01, next_available - time.time())))
+
+    def report(self, state, response):
+        """Actualiza salud y cuota de una key a partir de la respuesta recibida"""
+        with self.lock:
+            headers = {k.lower(): v for k, v in (response.headers or {}).items()}
+            if headers.get(self.QUOTA_HEADERS['remaining'], '').isdigit():
+                state['quota_remaining'] = int(headers[self.QUOTA_HEADERS['remaining']])
+            if headers.get(self.QUOTA_HEADERS['limit'], '').isdigit():
+                state['quota_limit'] = int(headers[self.QUOTA_HEADERS['limit']])
+            if headers.get(self.QUOTA_HEADERS['reset'], '').isdigit():
+                state['quota_reset_at'] = time.time() + int(headers[self.QUOTA_HEADERS['reset']])
+
+            if response.status_code == 429:
+                state['rate_limited'] += 1
+                retry_after = headers.get('retry-after', '')
+                state['status'] = 'cooldown'
+                state['cooldown_until'] = time.time() + (int(retry_after) if retry_after.isdigit() else self.cooldown_seconds)
+            elif response.status_code == 403:
+                state['errors'] += 1
+                state['status'] = 'disabled'
+            elif response.status_code >= 400:
+                state['errors'] += 1
+            elif state['quota_remaining'] == 0:
+                # Cuota agotada: pausa hasta el reinicio indicado por RapidAPI
+                reset = headers.get(self.QUOTA_HEADERS['reset'], '')
+                state['status'] = 'cooldown'
+                state['cooldown_until'] = time.time() + (int(reset) if reset.isdigit() else self.cooldown_seconds)
+
+    def quota_budget(self):
+        """
+        Cuota restante agregada de las keys activas
+
+        Returns:
+            Tupla (peticiones_restantes, segundos_hasta_reinicio), o None si
+            RapidAPI no ha informado de la cuota o de su reinicio
+        """
+        with self.lock:
+            active = [st for st in self.keys if st['status'] != 'disabled']
+            if not active or any(st['quota_remaining'] is None or st['quota_reset_at'] is None for st in active):
+                return None
+            remaining = sum(st['quota_remaining'] for st in active)
+            reset_in = max(st['quota_reset_at'] for st in active) - time.time()
+        return remaining, max(reset_in, 0)
+
+    def usage_report(self):
+        """Uso por key (la key se muestra enmascarada)"""
+        return [
+            {
+                'key': f"{state['key'][:6]}...{state['key'][-4:]}",
+                'status': state['status'],
+                'requests': state['requests'],
+                'errors': state['errors'],
+                'rate_limited': state['rate_limited'],
+                'quota_remaining': state['quota_remaining'],
+                'quota_limit': state['quota_limit']
+            }
+            for state in self.keys
+        ]
+
+    def print_usage(self):
+        """Muestra el uso de cada API key"""
+        print("\n" + "=" * 50)
+        print("USO DE API KEYS")
+        print("=" * 50)
+        for usage in self.usage_report():
+            quota = f"{usage['quota_remaining']}/{usage['quota_limit']}" if usage['quota_remaining'] is not None else 'N/A'
+            print(f"{usage['key']} [{usage['status']}] peticiones: {usage['requests']} | "
+                  f"errores: {usage['errors']} | 429: {usage['rate_limited']} | cuota restante: {quota}")
+        print("=" * 50)
+
+
+class MonitorScheduler:
+    """
+    Planificador del modo monitoreo con cadencia fija e intervalo adaptativo
+
+    Las búsquedas se disparan sobre una rejilla de tiempos fija (la duración de
+    cada descarga no desplaza la siguiente). Si una descarga se alarga más que el
+    intervalo, se saltan los huecos perdidos en lugar de encadenar búsquedas.
+
+    En modo adaptativo el intervalo se ajusta al ritmo de tweets nuevos (media
+    móvil exponencial) para que cada búsqueda traiga unos target_new tweets:
+    se acorta en picos de actividad y se alarga poco a poco cuando el tema está
+    tranquilo. Nunca baja del mínimo que permite la cuota de RapidAPI restante.
+    """
+
+    def __init__(self, interval, min_interval=None, max_interval=None, target_new=20,
+                 adaptive=True, smoothing=0.5, backoff=1.5, key_pool=None, budget_share=1):
+        """
+        Args:
+            interval: Intervalo inicial entre búsquedas (segundos)
+            min_interval: Intervalo mínimo (default: interval / 4, al menos 10 s)
+            max_interval: Intervalo máximo (default: interval * 4)
+            target_new: Tweets nuevos deseados por búsqueda
+            adaptive: Si False, el intervalo es fijo (solo se corrige la deriva)
+            smoothing: Peso de la última observación en la media del ritmo (0-1]
+            backoff: Factor máximo de crecimiento del intervalo por búsqueda
+            key_pool: ApiKeyPool del que leer la cuota restante (opcional)
+            budget_share: Número de búsquedas que comparten la cuota del pool
+        """
+        self.base_interval = interval
+        self.interval = interval
+        self.min_interval = min_interval if min_interval is not None else max(10, interval / 4)
+        self.max_interval = max_interval if max_interval is not None else interval * 4
+        self.target_new = target_new
+        self.adaptive = adaptive
+        self.smoothing = smoothing
+        self.backoff = backoff
+        self.key_pool = key_pool
+        self.budget_share = budget_share
+
+        self.rate = None               # Tweets nuevos por segundo (media móvil)
+        self.requests_per_poll = None  # Peticiones por búsqueda (media móvil)
+        self.next_fire = time.monotonic()
+        self.fired_at = None
+        self.previous_fire = None
+        self.polls = 0
+        self.skipped_slots = 0
+
+    def seconds_until_next(self):
+        """Segundos que faltan para la próxima búsqueda"""
+        return max(self.next_fire - time.monotonic(), 0)
+
+    def fire(self):
+        """Marca el inicio de una búsqueda"""
+        self.previous_fire, self.fired_at = self.fired_at, time.monotonic()
+        self.polls += 1
+
+    def _smooth(self, previous, observed):
+        if previous is None:
+            return observed
+        return self.smoothing * observed + (1 - self.smoothing) * previous
+
+    def budget_floor(self):
+        """Intervalo mínimo que permite la cuota restante (0 si no hay datos)"""
+        if not self.key_pool or not self.requests_per_poll:
+            return 0
+        # Peticiones de una ronda completa de las búsquedas que comparten el pool
+        round_requests = self.requests_per_poll * self.budget_share
+        floor = 0
+        total_rate = self.key_pool.total_rate()
+        if total_rate:
+            floor = round_requests / total_rate
+        budget = self.key_pool.quota_budget()
+        if budget:
+            remaining, reset_in = budget
+            # Repartir la cuota restante hasta el reinicio
+            floor = max(floor, round_requests * reset_in / max(remaining, 1))
+        return floor
+
+    def record(self, new_tweets, requests_used=None, saturated=False):
+        """
+        Registra el resultado de una búsqueda y programa la siguiente
+
+        Args:
+            new_tweets: Tweets nuevos obtenidos en la búsqueda
+            requests_used: Peticiones a la API consumidas por la búsqueda
+            saturated: True si la búsqueda llegó al límite de tweets (puede haber huecos)
+
+        Returns:
+            Intervalo (segundos) hasta la próxima búsqueda
+        """
+        if requests_used is not None:
+            self.requests_per_poll = self._smooth(self.requests_per_poll, requests_used)
+
+        # La primera búsqueda trae el histórico acumulado: no sirve para estimar el ritmo
+        if self.previous_fire is not None:
+            window = max(self.fired_at - self.previous_fire, 1e-6)
+            self.rate = self._smooth(self.rate, new_tweets / window)
+
+        if self.adaptive:
+            if saturated:
+                interval = self.interval / 2
+            elif self.rate:
+                interval = min(self.target_new / self.rate, self.interval * self.backoff)
+            elif self.rate == 0:
+                interval = self.interval * self.backoff
+            else:
+                interval = self.interval
+            self.interval = min(max(interval, self.min_interval), self.max_interval)
+
+        # La cuota manda sobre los límites configurados
+        interval = max(self.interval, self.budget_floor())
+
+        # Rejilla fija: la duración de la descarga no retrasa la siguiente búsqueda
+        self.next_fire += interval
+        now = time.monotonic()
+        while self.next_fire < now:
+            self.next_fire += interval
+            self.skipped_slots += 1
+        return interval
+
+    def summary(self):
+        """Resumen del planificador"""
+        return {
+            'polls': self.polls,
+            'interval_seconds': round(self.interval, 1),
+            'rate_per_minute': round(self.rate * 60, 2) if self.rate is not None else None,
+            'requests_per_poll': round(self.requests_per_poll, 1) if self.requests_per_poll is not None else None,
+            'skipped_slots': self.skipped_slots
+        }
+
+
+# Campos del autor que la API repite en cada tweet y se pueden guardar una sola vez
+USER_FIELDS = ('username', 'name')
+
+
+def normalize_users(data):
+    """
+    Extrae los datos de los autores a un mapa 'users' (user_id -> campos)
+
+    Solo pasan al mapa los campos presentes con el mismo valor en todos los
+    tweets y respuestas del autor; el resto (un nombre cambiado, un campo que
+    falta en algún tweet) se queda en cada tweet, así que denormalize_users
+    reconstruye exactamente la vista original.
+
+    Args:
+        data: Dataset con la estructura de download_full_conversation
+
+    Returns:
+        Nuevo diccionario con 'users' (no modifica data)
+    """
+    if 'users' in data:
+        return data
+
+    items = data.get('tweets', [])
+    authored = [t for item in items for t in [item['tweet'], *item.get('replies', [])] if t.get('user_id')]
+
+    users = {}
+    for tweet in authored:
+        fields = {k: tweet[k] for k in USER_FIELDS if k in tweet}
+        known = users.get(tweet['user_id'])
+        if known is None:
+            users[tweet['user_id']] = fields
+        else:
+            for k in [k for k in known if k not in fields or fields[k] != known[k]]:
+                del known[k]
+
+    def intern(tweet):
+        known = users.get(tweet.get('user_id'))
+        if not known:
+            return tweet
+        return {k: v for k, v in tweet.items() if k not in known}
+
+    tweets = [
+        dict(item, tweet=intern(item['tweet']), replies=[intern(r) for r in item.get('replies', [])])
+        for item in items
+    ]
+    return dict(data, tweets=tweets, users=users)
+
+
+def denormalize_users(data):
+    """
+    Reconstruye la vista con los datos del autor en cada tweet
+
+    Args:
+        data: Dataset, normalizado o no
+
+    Returns:
+        Dataset sin 'users' (el mismo objeto si no estaba normalizado)
+    """
+    users = data.get('users')
+    if users is None:
+        return data
+
+    def inline(tweet):
+        user = users.get(tweet.get('user_id'))
+        return {**user, **tweet} if user else tweet
+
+    tweets = [
+        dict(item, tweet=inline(item['tweet']), replies=[inline(r) for r in item.get('replies', [])])
+        for item in data.get('tweets', [])
+    ]
+    result = dict(data, tweets=tweets)
+    del result['users']
+    return result
+
+
+def load_dataset(filepath, inline=True):
+    """
+    Carga un dataset (con respaldo, ver load_checkpoint) en la vista con autores en línea
+
+    Args:
+        filepath: Ruta del JSON
+        inline: Si False, devuelve el dataset tal como está guardado
+
+    Returns:
+        Tupla (datos, ruta_leída)
+    """
+    data, source = load_checkpoint(filepath)
+    return (denormalize_users(data) if inline else data), source
+
+
+def tweet_csv_row(tweet, users=None):
+    """
+    Columnas CSV de un tweet (comunes a export_to_csv y DeltaExporter)
+
+    Args:
+        tweet: Diccionario del tweet
+        users: Mapa 'users' de un dataset normalizado (opcional)
+
+    Returns:
+        Diccionario columna -> valor
+    """
+    if users and tweet.get('user_id') in users:
+        tweet = {**users[tweet['user_id']], **tweet}
+    return {
+        'id': tweet.get('id', ''),
+        'fecha': tweet.get('time_parsed', ''),
+        'usuario': tweet.get('username', ''),
+        'nombre': tweet.get('name', ''),
+        'texto': tweet.get('text', ''),
+        'likes': tweet.get('likes', 0),
+        'retweets': tweet.get('retweets', 0),
+        'respuestas': tweet.get('replies', 0),
+        'vistas': tweet.get('views', 0),
+        'es_verificado': tweet.get('is_verified', False),
+        'url': tweet.get('permanent_url', ''),
+        'hashtags': ','.join(tweet.get('hashtags', [])) if tweet.get('hashtags') else ''
+    }
+
+
+class SeenSet:
+    """
+    Conjunto de IDs ya vistos con memoria acotada, para monitoreos de larga duración
+
+    Los IDs se guardan como enteros de 64 bits en arrays ordenados (8 bytes por
+    ID frente a los ~100 de un str en un set), repartidos en cubos por el
+    timestamp del tweet. Los cubos que quedan fuera de la ventana (respecto al
+    tweet más reciente visto) se descartan enteros, y con max_items se
+    descartan también los más antiguos al superar el techo. Lo anterior al
+    horizonte resultante se da por visto: add() lo rechaza para no volver a
+    emitir tweets antiguos.
+    """
+
+    def __init__(self, window_seconds=7 * 24 * 3600, max_items=None, buckets=8):
+        """
+        Args:
+            window_seconds: Antigüedad máxima (por timestamp del tweet) que se recuerda
+            max_items: Techo de IDs en memoria (None = solo la ventana)
+            buckets: Cubos en los que se divide la ventana (granularidad de la caducidad)
+        """
+        self.window_seconds = int(window_seconds)
+        self.bucket_seconds = max(1, self.window_seconds // buckets)
+        self.max_items = max_items
+        self.newest = None
+        self.horizon = None
+        self.expired = 0
+        self._buckets = {}  # cubo -> [array('q') ordenado, set de IDs pendientes de fusionar]
+        self._size = 0
+
+    @staticmethod
+    def _key(tweet_id):
+        """ID numérico como int64 (los no numéricos, por hash)"""
+        tweet_id = str(tweet_id)
+        if tweet_id.isdigit() and int(tweet_id) < 2 ** 63:
+            return int(tweet_id)
+        import hashlib
+        return int.from_bytes(hashlib.blake2b(tweet_id.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+    @staticmethod
+    def _compact(bucket):
+        if bucket[1]:
+            bucket[0] = array('q', sorted(chain(bucket[0], bucket[1])))
+            bucket[1].clear()
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, tweet_id):
+        key = self._key(tweet_id)
+        for ids, pending in self._buckets.values():
+            if key in pending:
+                return True
+            pos = bisect.bisect_left(ids, key)
+            if pos < len(ids) and ids[pos] == key:
+                return True
+        return False
+
+    def add(self, tweet_id, timestamp=None):
+        """
+        Registra un ID
+
+        Args:
+            tweet_id: ID del tweet o respuesta
+            timestamp: Timestamp del tweet (None = ahora)
+
+        Returns:
+            True si es nuevo; False si ya se había visto o es anterior al horizonte
+        """
+        try:
+            timestamp = int(timestamp) if timestamp else int(time.time())
+        except (TypeError, ValueError):
+            timestamp = int(time.time())
+        if self.horizon is not None and timestamp < self.horizon:
+            return False
+        if tweet_id in self:
+            return False
+
+        bucket = self._buckets.setdefault(timestamp // self.bucket_seconds, [array('q'), set()])
+        bucket[1].add(self._key(tweet_id))
+        self._size += 1
+        if len(bucket[1]) >= 4096:
+            self._compact(bucket)
+
+        if self.newest is None or timestamp > self.newest:
+            self.newest = timestamp
+            self.expire()
+        if self.max_items and self._size > self.max_items:
+            self.expire()
+        return True
+
+    def _drop_oldest(self):
+        oldest = min(self._buckets)
+        ids, pending = self._buckets.pop(oldest)
+        self._size -= len(ids) + len(pending)
+        self.expired += len(ids) + len(pending)
+        self.horizon = max(self.horizon or 0, (oldest + 1) * self.bucket_seconds)
+
+    def expire(self):
+        """Descarta los cubos fuera de la ventana y, si hace falta, los más antiguos hasta el techo"""
+        if self.newest is not None:
+            limit = self.newest - self.window_seconds
+            while self._buckets and (min(self._buckets) + 1) * self.bucket_seconds <= limit:
+                self._drop_oldest()
+            self.horizon = max(self.horizon or limit, limit)
+        # Se conserva siempre el cubo más reciente aunque supere el techo por sí solo
+        while self.max_items and self._size > self.max_items and len(self._buckets) > 1:
+            self._drop_oldest()
+
+    def memory_bytes(self):
+        """Memoria aproximada de los IDs (arrays + IDs pendientes de fusionar)"""
+        return sum(ids.itemsize * len(ids) + 64 * len(pending) for ids, pending in self._buckets.values())
+
+    def to_dict(self):
+        """Estado serializable en JSON (cada cubo como int64 little-endian en base64)"""
+        buckets = {}
+        for key, bucket in self._buckets.items():
+            self._compact(bucket)
+            ids = array('q', bucket[0])
+            if sys.byteorder == 'big':
+                ids.byteswap()
+            buckets[str(key)] = base64.b64encode(ids.tobytes()).decode('ascii')
+        return {
+            'window_seconds': self.window_seconds,
+            'bucket_seconds': self.bucket_seconds,
+            'max_items': self.max_items,
+            'newest': self.newest,
+            'horizon': self.horizon,
+            'buckets': buckets
+        }
+
+    @classmethod
+    def from_dict(cls, state, window_seconds=None, max_items=None):
+        """
+        Restaura un SeenSet guardado con to_dict
+
+        Args:
+            state: Diccionario de to_dict
+            window_seconds: Nueva ventana (None = la guardada)
+            max_items: Nuevo techo (None = el guardado)
+        """
+        seen = cls(window_seconds or state['window_seconds'],
+                   max_items if max_items is not None else state.get('max_items'))
+        seen.bucket_seconds = state['bucket_seconds']
+        seen.newest = state.get('newest')
+        seen.horizon = state.get('horizon')
+        for key, encoded in state.get('buckets', {}).items():
+            ids = array('q')
+            ids.frombytes(base64.b64decode(encoded))
+            if sys.byteorder == 'big':
+                ids.byteswap()
+            seen._buckets[int(key)] = [ids, set()]
+            seen._size += len(ids)
+        seen.expire()
+        return seen
+
+
+class DeltaExporter:
+    """
+    Exportación incremental para el modo monitoreo
+
+    Mantiene un dataset persistente por búsqueda ({query}_stream.jsonl y,
+    opcionalmente, {query}_stream.csv) y en cada iteración añade al final solo
+    los tweets y respuestas que no se habían escrito antes. El coste de cada
+    iteración es proporcional a los datos nuevos. Con rotate_hours se abre un
+    archivo nuevo por cada periodo. Los IDs exportados se recuerdan en un
+    SeenSet con ventana de tiempo, así que la memoria no crece sin límite.
+    """
+
+    def __init__(self, query, rotate_hours=None, csv_enabled=True, scraping_dir='scraping',
+                 seen_window_hours=None, seen_max_ids=None):
+        """
+        Args:
+            query: Término de búsqueda (da nombre a los archivos)
+            rotate_hours: Horas por archivo (None = un único archivo sin rotación)
+            csv_enabled: Si True, escribe también el CSV además del JSONL
+            scraping_dir: Carpeta de salida
+            seen_window_hours: Antigüedad de los tweets que se recuerdan para deduplicar
+                (None = MONITOR_SEEN_WINDOW_HOURS del .env, 168 por defecto)
+            seen_max_ids: Techo de IDs en memoria (None = MONITOR_SEEN_MAX_IDS del .env, sin techo)
+        """
+        import csv
+
+        self.csv = csv
+        self.rotate_hours = rotate_hours
+        self.csv_enabled = csv_enabled
+        self.base = os.path.join(scraping_dir, f"{query_filename(query)}_stream")
+        self.state_path = f"{self.base}.state"
+        self.csv_fields = ['tipo', 'id_padre'] + list(tweet_csv_row({}).keys())
+
+        if seen_window_hours is None:
+            seen_window_hours = float(os.getenv('MONITOR_SEEN_WINDOW_HOURS', '168'))
+        if seen_max_ids is None and os.getenv('MONITOR_SEEN_MAX_IDS'):
+            seen_max_ids = int(os.getenv('MONITOR_SEEN_MAX_IDS'))
+        window_seconds = int(seen_window_hours * 3600)
+
+        # IDs ya exportados y timestamp del tweet más reciente (persisten entre reinicios)
+        self.seen = SeenSet(window_seconds, seen_max_ids)
+        self.watermark = None
+        if os.path.exists(self.state_path):
+            try:
+                state, _ = load_checkpoint(self.state_path)
+                self.watermark = state.get('watermark')
+                if 'seen' in state:
+                    self.seen = SeenSet.from_dict(state['seen'], window_seconds, seen_max_ids)
+                else:
+                    # Estado antiguo con la lista completa de IDs: caducan a partir de la marca de agua
+                    for tweet_id in state.get('ids', []):
+                        self.seen.add(tweet_id, self.watermark)
+            except (ValueError, KeyError):
+                pass
+
+    def current_paths(self):
+        """Rutas (jsonl, csv) del periodo actual"""
+        suffix = ''
+        if self.rotate_hours:
+            period = self.rotate_hours * 3600
+            start = int(time.time() // period * period)
+            suffix = '_' + datetime.fromtimestamp(start).strftime('%Y%m%d_%H%M')
+        return f"{self.base}{suffix}.jsonl", f"{self.base}{suffix}.csv"
+
+    def write(self, conversation):
+        """
+        Añade a los archivos los tweets y respuestas nuevos de una conversación
+
+        Args:
+            conversation: Diccionario devuelto por download_full_conversation
+
+        Returns:
+            Tupla (tweets_nuevos, respuestas_nuevas)
+        """
+        records = []
+        for item in conversation['tweets']:
+            tweet = item['tweet']
+            tweet_id = tweet.get('id')
+            if tweet_id and self.seen.add(tweet_id, tweet.get('timestamp')):
+                records.append(('tweet', '', tweet))
+                if tweet.get('timestamp') and (self.watermark is None or tweet['timestamp'] > self.watermark):
+                    self.watermark = tweet['timestamp']
+            for reply in item.get('replies', []):
+                reply_id = reply.get('id')
+                if reply_id and self.seen.add(reply_id, reply.get('timestamp')):
+                    records.append(('reply', tweet_id or '', reply))
+
+        if records:
+            directory = os.path.dirname(self.base)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            jsonl_path, csv_path = self.current_paths()
+
+            with open(jsonl_path, 'a', encoding='utf-8') as f:
+                for kind, parent_id, tweet in records:
+                    f.write(json.dumps(dict(tweet, _type=kind, _parent_id=parent_id), ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+            if self.csv_enabled:
+                new_file = not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0
+                with open(csv_path, 'a', newline='', encoding='utf-8-sig' if new_file else 'utf-8') as f:
+                    writer = self.csv.DictWriter(f, fieldnames=self.csv_fields)
+                    if new_file:
+                        writer.writeheader()
+                    for kind, parent_id, tweet in records:
+                        writer.writerow(dict(tweet_csv_row(tweet), tipo=kind, id_padre=parent_id))
+
+            atomic_write_json(self.state_path, {'seen': self.seen.to_dict(), 'watermark': self.watermark})
+
+        new_tweets = sum(1 for kind, _, _ in records if kind == 'tweet')
+        return new_tweets, len(records) - new_tweets
+
+
+ENGAGEMENT_FIELDS = ('likes', 'retweets', 'replies', 'views')
+
+
+class EngagementTracker:
+    """
+    Serie temporal de engagement por tweet y planificador de refrescos de hilos
+
+    Cada búsqueda del monitoreo devuelve los contadores actuales (likes,
+    retweets, respuestas, vistas) de los tweets. Solo cuando alguno cambia se
+    añade una instantánea compacta al archivo JSONL: una lista
+    [id, timestamp, likes, retweets, replies, views, hilo_descargado]. Con el
+    número de respuestas de la última vez que se descargó cada hilo se decide
+    si hay que volver a pedirlo: solo si el contador ha crecido.
+
+    Como SeenSet, la memoria está acotada: se olvidan los tweets sin
+    instantáneas dentro de la ventana (respecto a la más reciente) y, con
+    max_items, los de actividad más antigua al superar el techo. El archivo se
+    compacta al arrancar y cuando se han olvidado tantos tweets como se
+    recuerdan, conservando solo las instantáneas de los tweets vivos.
+    """
+
+    COLUMNS = ('id', 't') + ENGAGEMENT_FIELDS + ('fetched',)
+    MIN_COMPACT_EXPIRED = 1000
+
+    def __init__(self, path, window_hours=None, max_items=None):
+        """
+        Args:
+            path: Archivo JSONL de instantáneas (se crea al registrar la primera)
+            window_hours: Horas sin instantáneas tras las que se olvida un tweet
+                (None = MONITOR_SEEN_WINDOW_HOURS del .env, 168 por defecto)
+            max_items: Techo de tweets en memoria (None = MONITOR_SEEN_MAX_IDS del .env, sin techo)
+        """
+        if window_hours is None:
+            window_hours = float(os.getenv('MONITOR_SEEN_WINDOW_HOURS', '168'))
+        if max_items is None and os.getenv('MONITOR_SEEN_MAX_IDS'):
+            max_items = int(os.getenv('MONITOR_SEEN_MAX_IDS'))
+
+        self.path = path
+        self.window_seconds = int(window_hours * 3600)
+        self.max_items = max_items
+        self.latest = {}          # id -> valores de ENGAGEMENT_FIELDS de la última instantánea
+        self.fetched_replies = {}  # id -> respuestas reportadas cuando se descargó el hilo
+        self.updated = {}         # id -> timestamp de la última instantánea (orden de actividad)
+        self.newest = None
+        self._expired = 0          # tweets olvidados desde la última compactación
+        self._lock = threading.Lock()
+
+        for row in self._rows():
+            tweet_id, values, fetched = row[0], row[2:2 + len(ENGAGEMENT_FIELDS)], row[-1]
+            self._remember(tweet_id, row[1], values, fetched)
+        self._expire()
+        if self._expired:
+            self.compact()
+
+    @property
+    def horizon(self):
+        """Timestamp a partir del cual se conservan las instantáneas (None = todavía ninguna)"""
+        return self.newest - self.window_seconds if self.newest is not None else None
+
+    def _remember(self, tweet_id, timestamp, values, fetched):
+        """Actualiza el estado en memoria de un tweet con una instantánea"""
+        self.latest[tweet_id] = values
+        if fetched:
+            self.fetched_replies[tweet_id] = values[ENGAGEMENT_FIELDS.index('replies')]
+        # Reinsertar para que self.updated quede ordenado por actividad
+        self.updated.pop(tweet_id, None)
+        self.updated[tweet_id] = timestamp
+        if self.newest is None or timestamp > self.newest:
+            self.newest = timestamp
+
+    def _expire(self):
+        """Olvida los tweets sin actividad dentro de la ventana y los más antiguos por encima del techo"""
+        limit = self.horizon
+        while self.updated:
+            tweet_id, timestamp = next(iter(self.updated.items()))
+            over_cap = self.max_items is not None and len(self.updated) > self.max_items
+            if timestamp >= limit and not over_cap:
+                break
+            del self.updated[tweet_id]
+            self.latest.pop(tweet_id, None)
+            self.fetched_replies.pop(tweet_id, None)
+            self._expired += 1
+
+    def _rows(self):
+        """Instantáneas guardadas, en orden (se ignora una última línea incompleta)"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(row, list) and len(row) == len(self.COLUMNS):
+                    yield row
+
+    def compact(self):
+        """
+        Reescribe el archivo (de forma atómica) solo con las instantáneas de los tweets recordados
+
+        De cada tweet se conservan las instantáneas dentro de la ventana y la
+        última de descarga de su hilo, aunque sea anterior, para que
+        needs_refetch() no cambie tras un reinicio.
+
+        Returns:
+            Número de instantáneas conservadas
+        """
+        if not os.path.exists(self.path):
+            self._expired = 0
+            return 0
+        limit = self.horizon
+        old_fetched, kept = {}, []
+        for row in self._rows():
+            if row[0] not in self.updated:
+                continue
+            if row[1] >= limit:
+                kept.append(row)
+            elif row[-1]:
+                old_fetched[row[0]] = row
+        rows = list(old_fetched.values()) + kept
+
+        def write(f):
+            for row in rows:
+                f.write((json.dumps(row, separators=(',', ':')) + '\n').encode('utf-8'))
+
+        _atomic_write(self.path, write)
+        self._expired = 0
+        return len(rows)
+
+    @staticmethod
+    def counters(tweet):
+        """Valores de ENGAGEMENT_FIELDS de un tweet como enteros"""
+        values = []
+        for field in ENGAGEMENT_FIELDS:
+            try:
+                values.append(int(tweet.get(field) or 0))
+            except (TypeError, ValueError):
+                values.append(0)
+        return values
+
+    def needs_refetch(self, tweet):
+        """
+        True si el hilo del tweet nunca se descargó o tiene más respuestas que entonces
+
+        Args:
+            tweet: Tweet principal devuelto por la búsqueda
+        """
+        last = self.fetched_replies.get(tweet.get('id'))
+        if last is None:
+            return True
+        reported = tweet.get('replies')
+        return isinstance(reported, int) and reported > last
+
+    def record(self, tweets, fetched_ids=(), timestamp=None):
+        """
+        Añade una instantánea por cada tweet cuyos contadores cambiaron o cuyo hilo se descargó
+
+        Args:
+            tweets: Tweets principales de la búsqueda
+            fetched_ids: IDs cuyos hilos se descargaron en esta búsqueda
+            timestamp: Momento de la instantánea (None = ahora)
+
+        Returns:
+            Número de instantáneas añadidas
+        """
+        timestamp = int(timestamp if timestamp is not None else time.time())
+        rows = []
+        with self._lock:
+            for tweet in tweets:
+                tweet_id = tweet.get('id')
+                if not tweet_id:
+                    continue
+                values = self.counters(tweet)
+                fetched = tweet_id in fetched_ids
+                if not fetched and self.latest.get(tweet_id) == values:
+                    continue
+                self._remember(tweet_id, timestamp, values, fetched)
+                rows.append([tweet_id, timestamp] + values + [int(fetched)])
+
+            if rows:
+                directory = os.path.dirname(self.path)
+                if directory and not os.path.exists(directory):
+                    os.makedirs(directory)
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    for row in rows:
+                        f.write(json.dumps(row, separators=(',', ':')) + '\n')
+
+            self._expire()
+            if self._expired >= max(self.MIN_COMPACT_EXPIRED, len(self.updated)):
+                self.compact()
+        return len(rows)
+
+    def series(self, tweet_id=None):
+        """
+        Instantáneas guardadas
+
+        Args:
+            tweet_id: Solo las de este tweet (None = todas)
+
+        Returns:
+            Diccionario {id: [ {t, likes, retweets, replies, views, fetched}, ... ]}
+        """
+        result = {}
+        for row in self._rows():
+            if tweet_id is None or row[0] == tweet_id:
+                result.setdefault(row[0], []).append(dict(zip(self.COLUMNS[1:], row[1:])))
+        return result
+
+    def top_growth(self, field='likes', window_seconds=3600, k=10, now=None):
+        """
+        Tweets que más han crecido en un contador dentro de una ventana (viralidad)
+
+        Args:
+            field: Contador de ENGAGEMENT_FIELDS
+            window_seconds: Ventana hacia atrás desde now
+            k: Número de tweets
+            now: Fin de la ventana (None = ahora)
+
+        Returns:
+            Lista de (id, crecimiento) ordenada de mayor a menor
+        """
+        now = now if now is not None else time.time()
+        column = self.COLUMNS.index(field)
+        first, last = {}, {}
+        for row in self._rows():
+            if row[1] > now:
+                continue
+            if row[1] < now - window_seconds:
+                # La última instantánea anterior a la ventana es la base
+                first[row[0]] = row[column]
+                continue
+            first.setdefault(row[0], row[column])
+            last[row[0]] = row[column]
+        growth = [(tweet_id, value - first[tweet_id]) for tweet_id, value in last.items()]
+        return sorted((g for g in growth if g[1] > 0), key=lambda g: g[1], reverse=True)[:k]
+
+
+def stream_record(tweet, kind='tweet', parent_id='', query=None):
+    """
+    Registro NDJSON de un tweet o respuesta (mismo formato que {query}_stream.jsonl)
+
+    Args:
+        tweet: Tweet o respuesta tal como lo devuelve la API
+        kind: 'tweet' o 'reply'
+        parent_id: ID del tweet principal (solo respuestas)
+        query: Búsqueda que lo descargó
+
+    Returns:
+        Diccionario con el tweet y los campos _type, _parent_id y _query
+    """
+    return dict(tweet, _type=kind, _parent_id=parent_id or '', _query=query)
+
+
+class TweetSink:
+    """
+    Destino de la salida en streaming: recibe cada tweet y respuesta en cuanto se descarga
+
+    Las subclases implementan _write(registro). Un fallo del consumidor (tubería
+    cerrada, socket desconectado) no detiene la descarga: el destino se marca
+    como cerrado y los registros siguientes se cuentan como descartados.
+    """
+
+    def __init__(self):
+        self.emitted = 0
+        self.dropped = 0
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def _write(self, record):
+        raise NotImplementedError
+
+    def emit(self, record):
+        """
+        Entrega un registro al consumidor
+
+        Args:
+            record: Diccionario creado con stream_record
+        """
+        with self._lock:
+            if self.closed:
+                self.dropped += 1
+                return
+            try:
+                self._write(record)
+                self.emitted += 1
+            except (OSError, ValueError) as e:
+                self.closed = True
+                self.dropped += 1
+                print(f"⚠️  Salida en streaming cerrada por el consumidor: {e}", file=sys.stderr)
+
+    def close(self):
+        self.closed = True
+
+    def summary(self):
+        return {'emitted': self.emitted, 'dropped': self.dropped}
+
+
+class NDJSONSink(TweetSink):
+    """Escribe un JSON por línea en un flujo de texto (stdout, archivo o tubería con nombre)"""
+
+    def __init__(self, stream, close_stream=False):
+        """
+        Args:
+            stream: Flujo de texto abierto para escritura
+            close_stream: Si True, close() cierra también el flujo
+        """
+        super().__init__()
+        self.stream = stream
+        self.close_stream = close_stream
+
+    def _write(self, record):
+        self.stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.stream.flush()
+
+    def close(self):
+        super().close()
+        if self.close_stream:
+            try:
+                self.stream.close()
+            except OSError:
+                pass
+
+
+class UnixSocketSink(TweetSink):
+    """Envía NDJSON a un socket Unix en el que escucha el consumidor (p. ej. un dashboard)"""
+
+    def __init__(self, path, timeout=None):
+        """
+        Args:
+            path: Ruta del socket Unix
+            timeout: Segundos máximos por envío (None = esperar al consumidor)
+        """
+        import socket
+
+        super().__init__()
+        self.path = path
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(path)
+
+    def _write(self, record):
+        # sendall bloquea mientras el buffer del socket está lleno: contrapresión natural
+        self.socket.sendall((json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8'))
+
+    def close(self):
+        super().close()
+        try:
+            self.socket.close()
+        except OSError:
+            pass
+
+
+class CallbackSink(TweetSink):
+    """Entrega cada registro a una función del usuario"""
+
+    def __init__(self, callback):
+        """
+        Args:
+            callback: Función llamada con cada registro (desde el hilo que lo descarga)
+        """
+        super().__init__()
+        self.callback = callback
+
+    def _write(self, record):
+        self.callback(record)
+
+
+class BufferedSink(TweetSink):
+    """
+    Cola acotada delante de otro destino, vaciada por un hilo propio
+
+    Desacopla la descarga de la velocidad del consumidor. Cuando la cola se
+    llena, con block=True el scraper espera a que haya hueco (contrapresión:
+    no se pierde nada pero la descarga se frena al ritmo del consumidor); con
+    block=False el registro se descarta y se cuenta en 'dropped'.
+    """
+
+    _STOP = object()
+
+    def __init__(self, sink, maxsize=1000, block=True):
+        """
+        Args:
+            sink: TweetSink que recibe los registros
+            maxsize: Registros como máximo en la cola
+            block: Si True, esperar cuando la cola está llena; si False, descartar
+        """
+        super().__init__()
+        self.sink = sink
+        self.block = block
+        self.queue = queue.Queue(maxsize)
+        self.max_depth = 0
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+
+    def _drain(self):
+        while True:
+            record = self.queue.get()
+            if record is self._STOP:
+                return
+            self.sink.emit(record)
+
+    def emit(self, record):
+        if self.closed:
+            self.dropped += 1
+            return
+        if self.block:
+            while True:
+                try:
+                    self.queue.put(record, timeout=0.5)
+                    break
+                except queue.Full:
+                    if should_stop:
+                        # Ctrl+C con el consumidor atascado: no bloquear la salida
+                        with self._lock:
+                            self.dropped += 1
+                        return
+        else:
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+                return
+        with self._lock:
+            self.emitted += 1
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def close(self):
+        """Entrega lo que queda en la cola y cierra el destino"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(self._STOP)
+        self._thread.join()
+        self.sink.close()
+
+    def summary(self):
+        return dict(self.sink.summary(), queued=self.emitted, queue_dropped=self.dropped,
+                    max_queue_depth=self.max_depth)
+
+
+def open_sink(target, maxsize=None, block=None):
+    """
+    Abre el destino de streaming indicado en STREAM_OUTPUT
+
+    Args:
+        target: '-' (stdout), 'unix:RUTA' (socket Unix) o la ruta de un archivo o
+            tubería con nombre (abrir una tubería espera a que haya un lector)
+        maxsize: Tamaño de la cola (None = STREAM_QUEUE_SIZE del .env, 1000 por defecto)
+        block: Contrapresión al llenarse la cola (None = STREAM_BACKPRESSURE del .env:
+            'block' por defecto o 'drop')
+
+    Returns:
+        BufferedSink sobre el destino elegido
+    """
+    if target == '-':
+        # sys.__stdout__: con salida en streaming los mensajes se redirigen a stderr
+        sink = NDJSONSink(sys.__stdout__)
+    elif target.startswith('unix:'):
+        sink = UnixSocketSink(target[len('unix:'):])
+    else:
+        sink = NDJSONSink(open(target, 'a', encoding='utf-8'), close_stream=True)
+
+    if maxsize is None:
+        maxsize = int(os.getenv('STREAM_QUEUE_SIZE', '1000'))
+    if block is None:
+        block = os.getenv('STREAM_BACKPRESSURE', 'block').lower() != 'drop'
+    return BufferedSink(sink, maxsize, block)
+
+
+def media_urls(conversation, include_replies=True):
+    """
+    URLs de fotos, vídeos (mp4) y GIFs de una conversación, sin repetir
+
+    Args:
+        conversation: Dataset de download_full_conversation
+        include_replies: Si True, incluye la multimedia de las respuestas
+
+    Returns:
+        Lista de tuplas (tipo, url) en orden de aparición
+    """
+    seen = set()
+    urls = []
+    for item in conversation.get('tweets', []):
+        tweets = [item['tweet']] + (item.get('replies', []) if include_replies else [])
+        for tweet in tweets:
+            for kind in ('photos', 'videos', 'gifs'):
+                for media in tweet.get(kind) or []:
+                    url = media.get('url') if isinstance(media, dict) else media
+                    if url and url not in seen:
+                        seen.add(url)
+                        urls.append((kind, url))
+    return urls
+
+
+class MediaDownloader:
+    """
+    Descarga concurrente de multimedia a un almacén direccionado por contenido
+
+    Cada archivo se guarda como objects/<sha256[:2]>/<sha256><ext>, así que la
+    misma imagen o vídeo publicado desde varias URLs se guarda una sola vez.
+    index.json relaciona cada URL con su objeto. Las descargas a medias se
+    conservan en partial/ y se reanudan con cabecera Range. El presupuesto de
+    bytes se comparte entre todos los hilos de la ejecución.
+    """
+
+    def __init__(self, media_dir=os.path.join('scraping', 'media'), max_workers=4, byte_budget=None,
+                 chunk_size=64 * 1024, timeout=60):
+        """
+        Args:
+            media_dir: Carpeta del almacén
+            max_workers: Descargas simultáneas
+            byte_budget: Bytes máximos a descargar en esta ejecución (None = sin límite)
+            chunk_size: Tamaño de bloque de lectura
+            timeout: Timeout de conexión/lectura en segundos
+        """
+        import hashlib
+
+        self.hashlib = hashlib
+        self.media_dir = media_dir
+        self.objects_dir = os.path.join(media_dir, 'objects')
+        self.partial_dir = os.path.join(media_dir, 'partial')
+        self.index_path = os.path.join(media_dir, 'index.json')
+        self.max_workers = max_workers
+        self.byte_budget = byte_budget
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.lock = threading.Lock()
+        self.bytes_downloaded = 0
+        self.budget_exhausted = False
+
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            try:
+                self.index, _ = load_checkpoint(self.index_path)
+            except ValueError:
+                pass
+
+    def _charge(self, nbytes):
+        """Descuenta bytes del presupuesto; False si ya no queda"""
+        with self.lock:
+            if self.budget_exhausted:
+                return False
+            self.bytes_downloaded += nbytes
+            if self.byte_budget is not None and self.bytes_downloaded >= self.byte_budget:
+                self.budget_exhausted = True
+            return True
+
+    def object_path(self, digest, ext):
+        """Ruta del objeto con el hash indicado"""
+        return os.path.join(self.objects_dir, digest[:2], f"{digest}{ext}")
+
+    def fetch(self, url):
+        """
+        Descarga una URL al almacén (reanudando si hay una descarga parcial)
+
+        Returns:
+            Estado: 'cached', 'downloaded', 'duplicate', 'partial' o 'failed'
+        """
+        with self.lock:
+            entry = self.index.get(url)
+        if entry and os.path.exists(os.path.join(self.media_dir, entry['path'])):
+            return 'cached'
+        if self.budget_exhausted or should_stop:
+            return 'partial'
+
+        partial_path = os.path.join(self.partial_dir, self.hashlib.sha256(url.encode('utf-8')).hexdigest() + '.part')
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+
+        try:
+            with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                if response.status_code == 416:
+                    # El parcial ya contiene el archivo completo
+                    pass
+                elif response.status_code not in (200, 206):
+                    print(f"  ⚠️  Multimedia {url}: HTTP {response.status_code}")
+                    return 'failed'
+                else:
+                    # Sin soporte de Range el servidor devuelve 200: se empieza de cero
+                    mode = 'ab' if response.status_code == 206 else 'wb'
+                    with open(partial_path, mode) as f:
+                        for chunk in response.iter_content(self.chunk_size):
+                            if not chunk:
+                                continue
+                            if should_stop or not self._charge(len(chunk)):
+                                return 'partial'
+                            f.write(chunk)
+                            if self.budget_exhausted:
+                                return 'partial'
+                content_type = response.headers.get('Content-Type', '')
+        except requests.exceptions.RequestException as e:
+            print(f"  ⚠️  Multimedia {url}: {e}")
+            return 'partial' if os.path.exists(partial_path) else 'failed'
+
+        # Hash del archivo completo (incluida la parte descargada en ejecuciones anteriores)
+        digest = self.hashlib.sha256()
+        with open(partial_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        digest = digest.hexdigest()
+
+        ext = os.path.splitext(url.split('?')[0])[1].lower()
+        if not ext and '/' in content_type:
+            ext = '.' + content_type.split('/')[1].split(';')[0].strip()
+        final_path = self.object_path(digest, ext)
+        size = os.path.getsize(partial_path)
+
+        with self.lock:
+            duplicate = os.path.exists(final_path)
+            if duplicate:
+                os.remove(partial_path)
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(partial_path, final_path)
+            self.index[url] = {
+                'sha256': digest,
+                'path': os.path.relpath(final_path, self.media_dir),
+                'size': size,
+                'content_type': content_type
+            }
+        return 'duplicate' if duplicate else 'downloaded'
+
+    def run(self, conversation, include_replies=True):
+        """
+        Descarga toda la multimedia de una conversación
+
+        Args:
+            conversation: Dataset de download_full_conversation
+            include_replies: Si True, incluye la multimedia de las respuestas
+
+        Returns:
+            Resumen: URLs por estado, bytes descargados y si se agotó el presupuesto
+        """
+        urls = media_urls(conversation, include_replies)
+        counts = {'cached': 0, 'downloaded': 0, 'duplicate': 0, 'partial': 0, 'failed': 0}
+        if urls:
+            print(f"\n🖼️  Descargando multimedia: {len(urls)} archivos ({self.max_workers} en paralelo)")
+            try:
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    for status in executor.map(lambda kind_url: self.fetch(kind_url[1]), urls):
+                        counts[status] += 1
+            finally:
+                with self.lock:
+                    atomic_write_json(self.index_path, self.index)
+
+        summary = dict(counts, total=len(urls), bytes_downloaded=self.bytes_downloaded,
+                       budget_exhausted=self.budget_exhausted)
+        if urls:
+            print(f"✓ Multimedia: {counts['downloaded']} nuevos, {counts['duplicate']} duplicados, "
+                  f"{counts['cached']} ya descargados, {counts['partial']} pendientes, {counts['failed']} con error "
+                  f"({self.bytes_downloaded / (1024 * 1024):.1f} MB)")
+            if self.budget_exhausted:
+                print("⚠️  Presupuesto de bytes agotado: el resto se reanudará en la próxima ejecución")
+        return summary
+
+
+class PhaseProfiler:
+    """
+    Perfilado por fases del scraper: tiempo, CPU (cProfile) y memoria (tracemalloc)
+
+    Cada fase ('network', 'search_page', 'replies', 'checkpoint', 'save',
+    'filters', 'export', 'index') acumula llamadas, tiempo real y tiempo de CPU
+    del hilo. Con cpu=True guarda además un perfil cProfile por fase y, con
+    memory=True, los sitios del código que más memoria reservan durante ella.
+
+    Las fases anidadas se perfilan por separado: al entrar en una fase interna
+    se pausa el cProfile de la externa (el perfil de 'search_page' no incluye la
+    red), aunque los tiempos sí son inclusivos. Cada hilo usa sus propios
+    perfiles y dump() los combina. tracemalloc es global: con varios hilos, las
+    reservas de fases simultáneas se atribuyen a todas ellas.
+    """
+
+    def __init__(self, cpu=True, memory=False, output_dir='scraping', top=30, frames=1):
+        """
+        Args:
+            cpu: Capturar un perfil cProfile por fase
+            memory: Medir las reservas de memoria de cada fase con tracemalloc (más lento)
+            output_dir: Carpeta en la que dump() crea profile_<fecha>/
+            top: Funciones y sitios de memoria que se listan en los informes de texto
+            frames: Marcos de pila que tracemalloc guarda por cada reserva
+        """
+        self.cpu = cpu
+        self.memory = memory
+        self.output_dir = output_dir
+        self.top = top
+        self.stats = {}
+        self._profiles = {}
+        self._allocations = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._started_tracing = False
+
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            self._started_tracing = True
+        self._filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ]
+
+    @classmethod
+    def from_env(cls):
+        """
+        Crea el perfilador según PROFILE del .env ('cpu', 'memory', 'cpu,memory' o 'all')
+
+        Returns:
+            PhaseProfiler o None si el perfilado está desactivado
+        """
+        value = os.getenv('PROFILE', '').strip().lower()
+        if value in ('', '0', 'false', 'no', 'n'):
+            return None
+        cpu = value in ('1', 'true', 's', 'si', 'all') or 'cpu' in value
+        memory = value == 'all' or 'memory' in value
+        return cls(cpu=cpu, memory=memory, top=int(os.getenv('PROFILE_TOP', '30')))
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _thread_profile(self, name):
+        """Perfil cProfile de la fase para el hilo actual (cProfile solo mide su propio hilo)"""
+        profiles = getattr(self._local, 'profiles', None)
+        if profiles is None:
+            profiles = self._local.profiles = {}
+        if name not in profiles:
+            profiles[name] = cProfile.Profile()
+            with self._lock:
+                self._profiles.setdefault(name, []).append(profiles[name])
+        return profiles[name]
+
+    def _record_allocations(self, name, before):
+        """Suma a la fase las reservas netas entre dos instantáneas, por línea de código"""
+        after = tracemalloc.take_snapshot().filter_traces(self._filters)
+        allocated = 0
+        with self._lock:
+            sites = self._allocations.setdefault(name, {})
+            for stat in after.compare_to(before, 'lineno'):
+                if stat.size_diff <= 0:
+                    continue
+                allocated += stat.size_diff
+                site = sites.setdefault(str(stat.traceback[0]), [0, 0])
+                site[0] += stat.size_diff
+                site[1] += max(stat.count_diff, 0)
+        return allocated
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Mide el bloque como la fase indicada
+
+        Args:
+            name: Nombre de la fase
+        """
+        stack = self._stack()
+        outer = stack[-1] if stack else None
+        if outer is not None:
+            outer.disable()
+
+        profile = self._thread_profile(name) if self.cpu else None
+        if profile is not None:
+            try:
+                profile.enable()
+            except ValueError:
+                # Otro perfilador activo (otro hilo en Python 3.12+, o uno externo): solo tiempos
+                profile = None
+        stack.append(profile)
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(self._filters) if self.memory else None
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall_start, time.thread_time() - cpu_start
+            if profile is not None:
+                profile.disable()
+            stack.pop()
+            allocated = self._record_allocations(name, snapshot) if snapshot is not None else 0
+
+            with self._lock:
+                stats = self.stats.setdefault(name, {
+                    'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'allocated_bytes': 0
+                })
+                stats['calls'] += 1
+                stats['wall_seconds'] += wall
+                stats['cpu_seconds'] += cpu
+                stats['allocated_bytes'] += allocated
+
+            if outer is not None:
+                outer.enable()
+
+    def summary(self):
+        """
+        Returns:
+            Diccionario {fase: estadísticas} ordenado por tiempo real descendente
+        """
+        with self._lock:
+            ordered = sorted(self.stats.items(), key=lambda kv: kv[1]['wall_seconds'], reverse=True)
+            return {name: dict(stats, wall_seconds=round(stats['wall_seconds'], 4),
+                               cpu_seconds=round(stats['cpu_seconds'], 4))
+                    for name, stats in ordered}
+
+    def dump(self, directory=None):
+        """
+        Vuelca los perfiles para analizarlos fuera de línea
+
+        Crea en la carpeta:
+            summary.json: llamadas, tiempo real, CPU y memoria reservada por fase
+            <fase>.prof: perfil cProfile (abrir con pstats, snakeviz...)
+            <fase>.txt: funciones con más tiempo acumulado
+            allocations.txt: sitios con más memoria reservada por fase
+
+        Args:
+            directory: Carpeta de salida (None = output_dir/profile_<fecha>)
+
+        Returns:
+            Ruta de la carpeta creada, o None si no se midió ninguna fase
+        """
+        summary = self.summary()
+        if not summary:
+            return None
+        if directory is None:
+            directory = os.path.join(self.output_dir, f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        os.makedirs(directory, exist_ok=True)
+
+        with self._lock:
+            profiles = {name: list(items) for name, items in self._profiles.items()}
+            allocations = {name: dict(sites) for name, sites in self._allocations.items()}
+
+        for name, items in profiles.items():
+            merged = None
+            for profile in items:
+                try:
+                    if merged is None:
+                        merged = pstats.Stats(profile)
+                    else:
+                        merged.add(profile)
+                except TypeError:
+                    # Perfil sin llamadas registradas
+                    continue
+            if merged is None:
+                continue
+            merged.dump_stats(os.path.join(directory, f"{name}.prof"))
+            with open(os.path.join(directory, f"{name}.txt"), 'w', encoding='utf-8') as f:
+                merged.stream = f
+                merged.sort_stats('cumulative').print_stats(self.top)
+
+        if allocations:
+            with open(os.path.join(directory, 'allocations.txt'), 'w', encoding='utf-8') as f:
+                for name, sites in allocations.items():
+                    f.write(f"== {name} ==\n")
+                    top_sites = sorted(sites.items(), key=lambda kv: kv[1][0], reverse=True)[:self.top]
+                    for site, (size, count) in top_sites:
+                        f.write(f"{size / 1024:10.1f} KiB {count:8d} bloques  {site}\n")
+                    f.write("\n")
+
+        report = {
+            'created_at': datetime.now().isoformat(),
+            'cpu': self.cpu,
+            'memory': self.memory,
+            'phases': summary
+        }
+        if self.memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            report['traced_memory'] = {'current_bytes': current, 'peak_bytes': peak}
+        atomic_write_json(os.path.join(directory, 'summary.json'), report)
+        return directory
+
+    def print_summary(self, directory=None):
+        """Muestra el tiempo y la memoria de cada fase"""
+        summary = self.summary()
+        if not summary:
+            return
+        print("\n⏱️  Perfil por fases (tiempo real / CPU / memoria reservada):")
+        for name, stats in summary.items():
+            line = f"   {name:<12} {stats['calls']:>6} llamadas  {stats['wall_seconds']:>9.2f}s  {stats['cpu_seconds']:>8.2f}s CPU"
+            if self.memory:
+                line += f"  {stats['allocated_bytes'] / 1024 / 1024:>8.1f} MB"
+            print(line)
+        if directory:
+            print(f"📁 Perfiles guardados en: {directory}")
+
+    def finish(self):
+        """Vuelca los perfiles, muestra el resumen y detiene tracemalloc si lo inició este perfilador"""
+        directory = self.dump()
+        self.print_summary(directory)
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return directory
+
+
+def profiled(phase):
+    """
+    Decorador para métodos del scraper: mide cada llamada como una fase de
+    self.profiler (sin coste si el perfilado está desactivado)
+
+    Args:
+        phase: Nombre de la fase
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.profiler is None:
+                return method(self, *args, **kwargs)
+            with self.profiler.phase(phase):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TwitterHashtagScraper:
+    def __init__(self, checkpoint_backups=None, date_operators=True, requests_per_second=None, normalize_users=None,
+                 search_index=None, profiler=None, sink=None, page_archive=None):
+        """
+        Args:
+            checkpoint_backups: Generaciones de respaldo (.bakN) que se mantienen
+                al sobrescribir un checkpoint. None = usar CHECKPOINT_BACKUPS del .env (0 por defecto)
+            date_operators: Si True, añade los operadores since:/until: al query para
+                que la API filtre por fecha (el filtro local se mantiene como respaldo)
+            requests_per_second: Límite de peticiones por segundo de cada API key (plan de RapidAPI).
+                None = usar RAPIDAPI_REQUESTS_PER_SECOND del .env (sin límite por defecto)
+            normalize_users: Si True, los JSON guardan los autores una vez en un mapa 'users'
+                (ver normalize_users). None = usar NORMALIZE_USERS del .env (desactivado por defecto)
+            search_index: TweetIndex que save_to_json actualiza con cada dataset guardado.
+                None = crear uno en scraping/index.db si SEARCH_INDEX=1 en el .env
+            profiler: PhaseProfiler que mide red, páginas, respuestas, checkpoints, filtros
+                y exportaciones. None = PhaseProfiler.from_env() (PROFILE en el .env)
+            sink: TweetSink que recibe cada tweet y respuesta en cuanto se descarga.
+                None = open_sink(STREAM_OUTPUT) si está definido en el .env
+            page_archive: PageArchive en el que se guarda cada respuesta cruda de la API.
+                None = crear uno en scraping/pages.db si PAGE_ARCHIVE=1 en el .env
+        """
+        if checkpoint_backups is None:
+            checkpoint_backups = int(os.getenv('CHECKPOINT_BACKUPS', '0'))
+        self.checkpoint_backups = checkpoint_backups
+        self.date_operators = date_operators
+        if normalize_users is None:
+            normalize_users = os.getenv('NORMALIZE_USERS', '').lower() in ('1', 'true', 's', 'si')
+        self.normalize_users = normalize_users
+        if search_index is None and os.getenv('SEARCH_INDEX', '').lower() in ('1', 'true', 's', 'si'):
+            search_index = TweetIndex()
+        self.search_index = search_index
+        self.profiler = profiler if profiler is not None else PhaseProfiler.from_env()
+        if sink is None and os.getenv('STREAM_OUTPUT'):
+            sink = open_sink(os.getenv('STREAM_OUTPUT'))
+        self.sink = sink
+        if page_archive is None and os.getenv('PAGE_ARCHIVE', '').lower() in ('1', 'true', 's', 'si'):
+            page_archive = PageArchive()
+        self.page_archive = page_archive
+
+        if requests_per_second is None and os.getenv('RAPIDAPI_REQUESTS_PER_SECOND'):
+            requests_per_second = float(os.getenv('RAPIDAPI_REQUESTS_PER_SECOND'))
+        self.request_count = 0
+        self._count_lock = threading.Lock()
+        self.last_checkpoint = None
+
+        # Varias keys separadas por comas en RAPIDAPI_KEYS, o una sola en RAPIDAPI_KEY
+        keys = [k.strip() for k in os.getenv('RAPIDAPI_KEYS', '').split(',') if k.strip()]
+        if not keys and os.getenv('RAPIDAPI_KEY'):
+            keys = [os.getenv('RAPIDAPI_KEY')]
+        self.api_key = keys[0] if keys else None
+        self.api_host = os.getenv('RAPIDAPI_HOST')
+
+        if not self.api_key or not self.api_host:
+            raise ValueError("RAPIDAPI_KEY (o RAPIDAPI_KEYS) y RAPIDAPI_HOST deben estar definidos en .env")
+
+        self.key_pool = ApiKeyPool(keys, requests_per_second)
+        self.base_url = f"https://{self.api_host}/v1"
+        self.headers = {
+            'X-RapidAPI-Key': self.api_key,
+            'X-RapidAPI-Host': self.api_host
+        }
+
+        # Sesión HTTP compartida: reutiliza conexiones TLS entre búsquedas e hilos
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32)
+        self.session.mount('https://', adapter)
+
+        print(f"Conectando a: {self.api_host}")
+        if len(keys) > 1:
+            print(f"API Keys: {len(keys)} ({', '.join(u['key'] for u in self.key_pool.usage_report())})")
+        else:
+            print(f"API Key: {self.api_key[:10]}...{self.api_key[-4:]}")
+        print()
+
+    def _get(self, url, params=None):
+        """
+        Realiza una petición GET a la API con la key más adecuada del pool
+
+        Respeta el límite de peticiones de cada key y, si una key recibe
+        429 o 403, reintenta la petición con otra mientras quede alguna.
+
+        Args:
+            url: URL completa del endpoint
+            params: Parámetros de la petición
+
+        Returns:
+            requests.Response
+        """
+        for _ in range(len(self.key_pool.keys)):
+            state = self.key_pool.acquire()
+            if state is None:
+                raise RuntimeError("Descarga detenida mientras se esperaba una API key")
+            with self._count_lock:
+                self.request_count += 1
+            headers = dict(self.headers, **{'X-RapidAPI-Key': state['key']})
+            with self._phase('network'):
+                response = self.session.get(url, headers=headers, params=params)
+            self.key_pool.report(state, response)
+
+            if response.status_code not in (403, 429) or len(self.key_pool.keys) == 1:
+                return response
+            if not self.key_pool.has_available():
+                return response
+            print(f"  ⚠️  Key {state['key'][:6]}... respondió {response.status_code}, reintentando con otra key")
+
+        return response
+
+    def close_sink(self):
+        """Entrega lo pendiente de la salida en streaming, la cierra y muestra su resumen"""
+        if not self.sink:
+            return
+        self.sink.close()
+        summary = self.sink.summary()
+        dropped = summary['dropped'] + summary.get('queue_dropped', 0)
+        print(f"📡 Streaming: {summary['emitted']} registros entregados, {dropped} descartados", file=sys.stderr)
+
+    def _fetch_page(self, endpoint, key, params, request=None, mode=None):
+        """
+        Pide una página de búsqueda o de respuestas y la guarda en page_archive (si hay)
+
+        La descarga procesa page.json(), que se parsea de los mismos bytes que
+        se archivan: lo que se regenera desde el archivo es lo que se procesó.
+
+        Args:
+            endpoint: 'search' o 'replies'
+            key: Término de búsqueda o ID del tweet
+            params: Parámetros de la petición ('cursor' desde la segunda página)
+            request: Query enviado a la API (búsquedas)
+            mode: Modo de búsqueda
+
+        Returns:
+            Tupla (response, ArchivedPage)
+        """
+        path = 'search/tweets' if endpoint == 'search' else f'tweets/{key}/replies'
+        response = self._get(f"{self.base_url}/{path}", params)
+        page = ArchivedPage.from_response(endpoint, key, response, request, mode, params.get('cursor'))
+        if self.page_archive:
+            self.page_archive.store(page)
+        return response, page
+
+    def _phase(self, name):
+        """Contexto que mide un bloque como fase del perfilador (no hace nada sin perfilador)"""
+        return self.profiler.phase(name) if self.profiler else nullcontext()
+
+    @profiled('checkpoint')
+    def _save_checkpoint(self, filename, data, policy=None):
+        """
+        Guarda un checkpoint en scraping/ de forma atómica
+
+        Args:
+            filename: Nombre del archivo dentro de scraping/
+            data: Datos a guardar
+            policy: CheckpointPolicy en la que registrar el coste del guardado
+
+        Returns:
+            Ruta del archivo guardado
+        """
+        filepath = os.path.join('scraping', filename)
+        start = time.monotonic()
+        if 'tweets' in data:
+            atomic_write_dataset(filepath, normalize_users(data) if self.normalize_users else data,
+                                 backups=self.checkpoint_backups)
+        else:
+            atomic_write_json(filepath, data, backups=self.checkpoint_backups)
+        if policy:
+            policy.mark(time.monotonic() - start, os.path.getsize(filepath))
+        # Progreso que los workers envían en cada heartbeat
+        self.last_checkpoint = {
+            'file': filepath,
+            'items': len(data.get('tweets', data.get('replies', []))),
+            'status': data.get('status'),
+            'at': datetime.now().isoformat()
+        }
+        return filepath
+
+    def search_tweets(self, query, mode='latest', max_tweets=None, is_hashtag=True, until_date=None, since_date=None, incremental_save=False, partial_filename=None, checkpoint_policy=None, tweet_filter=None, on_page=None, outcome=None):
+        """
+        Busca tweets por hashtag o texto
+
+        Args:
+            query: El término a buscar (hashtag o texto)
+            mode: Modo de búsqueda ('top', 'latest', 'photos', 'videos')
+            max_tweets: Número máximo de tweets a descargar (None = todos disponibles)
+            is_hashtag: Si True, agrega # si no lo tiene. Si False, busca como texto
+            until_date: Fecha límite superior (más reciente) - formato: YYYY-MM-DD
+            since_date: Fecha límite inferior (más antigua) - formato: YYYY-MM-DD
+            incremental_save: Si True, guarda después de cada página
+            partial_filename: Nombre del archivo para guardado incremental
+            checkpoint_policy: CheckpointPolicy que decide cuándo guardar (None = cada página)
+            tweet_filter: TweetFilter aplicado a cada página antes de acumularla y guardarla
+            on_page: Función llamada con los tweets aceptados de cada página
+            outcome: Diccionario que se rellena con 'complete' (True si la búsqueda
+                terminó por agotar resultados, cursor, rango de fechas o max_tweets) y
+                'error' (motivo si se cortó por un error HTTP o de red)
+
+        Returns:
+            Lista de tweets (posiblemente parcial: ver outcome)
+        """
+        if checkpoint_policy is None:
+            checkpoint_policy = CheckpointPolicy()
+        complete = False
+        error = None
+
+        search_query = self._build_search_query(query, is_hashtag, until_date, since_date)
+
+        all_tweets = []
+        cursor = None
+        tweet_count = 0
+        page_count = 0
+        oldest_date = None
+        newest_date = None
+
+        # Convertir fechas a timestamp si están presentes
+        until_timestamp = None
+        since_timestamp = None
+        if until_date:
+            until_timestamp = parse_date_limit(until_date)
+        if since_date:
+            since_timestamp = parse_date_limit(since_date)
+
+        print(f"Buscando tweets para: {search_query}")
+        print(f"Modo: {mode}")
+        if since_date and until_date:
+            print(f"Rango de fechas: desde {since_date} hasta {until_date}")
+        elif until_date:
+            print(f"Hasta fecha: {until_date}")
+        elif since_date:
+            print(f"Desde fecha: {since_date}")
+        print("-" * 50)
+
+        while True:
+            # Verificar si se debe detener
+            global should_stop
+            if should_stop:
+                print("\n⚠️  Descarga interrumpida por el usuario")
+                break
+
+            # Preparar parámetros
+            params = {
+                'query': search_query,
+                'mode': mode
+            }
+
+            if cursor:
+                params['cursor'] = cursor
+
+            try:
+                # Hacer la petición
+                response, page = self._fetch_page('search', query, params, search_query, mode)
+
+                with self._phase('search_page'):
+                    response.raise_for_status()
+                    data = page.json()
+
+                    # Extraer tweets (la API devuelve en data.tweets)
+                    if 'data' in data and 'tweets' in data['data']:
+                        tweets = data['data']['tweets']
+                        cursor = data['data'].get('cursor')
+                    else:
+                        tweets = data.get('tweets', [])
+
+                    if not tweets:
+                        print("No se encontraron más tweets.")
+                        complete = True
+                        break
+
+                    # Filtrar tweets por rango de fechas si está configurado
+                    # (respaldo por si la API ignora los operadores since:/until:)
+                    filtered_tweets = []
+                    stop_pagination = False
+
+                    page_count += 1
+                    for tweet in tweets:
+                        tweet_date = tweet.get('time_parsed', '')
+                        tweet_timestamp = tweet.get('timestamp', 0)
+
+                        # Actualizar fechas más antigua y más nueva
+                        if not oldest_date or (tweet_date and tweet_date < oldest_date):
+                            oldest_date = tweet_date
+                        if not newest_date or (tweet_date and tweet_date > newest_date):
+                            newest_date = tweet_date
+
+                        # Verificar si el tweet está dentro del rango de fechas
+                        if since_timestamp and tweet_timestamp < since_timestamp:
+                            # Ya pasamos la fecha inferior, detener paginación
+                            print(f"\nAlcanzada la fecha límite inferior: {since_date}")
+                            stop_pagination = True
+                            break
+
+                        # Filtrar según el rango
+                        if until_timestamp and tweet_timestamp > until_timestamp:
+                            # Tweet más reciente que el límite superior, saltarlo
+                            continue
+
+                        if since_timestamp and tweet_timestamp < since_timestamp:
+                            # Tweet más antiguo que el límite inferior, saltarlo
+                            continue
+
+                        # Tweet dentro del rango (o sin filtros)
+                        filtered_tweets.append(tweet)
+
+                    # Filtros del usuario: lo descartado no se guarda ni genera peticiones de respuestas
+                    if tweet_filter:
+                        with self._phase('filters'):
+                            filtered_tweets = tweet_filter.apply(filtered_tweets)
+
+                    # No pasar del máximo dentro de la página (lo sobrante no se procesa)
+                    if max_tweets:
+                        filtered_tweets = filtered_tweets[:max(0, max_tweets - len(all_tweets))]
+
+                    if on_page and filtered_tweets:
+                        on_page(filtered_tweets)
+                    if self.sink:
+                        for tweet in filtered_tweets:
+                            self.sink.emit(stream_record(tweet, 'tweet', query=query))
+
+                    all_tweets.extend(filtered_tweets)
+                    tweet_count = len(all_tweets)
+
+                    if stop_pagination:
+                        print(f"Total descargado: {tweet_count} tweets en el rango especificado")
+                        complete = True
+                        break
+
+                    print(f"Página {page_count}: {len(filtered_tweets)} tweets añadidos de {len(tweets)} | Total: {tweet_count} tweets | Más antiguo: {oldest_date[:10] if oldest_date else 'N/A'}")
+
+                    # Guardado incremental según la política de checkpoints
+                    checkpoint_policy.record(len(filtered_tweets), len(response.content))
+                    if incremental_save and partial_filename and checkpoint_policy.due():
+                        self._save_partial_search(query, mode, is_hashtag, all_tweets, partial_filename, checkpoint_policy)
+
+                # Verificar si llegamos al máximo
+                if max_tweets and tweet_count >= max_tweets:
+                    all_tweets = all_tweets[:max_tweets]
+                    print(f"\nAlcanzado el límite de {max_tweets} tweets")
+                    complete = True
+                    break
+
+                # Cursor ya se extrajo arriba junto con tweets
+
+                if not cursor:
+                    print("No hay más páginas disponibles.")
+                    complete = True
+                    break
+
+                # Pequeña pausa para no saturar la API
+                time.sleep(1)
+
+            except requests.exceptions.HTTPError as e:
+                error = f"HTTP {response.status_code}"
+                print(f"\n❌ Error HTTP: {e}")
+                print(f"Respuesta: {response.text}")
+
+                if response.status_code == 403:
+                    print("\n⚠️  PROBLEMA DE SUSCRIPCIÓN:")
+                    print("   Tu API key no está suscrita a esta API en RapidAPI.")
+                    print("   Pasos para solucionarlo:")
+                    print("   1. Ve a: https://rapidapi.com/omarmhaimdat/api/twitter-api45")
+                    print("   2. Suscríbete a un plan (hay planes gratuitos)")
+                    print("   3. Actualiza tu API key en .env si es necesario")
+
+                break
+            except Exception as e:
+                error = str(e) or type(e).__name__
+                print(f"❌ Error: {e}")
+                break
+
+        # Guardar lo pendiente que la política no llegó a persistir
+        if incremental_save and partial_filename and checkpoint_policy.pending_items > 0:
+            self._save_partial_search(query, mode, is_hashtag, all_tweets, partial_filename, checkpoint_policy)
+
+        if outcome is not None:
+            outcome.update(complete=complete, error=error)
+        return all_tweets
+
+    def archive_search(self, query, mode='latest', is_hashtag=True, until_date=None, since_date=None, max_pages=None):
+        """
+        Descarga páginas de búsqueda solo al PageArchive, sin parsear las respuestas
+
+        El cursor siguiente y el fin de la paginación se leen del cuerpo crudo con
+        expresiones regulares, así que el coste de parsear se traslada a quien lea
+        el archivo (PageArchive.tweets / rebuild). El filtro de fechas depende de
+        los operadores since:/until: del query.
+
+        Args:
+            query: El término a buscar (hashtag o texto)
+            mode: Modo de búsqueda
+            is_hashtag: Si True, agrega # si no lo tiene
+            until_date: Fecha límite superior
+            since_date: Fecha límite inferior
+            max_pages: Máximo de páginas (None = hasta que no haya más)
+
+        Returns:
+            Número de páginas archivadas
+        """
+        if not self.page_archive:
+            self.page_archive = PageArchive()
+        search_query = self._build_search_query(query, is_hashtag, until_date, since_date)
+        print(f"Archivando búsqueda: {search_query} (modo {mode}) en {self.page_archive.path}")
+
+        cursor = None
+        pages = 0
+        while not should_stop and (max_pages is None or pages < max_pages):
+            params = {'query': search_query, 'mode': mode}
+            if cursor:
+                params['cursor'] = cursor
+
+            response, page = self._fetch_page('search', query, params, search_query, mode)
+            if response.status_code != 200:
+                print(f"❌ Error HTTP {response.status_code}: {response.text[:200]}")
+                break
+            if not NON_EMPTY_TWEETS_PATTERN.search(page.body):
+                print("No se encontraron más tweets.")
+                break
+
+            pages += 1
+            print(f"Página {pages} archivada ({page.raw_size / 1024:.1f} KB)")
+            if not page.next_cursor:
+                print("No hay más páginas disponibles.")
+                break
+            cursor = page.next_cursor
+            time.sleep(1)
+
+        return pages
+
+    def _build_search_query(self, query, is_hashtag, until_date=None, since_date=None):
+        """
+        Construye el query que se envía a la API
+
+        Agrega # si es hashtag y, si date_operators está activo, los operadores
+        since:/until: para que la API solo devuelva tweets del rango. Así una
+        ventana antigua no obliga a paginar primero todos los tweets recientes.
+
+        Args:
+            query: Término a buscar
+            is_hashtag: Si True, agrega # si no lo tiene
+            until_date: Fecha límite superior - formato: YYYY-MM-DD o YYYY-MM-DD HH:MM
+            since_date: Fecha límite inferior - formato: YYYY-MM-DD o YYYY-MM-DD HH:MM
+
+        Returns:
+            Query listo para el parámetro 'query' de la API
+        """
+        # Procesar query según el tipo de búsqueda
+        if is_hashtag and not query.startswith('#'):
+            search_query = f'#{query}'
+        else:
+            search_query = query
+
+        if self.date_operators:
+            # Con hora (franjas de backfill) se usan since_time:/until_time: con timestamp
+            if since_date:
+                search_query += f' since_time:{parse_date_limit(since_date)}' if ' ' in since_date else f' since:{since_date}'
+            if until_date:
+                search_query += f' until_time:{parse_date_limit(until_date)}' if ' ' in until_date else f' until:{until_date}'
+
+        return search_query
+
+    def _save_partial_search(self, query, mode, is_hashtag, tweets, partial_filename, policy):
+        """Guarda un checkpoint con los tweets principales descargados hasta ahora"""
+        partial_data = {
+            'query': query,
+            'search_type': 'hashtag' if is_hashtag else 'text',
+            'mode': mode,
+            'downloaded_at': datetime.now().isoformat(),
+            'status': 'in_progress',
+            'total_main_tweets': len(tweets),
+            'tweets': [{'tweet': t, 'replies': []} for t in tweets]
+        }
+        self._save_checkpoint(partial_filename, partial_data, policy)
+        print(f"  💾 Guardado incremental: {len(tweets)} tweets")
+
+    def search_tweets_partitioned(self, query, since_date, until_date, mode='latest', is_hashtag=True, slice_hours=24, max_workers=None, max_tweets_per_slice=None, incremental_save=True, tweet_filter=None):
+        """
+        Backfill en paralelo: divide el rango de fechas en franjas y las descarga a la vez
+
+        Cada franja sigue su propia cadena de cursores y guarda su propio
+        checkpoint en scraping/slices/. Las franjas ya completadas en una
+        ejecución anterior se reutilizan sin volver a pedirlas. Al final se
+        combinan sin duplicados y ordenadas del más reciente al más antiguo.
+
+        Args:
+            query: El término a buscar (hashtag o texto)
+            since_date: Fecha inicial - formato: YYYY-MM-DD o YYYY-MM-DD HH:MM
+            until_date: Fecha final (exclusiva) - mismo formato
+            mode: Modo de búsqueda
+            is_hashtag: Si True, trata como hashtag. Si False, como texto libre
+            slice_hours: Tamaño de cada franja en horas (24 = un día)
+            max_workers: Franjas simultáneas (None = peticiones/s agregadas de todas las keys, 4 sin límite)
+            max_tweets_per_slice: Límite de tweets por franja (None = todos)
+            incremental_save: Si True, guarda checkpoints por franja
+            tweet_filter: TweetFilter aplicado a cada página de cada franja
+
+        Returns:
+            Lista de tweets combinada
+        """
+        slices = split_date_range(since_date, until_date, slice_hours)
+        if max_workers is None:
+            total_rate = self.key_pool.total_rate()
+            max_workers = max(1, int(total_rate)) if total_rate else 4
+
+        query_clean = query_filename(query)
+        print(f"Backfill paralelo: {len(slices)} franjas de {slice_hours}h con {max_workers} hilos")
+
+        def crawl(slice_range):
+            slice_since, slice_until = slice_range
+            slice_name = f"{slice_since}_{slice_until}".replace(' ', 'T').replace(':', '')
+            slice_filename = os.path.join('slices', f"{query_clean}_{slice_name}.json")
+            slice_path = os.path.join('scraping', slice_filename)
+
+            if os.path.exists(slice_path):
+                try:
+                    data, _ = load_dataset(slice_path)
+                    if data.get('status') == 'completed':
+                        print(f"  ✓ Franja {slice_since} → {slice_until} ya descargada")
+                        return slice_path, [item['tweet'] for item in data.get('tweets', [])], True
+                except ValueError:
+                    pass
+
+            outcome = {}
+            tweets = self.search_tweets(query, mode, max_tweets_per_slice, is_hashtag, slice_until, slice_since,
+                                        incremental_save, slice_filename, CheckpointPolicy(), tweet_filter,
+                                        outcome=outcome)
+            # Una franja cortada por un error (429, 5xx, red) se vuelve a pedir al relanzar
+            completed = outcome['complete']
+            if outcome['error']:
+                print(f"  ⚠️  Franja {slice_since} → {slice_until} incompleta ({outcome['error']}): se reintentará")
+            if incremental_save and completed:
+                self._save_checkpoint(slice_filename, {
+                    'query': query,
+                    'search_type': 'hashtag' if is_hashtag else 'text',
+                    'mode': mode,
+                    'since_date': slice_since,
+                    'until_date': slice_until,
+                    'status': 'completed',
+                    'total_main_tweets': len(tweets),
+                    'tweets': [{'tweet': t, 'replies': []} for t in tweets]
+                })
+            return slice_path, tweets, completed
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(crawl, slices))
+
+        # Combinar sin duplicados y en orden temporal (más reciente primero)
+        merged = {}
+        for _, tweets, _ in results:
+            for tweet in tweets:
+                tweet_id = tweet.get('id')
+                if tweet_id and tweet_id not in merged:
+                    merged[tweet_id] = tweet
+        all_tweets = sorted(merged.values(), key=lambda t: t.get('timestamp', 0), reverse=True)
+
+        # Los checkpoints por franja solo se eliminan si todas terminaron
+        if all(completed for _, _, completed in results):
+            remove_dataset_files([slice_path for slice_path, _, _ in results])
+
+        print(f"Backfill completado: {len(all_tweets)} tweets únicos de {len(slices)} franjas")
+        return all_tweets
+
+    @profiled('replies')
+    def get_tweet_replies(self, tweet_id, max_pages=None, planner=None, known_ids=None):
+        """
+        Obtiene las respuestas de un tweet específico
+
+        Args:
+            tweet_id: ID del tweet
+            max_pages: Máximo de páginas (peticiones) a pedir (None = todas)
+            planner: ReplyFetchPlanner del que se descuenta cada petición (se detiene
+                al agotar su presupuesto)
+            known_ids: IDs ya descargados; al refrescar un hilo la paginación se
+                detiene en la primera página sin respuestas nuevas
+
+        Returns:
+            Lista de respuestas
+        """
+        all_replies = []
+        cursor = None
+        pages = 0
+
+        while True:
+            # Verificar si se debe detener
             global should_stop
             if should_stop:
                 break
 
-            try:
-                params = {}
-                if cursor:
-                    params['cursor'] = cursor
+            if max_pages is not None and pages >= max_pages:
+                break
+            if planner and not planner.try_charge():
+                break
+            pages += 1
+
+            try:
+                params = {}
+                if cursor:
+                    params['cursor'] = cursor
+
+                response, page = self._fetch_page('replies', tweet_id, params)
+
+                response.raise_for_status()
+                data = page.json()
+
+                replies = data.get('tweets', [])
+
+                if not replies:
+                    break
+
+                all_replies.extend(replies)
+                cursor = data.get('cursor')
+
+                if not cursor:
+                    break
+                if known_ids is not None and all(reply.get('id') in known_ids for reply in replies):
+                    break
+
+                time.sleep(0.5)
+
+            except Exception as e:
+                print(f"Error obteniendo respuestas del tweet {tweet_id}: {e}")
+                break
+
+        return all_replies
+
+    def crawl_reply_tree(self, root_id, max_depth=3, max_workers=4, planner=None):
+        """
+        Reconstruye el árbol de respuestas de un tweet recorriéndolo por niveles
+
+        Nivel 1 son las respuestas directas; en cada nivel se piden en paralelo
+        las respuestas de los nodos del nivel anterior. Cada respuesta se enlaza
+        con su padre mediante in_reply_to_status_id y se descarta si ya se vio
+        (por ID), así que nunca se pide dos veces el mismo hilo.
+
+        Args:
+            root_id: ID del tweet raíz
+            max_depth: Profundidad máxima (1 = solo respuestas directas)
+            max_workers: Peticiones de respuestas simultáneas por nivel
+            planner: ReplyFetchPlanner con el presupuesto de peticiones compartido
+
+        Returns:
+            Diccionario con:
+                'nodes': {id: respuesta} en orden de recorrido (por niveles)
+                'children': {id_padre: [ids_hijos]}
+                'depth': profundidad alcanzada
+        """
+        nodes = {}
+        children = {}
+        frontier = [root_id]
+        depth = 0
+
+        while frontier and depth < max_depth and not should_stop:
+            if planner and not planner.has_budget():
+                break
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(lambda parent_id: (parent_id, self.get_tweet_replies(parent_id, planner=planner)), frontier))
+
+            depth += 1
+            next_frontier = []
+            for parent_id, replies in results:
+                for reply in replies:
+                    reply_id = reply.get('id')
+                    if not reply_id or reply_id == root_id or reply_id in nodes:
+                        continue
+
+                    parent = reply.get('in_reply_to_status_id') or parent_id
+                    nodes[reply_id] = reply
+                    children.setdefault(parent, []).append(reply_id)
+
+                    # Solo se expanden respuestas que tienen (o pueden tener) respuestas
+                    reply_count = reply.get('replies')
+                    if not isinstance(reply_count, int) or reply_count > 0:
+                        next_frontier.append(reply_id)
+
+            frontier = next_frontier
+
+        return {'nodes': nodes, 'children': children, 'depth': depth}
+
+    def download_full_conversation(self, query, mode='latest', max_tweets=None, include_replies=True, is_hashtag=True, until_date=None, since_date=None, incremental_save=True, checkpoint_policy=None, slice_hours=None, max_workers=None, reply_planner=None, reply_depth=1, tweet_filter=None, aggregator=None, known_reply_ids=None):
+        """
+        Descarga la conversación completa incluyendo respuestas
+
+        Args:
+            query: El término a buscar (hashtag o texto)
+            mode: Modo de búsqueda
+            max_tweets: Número máximo de tweets principales (None = todos disponibles)
+            include_replies: Si incluir las respuestas de cada tweet
+            is_hashtag: Si True, trata como hashtag. Si False, como texto libre
+            until_date: Fecha límite superior (más reciente) - formato: YYYY-MM-DD
+            since_date: Fecha límite inferior (más antigua) - formato: YYYY-MM-DD
+            incremental_save: Si True, guarda progresivamente (por defecto True)
+            checkpoint_policy: CheckpointPolicy para el guardado incremental
+                (None = CheckpointPolicy.from_env(), cada 5 elementos por defecto)
+            slice_hours: Si se indica junto con since_date y until_date, descarga el rango
+                en franjas paralelas de N horas (ver search_tweets_partitioned)
+            max_workers: Franjas simultáneas en el modo por franjas
+            reply_planner: ReplyFetchPlanner que decide de qué tweets pedir respuestas
+                (None = omitir solo los tweets con 0 respuestas reportadas)
+            reply_depth: Niveles de respuestas a descargar (1 = solo directas). Con más
+                de 1 se guarda además 'reply_tree' con el mapa padre → hijos
+            tweet_filter: TweetFilter aplicado durante la paginación, antes de los
+                guardados incrementales y de pedir respuestas
+            aggregator: StreamingAggregator que se actualiza con cada página y lote de
+                respuestas (None = uno nuevo). Su resumen se guarda en 'analytics'
+            known_reply_ids: IDs de respuestas ya guardadas; los hilos que se refrescan
+                dejan de paginar en cuanto una página no trae nada nuevo
+
+        Returns:
+            Diccionario con tweets y respuestas
+        """
+        global should_stop
+
+        if checkpoint_policy is None:
+            checkpoint_policy = CheckpointPolicy.from_env()
+        if aggregator is None:
+            aggregator = StreamingAggregator()
+        start_time = time.monotonic()
+
+        # Preparar nombre de archivo para guardado incremental
+        query_clean = query_filename(query)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        partial_filename = f"{query_clean}_{timestamp}.json"
+
+        # Buscar tweets principales con guardado incremental
+        if slice_hours and since_date and until_date:
+            main_tweets = self.search_tweets_partitioned(query, since_date, until_date, mode, is_hashtag,
+                                                         slice_hours, max_workers, incremental_save=incremental_save,
+                                                         tweet_filter=tweet_filter)
+            if max_tweets:
+                main_tweets = main_tweets[:max_tweets]
+            aggregator.add_tweets(main_tweets)
+            if incremental_save:
+                self._save_partial_search(query, mode, is_hashtag, main_tweets, partial_filename, checkpoint_policy)
+        else:
+            main_tweets = self.search_tweets(query, mode, max_tweets, is_hashtag, until_date, since_date, incremental_save, partial_filename, checkpoint_policy, tweet_filter, aggregator.add_tweets)
+
+        conversation = {
+            'query': query,
+            'search_type': 'hashtag' if is_hashtag else 'text',
+            'mode': mode,
+            'downloaded_at': datetime.now().isoformat(),
+            'total_main_tweets': len(main_tweets),
+            'tweets': []
+        }
+
+        # Obtener respuestas si se solicita
+        if include_replies:
+            print("\n" + "=" * 50)
+            print("Descargando respuestas...")
+            print("=" * 50)
+
+            if reply_planner is None:
+                reply_planner = ReplyFetchPlanner()
+            selected_ids = reply_planner.plan(main_tweets)
+            print(f"Tweets con respuestas a descargar: {len(selected_ids)}/{len(main_tweets)}")
+
+            replies_so_far = 0
+            for i, tweet in enumerate(main_tweets, 1):
+                # Verificar si se debe detener
+                if should_stop:
+                    print("\n⚠️  Descarga de respuestas interrumpida")
+                    # Marcar como incompleto
+                    conversation['status'] = 'in_progress'
+                    break
+
+                tweet_data = {
+                    'tweet': tweet,
+                    'replies': []
+                }
+
+                # Obtener respuestas
+                tweet_id = tweet.get('id')
+                if tweet_id in selected_ids and reply_planner.has_budget():
+                    print(f"\nTweet {i}/{len(main_tweets)} - ID: {tweet_id}")
+                    reply_planner.fetched += 1
+                    reply_planner.fetched_ids.add(tweet_id)
+                    if reply_depth > 1:
+                        tree = self.crawl_reply_tree(tweet_id, reply_depth, planner=reply_planner)
+                        tweet_data['replies'] = list(tree['nodes'].values())
+                        tweet_data['reply_tree'] = tree['children']
+                    else:
+                        tweet_data['replies'] = self.get_tweet_replies(tweet_id, planner=reply_planner,
+                                                                       known_ids=known_reply_ids)
+                    aggregator.add_tweets(tweet_data['replies'], kind='reply')
+                    if self.sink:
+                        for reply in tweet_data['replies']:
+                            self.sink.emit(stream_record(reply, 'reply', tweet_id, query))
+                    print(f"  Respuestas encontradas: {len(tweet_data['replies'])}")
+                elif tweet_id:
+                    reply_planner.skipped += 1
+
+                conversation['tweets'].append(tweet_data)
+                replies_so_far += len(tweet_data['replies'])
+
+                # Guardado incremental según la política (el guardado final cubre el último tramo)
+                nbytes = len(json.dumps(tweet_data, ensure_ascii=False).encode('utf-8')) if checkpoint_policy.tracks_bytes else 0
+                checkpoint_policy.record(1 + len(tweet_data['replies']), nbytes)
+                if incremental_save and i < len(main_tweets) and checkpoint_policy.due():
+                    conversation['total_replies'] = replies_so_far
+                    conversation['total_items'] = conversation['total_main_tweets'] + replies_so_far
+                    conversation['status'] = 'in_progress'
+                    conversation['analytics'] = aggregator.summary()
+
+                    self._save_checkpoint(partial_filename, conversation, checkpoint_policy)
+                    print(f"  💾 Guardado incremental: {i}/{len(main_tweets)} tweets procesados")
+
+            conversation['reply_plan'] = reply_planner.summary()
+            print(f"\nRespuestas: {reply_planner.fetched} tweets consultados, {reply_planner.skipped} omitidos, "
+                  f"{reply_planner.requests_used} peticiones")
+        else:
+            conversation['tweets'] = [{'tweet': tweet, 'replies': []} for tweet in main_tweets]
+
+        # Calcular estadísticas finales
+        total_replies = sum(len(t['replies']) for t in conversation['tweets'])
+        conversation['total_replies'] = total_replies
+        conversation['total_items'] = len(conversation['tweets']) + total_replies
+        conversation['analytics'] = aggregator.summary()
+
+        # Solo marcar como completed si no fue interrumpido
+        if not should_stop and 'status' not in conversation:
+            conversation['status'] = 'completed'
+        elif 'status' not in conversation:
+            conversation['status'] = 'in_progress'
+
+        # Guardado final (siempre, incluso si incremental_save está activo)
+        if incremental_save:
+            conversation['incremental_saved'] = True
+            conversation['_saved_filename'] = partial_filename  # Marcar el nombre del archivo usado
+
+            # Coste de los checkpoints intermedios (el guardado final se reporta aparte)
+            stats = checkpoint_policy.summary(time.monotonic() - start_time)
+            conversation['checkpoint_stats'] = stats
+            print(f"\n💾 Checkpoints intermedios: {stats['checkpoints']} escritos, {stats['overhead_seconds']}s "
+                  f"({stats.get('overhead_percent', 0)}% del tiempo), {stats['mb_written']} MB")
+
+            filepath = self._save_checkpoint(partial_filename, conversation)
+
+            if should_stop:
+                print(f"\n💾 Progreso guardado en: {filepath}")
+                print("   Puedes reanudar esta descarga más tarde")
+            else:
+                print(f"\n✓ Guardado final completado: {filepath}")
+
+        return conversation
+
+    def download_combined(self, queries, is_hashtag=True, max_query_length=MAX_QUERY_LENGTH,
+                          reply_budget=None, **kwargs):
+        """
+        Descarga varios términos agrupados en consultas OR y los separa por término
+
+        Cada lote se descarga con una sola cadena de paginación (los tweets que
+        coinciden con varios términos se piden una vez) y se reparte con
+        demux_conversation. max_tweets se aplica a cada consulta combinada.
+
+        Generador: devuelve las conversaciones por término a medida que termina
+        cada lote. Cuando el llamador ha procesado todas las de un lote, se
+        elimina el archivo de la consulta combinada (sus datos ya están en los
+        datasets por término).
+
+        Args:
+            queries: Lista de términos
+            is_hashtag: Tipo de búsqueda de los términos
+            max_query_length: Longitud máxima de cada consulta combinada
+            reply_budget: Presupuesto de peticiones de respuestas por lote
+            **kwargs: Parámetros para download_full_conversation
+
+        Yields:
+            Conversación de un término (con 'batched_query'); los tweets que no
+            corresponden a ningún término se devuelven con la consulta combinada
+        """
+        batches = batch_queries(queries, is_hashtag, max_query_length)
+        print(f"\n🔗 {len(queries)} términos agrupados en {len(batches)} búsqueda(s) combinada(s)")
+
+        for batch in batches:
+            combined = combine_terms(batch, is_hashtag)
+            print(f"\n🔗 Búsqueda combinada ({len(batch)} términos): {combined}")
+            conversation = self.download_full_conversation(
+                combined, is_hashtag=False, reply_planner=ReplyFetchPlanner(request_budget=reply_budget), **kwargs
+            )
+
+            saved_filename = conversation.pop('_saved_filename', None)
+            conversation.pop('incremental_saved', None)
+
+            per_term, unmatched = demux_conversation(conversation, batch, is_hashtag)
+            for term_conversation in per_term:
+                yield term_conversation
+
+            if unmatched:
+                print(f"⚠️  {len(unmatched)} tweets sin término asignado (coincidencia fuera del texto)")
+                conversation['tweets'] = unmatched
+                conversation['total_main_tweets'] = len(unmatched)
+                conversation['total_replies'] = sum(len(item.get('replies', [])) for item in unmatched)
+                conversation['total_items'] = conversation['total_main_tweets'] + conversation['total_replies']
+                yield conversation
+
+            if should_stop:
+                # El checkpoint combinado se conserva para poder reanudar
+                return
+
+            if saved_filename:
+                remove_dataset_files([os.path.join('scraping', saved_filename)])
+
+    @profiled('save')
+    def save_to_json(self, data, filename=None):
+        """
+        Guarda los datos en un archivo JSON
+
+        Args:
+            data: Datos a guardar
+            filename: Nombre del archivo (opcional)
+        """
+        # Si ya tiene status=completed y fue guardado incrementalmente, devolver el path existente
+        if data.get('status') == 'completed' and data.get('incremental_saved'):
+            saved_filename = data.get('_saved_filename')
+            if saved_filename:
+                filepath_existing = os.path.join('scraping', saved_filename)
+                if os.path.exists(filepath_existing):
+                    self._update_index(data, filepath_existing)
+                    return filepath_existing
+
+        # Crear carpeta scraping si no existe
+        scraping_dir = 'scraping'
+        if not os.path.exists(scraping_dir):
+            os.makedirs(scraping_dir)
+
+        if not filename:
+            query = query_filename(data['query'])
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            filename = f"{query}_{timestamp}.json"
+
+        # Guardar en la carpeta scraping
+        filepath = os.path.join(scraping_dir, filename)
+        atomic_write_dataset(filepath, normalize_users(data) if self.normalize_users else data,
+                             backups=self.checkpoint_backups)
+
+        print(f"\n✓ Datos guardados en: {filepath}")
+        self._update_index(data, filepath)
+        return filepath
+
+    @profiled('index')
+    def _update_index(self, data, filepath):
+        """Añade un dataset guardado al índice de búsqueda (si está activo)"""
+        if not self.search_index:
+            return
+        try:
+            count = self.search_index.add_dataset(data, filepath)
+            print(f"🔎 Índice de búsqueda actualizado: {count} elementos")
+        except sqlite3.Error as e:
+            print(f"⚠️  No se pudo actualizar el índice de búsqueda: {e}")
+
+    @profiled('export')
+    def export_to_csv(self, data, csv_filename=None):
+        """
+        Exporta los datos a formato CSV
+
+        Args:
+            data: Diccionario con los datos
+            csv_filename: Nombre del archivo CSV (opcional)
+        """
+        try:
+            import csv
+
+            scraping_dir = 'scraping'
+            if not csv_filename:
+                query = query_filename(data['query'])
+                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                csv_filename = f"{query}_{timestamp}.csv"
+
+            csv_filepath = os.path.join(scraping_dir, csv_filename)
+
+            # Preparar datos para CSV
+            rows = []
+            users = data.get('users')
+            for item in data['tweets']:
+                row = tweet_csv_row(item['tweet'], users)
+                row['num_respuestas_descargadas'] = len(item.get('replies', []))
+                rows.append(row)
+
+            # Escribir CSV
+            if rows:
+                with open(csv_filepath, 'w', newline='', encoding='utf-8-sig') as f:
+                    writer = csv.DictWriter(f, fieldnames=rows[0].keys())
+                    writer.writeheader()
+                    writer.writerows(rows)
+
+                print(f"✓ CSV exportado en: {csv_filepath}")
+                return csv_filepath
+            else:
+                print("⚠️  No hay datos para exportar a CSV")
+                return None
+
+        except Exception as e:
+            print(f"❌ Error al exportar CSV: {e}")
+            return None
+
+    @profiled('filters')
+    def apply_filters(self, data, min_likes=None, verified_only=False, tweet_filter=None):
+        """
+        Aplica filtros a los tweets
+
+        Args:
+            data: Diccionario con los tweets
+            min_likes: Mínimo de likes requeridos
+            verified_only: Solo usuarios verificados
+            tweet_filter: TweetFilter adicional (retweets, vistas, fechas, idioma, multimedia, regex...)
+
+        Returns:
+            Diccionario filtrado
+        """
+        items = data['tweets']
+        original_count = len(items)
+        combined = TweetFilter(min_likes=min_likes, verified_only=verified_only) & tweet_filter
+
+        filtered_tweets = combined.apply_items(items)
+        total_replies = sum(len(item['replies']) for item in filtered_tweets)
+
+        data['tweets'] = filtered_tweets
+        data['total_main_tweets'] = len(filtered_tweets)
+        data['total_replies'] = total_replies
+        data['total_items'] = len(filtered_tweets) + total_replies
+        if 'analytics' in data and len(filtered_tweets) != original_count:
+            # Las estadísticas deben describir solo lo que queda en el dataset
+            data['analytics'] = StreamingAggregator().add_items(filtered_tweets).summary()
+
+        filtered_count = len(filtered_tweets)
+        print(f"\n✓ Filtros aplicados: {original_count} tweets → {filtered_count} tweets")
+
+        return data
+
+class _ClosingConnection:
+    """Context manager que cierra la conexión SQLite al salir"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, *exc):
+        self.conn.close()
+
+
+class SQLiteWorkQueue:
+    """
+    Cola de tareas compartida en un archivo SQLite
 
-                response = requests.get(
-                    f"{self.base_url}/tweets/{tweet_id}/replies",
-                    headers=self.headers,
-                    params=params
+    Varios procesos (en la misma máquina o con el archivo en un disco
+    compartido) toman tareas con un lease temporal. Si un worker muere sin
+    completar su tarea, el lease caduca y la tarea vuelve a la cola.
+    """
+
+    def __init__(self, path=os.path.join('scraping', 'queue.db'), lease_seconds=300, max_attempts=3):
+        """
+        Args:
+            path: Ruta del archivo SQLite
+            lease_seconds: Duración del lease de cada tarea (se renueva con heartbeat)
+            max_attempts: Intentos antes de marcar una tarea como fallida
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    worker TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    updated_at REAL
                 )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, id)")
 
-                response.raise_for_status()
-                data = response.json()
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return _ClosingConnection(conn)
 
-                replies = data.get('tweets', [])
+    def put(self, kind, payload):
+        """
+        Encola una tarea
 
-                if not replies:
-                    break
+        Args:
+            kind: Tipo de tarea ('query', 'slice' o 'replies')
+            payload: Diccionario con los parámetros de la tarea
 
-                all_replies.extend(replies)
-                cursor = data.get('cursor')
+        Returns:
+            ID de la tarea
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO tasks (kind, payload, updated_at) VALUES (?, ?, ?)",
+                (kind, json.dumps(payload, ensure_ascii=False), time.time())
+            )
+            return cursor.lastrowid
 
-                if not cursor:
-                    break
+    def lease(self, worker_id):
+        """
+        Toma la siguiente tarea pendiente (devolviendo antes a la cola las de leases caducados)
 
-                time.sleep(0.5)
+        Returns:
+            Diccionario {'id', 'kind', 'payload', 'attempts'} o None si no hay tareas
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "UPDATE tasks SET status = 'pending', worker = NULL "
+                    "WHERE status = 'leased' AND lease_expires < ? AND attempts < ?",
+                    (now, self.max_attempts)
+                )
+                conn.execute(
+                    "UPDATE tasks SET status = 'failed', error = 'lease caducado demasiadas veces' "
+                    "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                    (now, self.max_attempts)
+                )
+                row = conn.execute(
+                    "SELECT id, kind, payload, attempts FROM tasks WHERE status = 'pending' ORDER BY id LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+
+                conn.execute(
+                    "UPDATE tasks SET status = 'leased', worker = ?, lease_expires = ?, "
+                    "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (worker_id, now + self.lease_seconds, now, row['id'])
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
 
-            except Exception as e:
-                print(f"Error obteniendo respuestas del tweet {tweet_id}: {e}")
-                break
+        return {'id': row['id'], 'kind': row['kind'], 'payload': json.loads(row['payload']), 'attempts': row['attempts'] + 1}
 
-        return all_replies
+    def heartbeat(self, task_id, worker_id, progress=None):
+        """
+        Renueva el lease de una tarea e informa del progreso (checkpoint actual)
+
+        Returns:
+            True si el worker sigue siendo el dueño del lease
+        """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET lease_expires = ?, updated_at = ?, result = COALESCE(?, result) "
+                "WHERE id = ? AND worker = ? AND status = 'leased'",
+                (now + self.lease_seconds, now, json.dumps(progress) if progress else None, task_id, worker_id)
+            )
+            return cursor.rowcount == 1
 
-    def download_full_conversation(self, query, mode='latest', max_tweets=None, include_replies=True, is_hashtag=True, until_date=None, since_date=None, incremental_save=True):
+    def complete(self, task_id, worker_id, result):
         """
-        Descarga la conversación completa incluyendo respuestas
+        Marca una tarea como completada con su resultado
+
+        Returns:
+            True si se registró (False si el lease ya se había perdido)
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET status = 'done', result = ?, lease_expires = NULL, updated_at = ? "
+                "WHERE id = ? AND worker = ? AND status = 'leased'",
+                (json.dumps(result, ensure_ascii=False), time.time(), task_id, worker_id)
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, task_id, worker_id, error):
+        """Registra un error: la tarea vuelve a la cola o queda fallida si agotó sus intentos"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "worker = NULL, lease_expires = NULL, error = ?, updated_at = ? "
+                "WHERE id = ? AND worker = ? AND status = 'leased'",
+                (self.max_attempts, str(error), time.time(), task_id, worker_id)
+            )
+
+    def release(self, task_id, worker_id):
+        """Devuelve una tarea a la cola sin contar el intento (p. ej. al detener el worker)"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = 'pending', worker = NULL, lease_expires = NULL, "
+                "attempts = attempts - 1, updated_at = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (time.time(), task_id, worker_id)
+            )
+
+    def stats(self):
+        """Número de tareas por estado"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM tasks GROUP BY status").fetchall()
+            return {row['status']: row['n'] for row in rows}
+
+
+class RedisWorkQueue:
+    """
+    Cola de tareas en Redis con la misma interfaz que SQLiteWorkQueue
+
+    Requiere el paquete opcional `redis`. Estructuras usadas (prefijo `name`):
+    - name:tasks   hash id -> tarea en JSON
+    - name:pending lista de IDs pendientes
+    - name:leases  sorted set id -> expiración del lease
+    """
+
+    # Reclama los leases caducados y toma la siguiente tarea en una sola operación
+    # atómica: dos workers nunca pueden quedarse con la misma tarea.
+    # KEYS: tasks, pending, leases | ARGV: ahora, lease_seconds, max_attempts, worker_id
+    LEASE_SCRIPT = """
+        local now = tonumber(ARGV[1])
+        for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[3], 0, now)) do
+            redis.call('ZREM', KEYS[3], id)
+            local raw = redis.call('HGET', KEYS[1], id)
+            if raw then
+                local task = cjson.decode(raw)
+                if task['attempts'] < tonumber(ARGV[3]) then
+                    task['status'] = 'pending'
+                    task['worker'] = cjson.null
+                    redis.call('LPUSH', KEYS[2], id)
+                else
+                    task['status'] = 'failed'
+                    task['error'] = 'lease caducado demasiadas veces'
+                end
+                redis.call('HSET', KEYS[1], id, cjson.encode(task))
+            end
+        end
+
+        local id = redis.call('RPOP', KEYS[2])
+        if not id then
+            return false
+        end
+        local task = cjson.decode(redis.call('HGET', KEYS[1], id))
+        task['status'] = 'leased'
+        task['worker'] = ARGV[4]
+        task['attempts'] = task['attempts'] + 1
+        local encoded = cjson.encode(task)
+        redis.call('HSET', KEYS[1], id, encoded)
+        redis.call('ZADD', KEYS[3], now + tonumber(ARGV[2]), id)
+        return encoded
+    """
+
+    # Comprobación de propiedad y actualización en una sola operación atómica: un
+    # worker cuyo lease caducó no puede tocar la tarea que ya tiene otro worker.
+    # KEYS: tasks, leases | ARGV: id, worker_id, expiración, progreso en JSON ('' = sin cambios)
+    HEARTBEAT_SCRIPT = """
+        local raw = redis.call('HGET', KEYS[1], ARGV[1])
+        if not raw then
+            return 0
+        end
+        local task = cjson.decode(raw)
+        if task['status'] ~= 'leased' or task['worker'] ~= ARGV[2] then
+            return 0
+        end
+        if ARGV[4] ~= '' then
+            task['result'] = cjson.decode(ARGV[4])
+            redis.call('HSET', KEYS[1], ARGV[1], cjson.encode(task))
+        end
+        redis.call('ZADD', KEYS[2], tonumber(ARGV[3]), ARGV[1])
+        return 1
+    """
+
+    # Cierra un lease: 'done' (resultado en JSON), 'fail' (error) o 'release'
+    # (devuelve la tarea sin gastar un intento)
+    # KEYS: tasks, pending, leases | ARGV: id, worker_id, acción, resultado o error, max_attempts
+    FINISH_SCRIPT = """
+        local raw = redis.call('HGET', KEYS[1], ARGV[1])
+        if not raw then
+            return 0
+        end
+        local task = cjson.decode(raw)
+        if task['status'] ~= 'leased' or task['worker'] ~= ARGV[2] then
+            return 0
+        end
+        redis.call('ZREM', KEYS[3], ARGV[1])
+        if ARGV[3] == 'done' then
+            task['status'] = 'done'
+            task['result'] = cjson.decode(ARGV[4])
+        elseif ARGV[3] == 'fail' then
+            task['worker'] = cjson.null
+            task['error'] = ARGV[4]
+            if task['attempts'] >= tonumber(ARGV[5]) then
+                task['status'] = 'failed'
+            else
+                task['status'] = 'pending'
+                redis.call('LPUSH', KEYS[2], ARGV[1])
+            end
+        else
+            task['status'] = 'pending'
+            task['worker'] = cjson.null
+            task['attempts'] = task['attempts'] - 1
+            redis.call('RPUSH', KEYS[2], ARGV[1])
+        end
+        redis.call('HSET', KEYS[1], ARGV[1], cjson.encode(task))
+        return 1
+    """
+
+    def __init__(self, url, name='scraper', lease_seconds=300, max_attempts=3):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("RedisWorkQueue necesita el paquete 'redis' (pip install redis)")
+
+        self.redis = redis.Redis.from_url(url)
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lease_script = self.redis.register_script(self.LEASE_SCRIPT)
+        self._heartbeat_script = self.redis.register_script(self.HEARTBEAT_SCRIPT)
+        self._finish_script = self.redis.register_script(self.FINISH_SCRIPT)
+
+    def _key(self, suffix):
+        return f"{self.name}:{suffix}"
+
+    def _store(self, task):
+        self.redis.hset(self._key('tasks'), task['id'], json.dumps(task, ensure_ascii=False))
+
+    def put(self, kind, payload):
+        task_id = str(self.redis.incr(self._key('next_id')))
+        self._store({'id': task_id, 'kind': kind, 'payload': payload, 'status': 'pending', 'attempts': 0})
+        self.redis.lpush(self._key('pending'), task_id)
+        return task_id
+
+    def lease(self, worker_id):
+        raw = self._lease_script(
+            keys=[self._key('tasks'), self._key('pending'), self._key('leases')],
+            args=[time.time(), self.lease_seconds, self.max_attempts, worker_id]
+        )
+        if not raw:
+            return None
+        task = json.loads(raw)
+        return {'id': str(task['id']), 'kind': task['kind'], 'payload': task['payload'], 'attempts': int(task['attempts'])}
+
+    def _finish(self, task_id, worker_id, action, value):
+        return bool(self._finish_script(
+            keys=[self._key('tasks'), self._key('pending'), self._key('leases')],
+            args=[task_id, worker_id, action, value, self.max_attempts]
+        ))
+
+    def heartbeat(self, task_id, worker_id, progress=None):
+        return bool(self._heartbeat_script(
+            keys=[self._key('tasks'), self._key('leases')],
+            args=[task_id, worker_id, time.time() + self.lease_seconds,
+                  json.dumps(progress, ensure_ascii=False) if progress else '']
+        ))
+
+    def complete(self, task_id, worker_id, result):
+        return self._finish(task_id, worker_id, 'done', json.dumps(result, ensure_ascii=False))
+
+    def fail(self, task_id, worker_id, error):
+        self._finish(task_id, worker_id, 'fail', str(error))
+
+    def release(self, task_id, worker_id):
+        self._finish(task_id, worker_id, 'release', '')
 
+    def stats(self):
+        counts = {}
+        for raw in self.redis.hvals(self._key('tasks')):
+            status = json.loads(raw)['status']
+            counts[status] = counts.get(status, 0) + 1
+        return counts
+
+
+class TweetIndex:
+    """
+    Índice de texto completo (SQLite FTS5) de los datasets de scraping/
+
+    Indexa texto, hashtags y usuario de tweets y respuestas, con fecha y
+    métricas en una tabla aparte para filtrar por rango y engagement. Cada
+    tweet aparece una vez (por id); al reindexar se actualizan sus métricas.
+    Los archivos ya indexados y sin cambios (tamaño y fecha) se omiten.
+    """
+
+    def __init__(self, path=os.path.join('scraping', 'index.db')):
+        """
         Args:
-            query: El término a buscar (hashtag o texto)
+            path: Ruta del archivo SQLite del índice
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS tweets (
+                    rowid INTEGER PRIMARY KEY,
+                    tweet_id TEXT NOT NULL UNIQUE,
+                    kind TEXT NOT NULL,
+                    parent_id TEXT,
+                    username TEXT,
+                    timestamp INTEGER,
+                    likes INTEGER,
+                    retweets INTEGER,
+                    views INTEGER,
+                    query TEXT,
+                    source TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_tweets_timestamp ON tweets (timestamp);
+                CREATE INDEX IF NOT EXISTS idx_tweets_likes ON tweets (likes);
+                CREATE INDEX IF NOT EXISTS idx_tweets_username ON tweets (username);
+                CREATE VIRTUAL TABLE IF NOT EXISTS tweets_fts USING fts5(
+                    text, hashtags, username, tokenize = 'unicode61 remove_diacritics 2'
+                );
+                CREATE TABLE IF NOT EXISTS sources (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER,
+                    mtime REAL
+                );
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return _ClosingConnection(conn)
+
+    def _upsert(self, conn, tweet, kind, parent_id, query, source):
+        tweet_id = tweet.get('id')
+        if not tweet_id:
+            return False
+        hashtags = ' '.join(h.lstrip('#') for h in tweet.get('hashtags') or [])
+        values = (kind, parent_id, tweet.get('username'), tweet.get('timestamp'), tweet.get('likes') or 0,
+                  tweet.get('retweets') or 0, int(tweet.get('views') or 0), query, source)
+
+        row = conn.execute("SELECT rowid FROM tweets WHERE tweet_id = ?", (tweet_id,)).fetchone()
+        if row:
+            conn.execute("""
+                UPDATE tweets SET kind = ?, parent_id = ?, username = ?, timestamp = ?, likes = ?,
+                                  retweets = ?, views = ?, query = ?, source = ?
+                WHERE rowid = ?
+            """, values + (row['rowid'],))
+            conn.execute("DELETE FROM tweets_fts WHERE rowid = ?", (row['rowid'],))
+            rowid = row['rowid']
+        else:
+            rowid = conn.execute("""
+                INSERT INTO tweets (tweet_id, kind, parent_id, username, timestamp, likes, retweets, views, query, source)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (tweet_id,) + values).lastrowid
+        conn.execute("INSERT INTO tweets_fts (rowid, text, hashtags, username) VALUES (?, ?, ?, ?)",
+                     (rowid, tweet.get('text') or '', hashtags, tweet.get('username') or ''))
+        return True
+
+    def add_dataset(self, data, source=None):
+        """
+        Indexa (o actualiza) los tweets y respuestas de un dataset
+
+        Args:
+            data: Dataset de download_full_conversation (normalizado o no)
+            source: Ruta del archivo de origen
+
+        Returns:
+            Número de tweets y respuestas indexados
+        """
+        data = denormalize_users(data)
+        query = data.get('query')
+        count = 0
+        with self._connect() as conn:
+            conn.execute("BEGIN")
+            for item in data.get('tweets', []):
+                tweet = item['tweet']
+                count += self._upsert(conn, tweet, 'tweet', None, query, source)
+                for reply in item.get('replies', []):
+                    count += self._upsert(conn, reply, 'reply', tweet.get('id'), query, source)
+            if source and os.path.exists(source):
+                stat = os.stat(source)
+                conn.execute("INSERT OR REPLACE INTO sources (path, size, mtime) VALUES (?, ?, ?)",
+                             (source, stat.st_size, stat.st_mtime))
+            conn.execute("COMMIT")
+        return count
+
+    def add_stream(self, filepath):
+        """
+        Indexa un dataset incremental JSONL del modo monitoreo (ver DeltaExporter)
+
+        Las líneas que no son tweets exportados (sin '_type') se ignoran.
+        """
+        items = []
+        with open(filepath, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    if not isinstance(record, dict) or '_type' not in record:
+                        continue
+                    items.append((record.pop('_type', 'tweet'), record.pop('_parent_id', '') or None, record))
+
+        query = os.path.basename(filepath).split('_stream')[0]
+        with self._connect() as conn:
+            conn.execute("BEGIN")
+            count = sum(self._upsert(conn, tweet, kind, parent_id, query, filepath) for kind, parent_id, tweet in items)
+            stat = os.stat(filepath)
+            conn.execute("INSERT OR REPLACE INTO sources (path, size, mtime) VALUES (?, ?, ?)",
+                         (filepath, stat.st_size, stat.st_mtime))
+            conn.execute("COMMIT")
+        return count
+
+    def index_directory(self, directory='scraping', rebuild=False):
+        """
+        Indexa los .json y .jsonl de una carpeta que hayan cambiado desde la última vez
+
+        Args:
+            directory: Carpeta con los datasets
+            rebuild: Si True, vacía el índice y lo reconstruye
+
+        Returns:
+            Tupla (archivos_indexados, tweets_indexados)
+        """
+        with self._connect() as conn:
+            if rebuild:
+                conn.executescript("DELETE FROM tweets; DELETE FROM tweets_fts; DELETE FROM sources;")
+            known = {row['path']: (row['size'], row['mtime']) for row in conn.execute("SELECT * FROM sources")}
+
+        files = 0
+        tweets = 0
+        for filename in sorted(os.listdir(directory)):
+            filepath = os.path.join(directory, filename)
+            if not (filename.endswith('.json') or filename.endswith('.jsonl')) or not os.path.isfile(filepath):
+                continue
+            stat = os.stat(filepath)
+            if known.get(filepath) == (stat.st_size, stat.st_mtime):
+                continue
+            try:
+                if filename.endswith('.jsonl'):
+                    tweets += self.add_stream(filepath)
+                else:
+                    data, _ = load_checkpoint(filepath)
+                    if not isinstance(data, dict) or 'tweets' not in data:
+                        continue
+                    tweets += self.add_dataset(data, filepath)
+                files += 1
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Se omite {filename}: {e}")
+        return files, tweets
+
+    def search(self, text=None, since_date=None, until_date=None, min_likes=None, min_retweets=None,
+               username=None, hashtag=None, kind=None, order='rank', limit=20):
+        """
+        Busca tweets en el índice
+
+        Args:
+            text: Consulta FTS5 (palabras, "frases", OR, NOT, prefijo*)
+            since_date: Fecha inicial (YYYY-MM-DD o YYYY-MM-DD HH:MM)
+            until_date: Fecha final, exclusiva (mismo formato)
+            min_likes: Mínimo de likes
+            min_retweets: Mínimo de retweets
+            username: Usuario exacto (sin @)
+            hashtag: Hashtag (sin #)
+            kind: 'tweet' o 'reply' (None = ambos)
+            order: 'rank' (relevancia), 'date' (más recientes) o 'likes'
+            limit: Número máximo de resultados
+
+        Returns:
+            Lista de diccionarios con id, tipo, usuario, fecha, métricas y texto
+        """
+        match = []
+        if text:
+            match.append(f"({text})")
+        if hashtag:
+            match.append(f'hashtags:"{hashtag.lstrip("#")}"')
+
+        conditions = []
+        params = []
+        if match:
+            conditions.append("tweets_fts MATCH ?")
+            params.append(' AND '.join(match))
+        if since_date:
+            conditions.append("t.timestamp >= ?")
+            params.append(parse_date_limit(since_date))
+        if until_date:
+            conditions.append("t.timestamp < ?")
+            params.append(parse_date_limit(until_date))
+        if min_likes is not None:
+            conditions.append("t.likes >= ?")
+            params.append(min_likes)
+        if min_retweets is not None:
+            conditions.append("t.retweets >= ?")
+            params.append(min_retweets)
+        if username:
+            conditions.append("t.username = ? COLLATE NOCASE")
+            params.append(username.lstrip('@'))
+        if kind:
+            conditions.append("t.kind = ?")
+            params.append(kind)
+
+        order_by = {
+            'rank': 'bm25(tweets_fts)' if match else 't.timestamp DESC',
+            'date': 't.timestamp DESC',
+            'likes': 't.likes DESC'
+        }[order]
+        sql = f"""
+            SELECT t.tweet_id, t.kind, t.parent_id, t.username, t.timestamp, t.likes, t.retweets,
+                   t.views, t.query, t.source, f.text
+            FROM tweets t JOIN tweets_fts f ON f.rowid = t.rowid
+            {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+            ORDER BY {order_by}
+            LIMIT ?
+        """
+        with self._connect() as conn:
+            rows = conn.execute(sql, params + [limit]).fetchall()
+        return [
+            {
+                'id': row['tweet_id'],
+                'kind': row['kind'],
+                'parent_id': row['parent_id'],
+                'username': row['username'],
+                'timestamp': row['timestamp'],
+                'likes': row['likes'],
+                'retweets': row['retweets'],
+                'views': row['views'],
+                'query': row['query'],
+                'source': row['source'],
+                'text': row['text']
+            }
+            for row in rows
+        ]
+
+    def stats(self):
+        """Número de tweets, respuestas y archivos indexados"""
+        with self._connect() as conn:
+            counts = dict(conn.execute("SELECT kind, COUNT(*) FROM tweets GROUP BY kind").fetchall())
+            files = conn.execute("SELECT COUNT(*) FROM sources").fetchone()[0]
+        return {'tweets': counts.get('tweet', 0), 'replies': counts.get('reply', 0), 'files': files}
+
+
+# Cursor y lista de tweets de una respuesta de la API sin parsear el JSON completo
+CURSOR_PATTERN = re.compile(rb'"cursor"\s*:\s*(?:"((?:[^"\\]|\\.)*)"|null)')
+NON_EMPTY_TWEETS_PATTERN = re.compile(rb'"tweets"\s*:\s*\[\s*[^\]\s]')
+
+
+def extract_cursor(body):
+    """
+    Cursor de la página siguiente leído del cuerpo crudo con una expresión regular
+
+    Args:
+        body: Cuerpo de la respuesta (bytes)
+
+    Returns:
+        Cursor o None si no hay más páginas
+    """
+    match = CURSOR_PATTERN.search(body)
+    if not match or match.group(1) is None:
+        return None
+    return json.loads(b'"' + match.group(1) + b'"') or None
+
+
+def page_tweets(data):
+    """Tweets de una respuesta ya parseada (búsqueda en data.tweets, respuestas en tweets)"""
+    if 'data' in data and isinstance(data['data'], dict) and 'tweets' in data['data']:
+        return data['data']['tweets']
+    return data.get('tweets', [])
+
+
+class ArchivedPage:
+    """
+    Página descargada de la API o guardada en el PageArchive
+
+    El cuerpo se descomprime y se parsea solo la primera vez que se piden sus
+    datos (body, json() o tweets); los metadatos están disponibles sin hacerlo.
+    """
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.endpoint = row['endpoint']
+        self.query = row['query']
+        self.request = row['request']
+        self.mode = row['mode']
+        self.cursor = row['cursor'] or None
+        self.next_cursor = row['next_cursor'] or None
+        self.status = row['status']
+        self.fetched_at = row['fetched_at']
+        self.raw_size = row['raw_size']
+        self._compressed = row['body']
+        self._body = None
+        self._data = None
+
+    @classmethod
+    def from_response(cls, endpoint, query, response, request=None, mode=None, cursor=None):
+        """
+        Página recién descargada (sin guardar todavía: id None)
+
+        Args:
+            endpoint: 'search' o 'replies'
+            query: Término de búsqueda o ID del tweet (clave para leerla después)
+            response: requests.Response
+            request: Query enviado a la API (con operadores de fecha, etc.)
             mode: Modo de búsqueda
-            max_tweets: Número máximo de tweets principales (None = todos disponibles)
-            include_replies: Si incluir las respuestas de cada tweet
-            is_hashtag: Si True, trata como hashtag. Si False, como texto libre
-            until_date: Fecha límite superior (más reciente) - formato: YYYY-MM-DD
-            since_date: Fecha límite inferior (más antigua) - formato: YYYY-MM-DD
-            incremental_save: Si True, guarda progresivamente (por defecto True)
+            cursor: Cursor de la petición (None = primera página)
+        """
+        body = response.content
+        page = cls({
+            'id': None, 'endpoint': endpoint, 'query': str(query), 'request': request, 'mode': mode,
+            'cursor': cursor, 'next_cursor': extract_cursor(body) if response.status_code == 200 else None,
+            'status': response.status_code, 'fetched_at': time.time(), 'raw_size': len(body), 'body': None
+        })
+        page._body = body
+        return page
+
+    @property
+    def body(self):
+        """Cuerpo original de la respuesta (bytes)"""
+        if self._body is None:
+            self._body = zlib.decompress(self._compressed)
+        return self._body
+
+    def json(self):
+        """Respuesta parseada (se cachea)"""
+        if self._data is None:
+            self._data = json.loads(self.body)
+        return self._data
+
+    @property
+    def tweets(self):
+        return page_tweets(self.json())
+
+
+class PageArchive:
+    """
+    Archivo de respuestas crudas de la API en SQLite, comprimidas con zlib
+
+    Cada página de búsqueda o de respuestas se guarda tal cual llegó, con el
+    término (o el ID del tweet), el query enviado, el modo y los cursores de
+    la petición y de la página siguiente. Permite auditar lo descargado y
+    regenerar datasets con otras proyecciones o filtros sin llamar a la API;
+    las páginas se parsean solo cuando se leen sus tweets.
+    """
+
+    def __init__(self, path=os.path.join('scraping', 'pages.db'), level=6):
+        """
+        Args:
+            path: Ruta del archivo SQLite
+            level: Nivel de compresión zlib (1-9)
+        """
+        self.path = path
+        self.level = level
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS pages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    endpoint TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    request TEXT,
+                    mode TEXT,
+                    cursor TEXT,
+                    next_cursor TEXT,
+                    status INTEGER,
+                    fetched_at REAL,
+                    raw_size INTEGER,
+                    body BLOB
+                );
+                CREATE INDEX IF NOT EXISTS idx_pages_query ON pages (endpoint, query, mode, id);
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return _ClosingConnection(conn)
+
+    def store(self, page):
+        """
+        Guarda el cuerpo crudo de una página descargada
+
+        Args:
+            page: ArchivedPage de ArchivedPage.from_response
 
         Returns:
-            Diccionario con tweets y respuestas
+            La misma página, con el id asignado en el archivo
         """
-        global should_stop
+        with self._connect() as conn:
+            page.id = conn.execute(
+                "INSERT INTO pages (endpoint, query, request, mode, cursor, next_cursor, status, fetched_at, raw_size, body) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (page.endpoint, page.query, page.request, page.mode, page.cursor or '', page.next_cursor or '',
+                 page.status, page.fetched_at, page.raw_size, sqlite3.Binary(zlib.compress(page.body, self.level)))
+            ).lastrowid
+        return page
+
+    def pages(self, endpoint='search', query=None, mode=None):
+        """
+        Páginas correctas (HTTP 200) guardadas, en orden de descarga
 
-        # Preparar nombre de archivo para guardado incremental
-        query_clean = query.replace('#', '').replace(' ', '_')
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        partial_filename = f"{query_clean}_{timestamp}.json"
+        Args:
+            endpoint: 'search' o 'replies'
+            query: Término o ID del tweet (None = todos)
+            mode: Modo de búsqueda (None = todos)
 
-        # Buscar tweets principales con guardado incremental
-        main_tweets = self.search_tweets(query, mode, max_tweets, is_hashtag, until_date, since_date, incremental_save, partial_filename)
+        Yields:
+            ArchivedPage (sin descomprimir ni parsear)
+        """
+        sql = "SELECT * FROM pages WHERE endpoint = ? AND status = 200"
+        params = [endpoint]
+        if query is not None:
+            sql += " AND query = ?"
+            params.append(str(query))
+        if mode is not None:
+            sql += " AND mode = ?"
+            params.append(mode)
+        with self._connect() as conn:
+            for row in conn.execute(sql + " ORDER BY id", params):
+                yield ArchivedPage(row)
+
+    def tweets(self, query, mode=None):
+        """
+        Tweets de las búsquedas archivadas de un término, sin repetir IDs
 
-        conversation = {
+        Yields:
+            Tweet tal como lo devolvió la API (la copia más reciente de cada ID
+            no sustituye a la primera: el orden es el de descarga)
+        """
+        seen = set()
+        for page in self.pages('search', query, mode):
+            for tweet in page.tweets:
+                tweet_id = tweet.get('id')
+                if tweet_id and tweet_id not in seen:
+                    seen.add(tweet_id)
+                    yield tweet
+
+    def replies(self, tweet_id):
+        """Respuestas archivadas de un tweet, sin repetir IDs"""
+        seen = set()
+        replies = []
+        for page in self.pages('replies', tweet_id):
+            for reply in page.tweets:
+                reply_id = reply.get('id')
+                if reply_id and reply_id not in seen:
+                    seen.add(reply_id)
+                    replies.append(reply)
+        return replies
+
+    def rebuild(self, query, mode=None, is_hashtag=True, tweet_filter=None, include_replies=True):
+        """
+        Regenera un dataset a partir de las páginas archivadas, sin peticiones a la API
+
+        Args:
+            query: Término de búsqueda tal como se descargó
+            mode: Modo de búsqueda (None = todos los archivados)
+            is_hashtag: Tipo de búsqueda que se guarda en el dataset
+            tweet_filter: TweetFilter aplicado a los tweets principales
+            include_replies: Si True, añade las respuestas archivadas de cada tweet
+
+        Returns:
+            Diccionario con el formato de download_full_conversation
+        """
+        main_tweets = list(self.tweets(query, mode))
+        if tweet_filter:
+            main_tweets = tweet_filter.apply(main_tweets)
+
+        items = [{'tweet': tweet, 'replies': self.replies(tweet.get('id')) if include_replies else []}
+                 for tweet in main_tweets]
+        total_replies = sum(len(item['replies']) for item in items)
+
+        return {
             'query': query,
             'search_type': 'hashtag' if is_hashtag else 'text',
-            'mode': mode,
+            'mode': mode or 'latest',
             'downloaded_at': datetime.now().isoformat(),
-            'total_main_tweets': len(main_tweets),
-            'tweets': []
+            'status': 'completed',
+            'source': 'page_archive',
+            'total_main_tweets': len(items),
+            'tweets': items,
+            'total_replies': total_replies,
+            'total_items': len(items) + total_replies,
+            'analytics': StreamingAggregator().add_items(items).summary()
         }
 
-        # Obtener respuestas si se solicita
-        if include_replies:
-            print("\n" + "=" * 50)
-            print("Descargando respuestas...")
-            print("=" * 50)
+    def stats(self):
+        """Páginas archivadas por endpoint y tamaño original frente a comprimido"""
+        with self._connect() as conn:
+            pages = dict(conn.execute("SELECT endpoint, COUNT(*) FROM pages GROUP BY endpoint").fetchall())
+            raw, stored = conn.execute("SELECT COALESCE(SUM(raw_size), 0), COALESCE(SUM(LENGTH(body)), 0) FROM pages").fetchone()
+        return {'search_pages': pages.get('search', 0), 'reply_pages': pages.get('replies', 0),
+                'raw_bytes': raw, 'stored_bytes': stored}
 
-            for i, tweet in enumerate(main_tweets, 1):
-                # Verificar si se debe detener
-                if should_stop:
-                    print("\n⚠️  Descarga de respuestas interrumpida")
-                    # Marcar como incompleto
-                    conversation['status'] = 'in_progress'
-                    break
 
-                tweet_data = {
-                    'tweet': tweet,
-                    'replies': []
-                }
+def find_dataset_files(query, directory='scraping', include_in_progress=False):
+    """
+    Datasets de una búsqueda ({query}_{AAAAMMDD_HHMMSS}.json) en una carpeta
+
+    Args:
+        query: Término de búsqueda (con o sin #)
+        directory: Carpeta donde buscar
+        include_in_progress: Si False, omite las descargas sin terminar (se pueden reanudar)
+
+    Returns:
+        Lista de rutas ordenada por nombre (de la más antigua a la más reciente)
+    """
+    query_clean = query_filename(query)
+    pattern = re.compile(rf'^{re.escape(query_clean)}_\d{{8}}_\d{{6}}\.json$')
+    files = []
+    for filename in sorted(os.listdir(directory)):
+        if not pattern.match(filename):
+            continue
+        filepath = os.path.join(directory, filename)
+        if not include_in_progress:
+            # Basta con los metadatos; solo se carga el archivo si no se pueden leer aparte
+            data = read_dataset_meta(filepath)
+            if data is None:
+                try:
+                    data, _ = load_checkpoint(filepath)
+                except ValueError:
+                    continue
+            if data.get('status') == 'in_progress':
+                print(f"⚠️  Se omite {filename}: descarga sin terminar (se puede reanudar)")
+                continue
+        files.append(filepath)
+    return files
+
+
+def compact_datasets(files, output_path, run_size=5000, csv_path=None):
+    """
+    Fusiona varios datasets de una búsqueda en uno sin duplicados y ordenado por fecha
+
+    Merge externo con memoria acotada: cada archivo se carga de uno en uno y se
+    vuelca en tramos ordenados de como mucho run_size elementos (NDJSON en una
+    carpeta temporal); después heapq.merge recorre todos los tramos a la vez y
+    escribe el resultado en streaming. Los duplicados quedan contiguos: se
+    conservan las métricas del archivo más reciente (downloaded_at) y el
+    conjunto de respuestas más grande. El JSON de salida tiene un tweet por
+    línea dentro de 'tweets'.
+
+    Args:
+        files: Rutas de los datasets a fusionar
+        output_path: Ruta del dataset resultante
+        run_size: Elementos máximos por tramo ordenado (memoria del merge)
+        csv_path: Si se indica, escribe también el CSV del resultado
+
+    Returns:
+        Diccionario con elementos leídos/escritos, duplicados y bytes antes/después
+    """
+    import csv
+    from contextlib import ExitStack
 
-                # Obtener respuestas
-                tweet_id = tweet.get('id')
-                if tweet_id:
-                    print(f"\nTweet {i}/{len(main_tweets)} - ID: {tweet_id}")
-                    replies = self.get_tweet_replies(tweet_id)
-                    tweet_data['replies'] = replies
-                    print(f"  Respuestas encontradas: {len(replies)}")
+    def sort_key(item):
+        tweet = item['tweet']
+        return [-(tweet.get('timestamp') or 0), str(tweet.get('id', ''))]
 
-                conversation['tweets'].append(tweet_data)
+    output_dir = os.path.dirname(output_path) or '.'
+    run_dir = tempfile.mkdtemp(prefix='compact_', dir=output_dir)
+    runs = []
+    header = None
+    items_in = 0
+    tmp_path = None
 
-                # Guardado incremental después de cada tweet con respuestas
-                if incremental_save and (i % 5 == 0 or i == len(main_tweets)):  # Cada 5 tweets o al final
-                    conversation['total_replies'] = sum(len(t['replies']) for t in conversation['tweets'])
-                    conversation['total_items'] = conversation['total_main_tweets'] + conversation['total_replies']
-                    conversation['status'] = 'in_progress' if i < len(main_tweets) else 'completed'
-
-                    scraping_dir = 'scraping'
-                    if not os.path.exists(scraping_dir):
-                        os.makedirs(scraping_dir)
-                    filepath = os.path.join(scraping_dir, partial_filename)
-                    with open(filepath, 'w', encoding='utf-8') as f:
-                        json.dump(conversation, f, ensure_ascii=False, indent=2)
-                    print(f"  💾 Guardado incremental: {i}/{len(main_tweets)} tweets procesados")
-        else:
-            conversation['tweets'] = [{'tweet': tweet, 'replies': []} for tweet in main_tweets]
+    try:
+        # Fase 1: un archivo cada vez -> tramos ordenados
+        for filepath in files:
+            data, _ = load_dataset(filepath)
+            if header is None:
+                header = {k: data.get(k) for k in ('query', 'search_type', 'mode')}
+            fetched_at = data.get('downloaded_at', '')
+            items = data.get('tweets', [])
+            items_in += len(items)
+            for start in range(0, len(items), run_size):
+                chunk = sorted(items[start:start + run_size], key=sort_key)
+                run_path = os.path.join(run_dir, f"run_{len(runs):05d}.ndjson")
+                with open(run_path, 'w', encoding='utf-8') as f:
+                    for item in chunk:
+                        f.write(json.dumps({'k': sort_key(item), 'f': fetched_at, 'item': item}, ensure_ascii=False) + '\n')
+                runs.append(run_path)
+            del data, items
+
+        def read_run(f):
+            for line in f:
+                yield json.loads(line)
+
+        def merge_duplicates(records):
+            freshest = max(records, key=lambda r: r['f'])
+            richest = max(records, key=lambda r: len(r['item'].get('replies', [])))
+            return dict(richest['item'], tweet=freshest['item']['tweet'])
+
+        # Fase 2: k-way merge en streaming
+        header = header or {'query': None, 'search_type': None, 'mode': None}
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(output_path) + '.', suffix='.tmp', dir=output_dir)
+        items_out = 0
+        replies_out = 0
+        latest_fetch = ''
+        with ExitStack() as stack:
+            streams = [read_run(stack.enter_context(open(path, 'r', encoding='utf-8'))) for path in runs]
+            out = stack.enter_context(os.fdopen(fd, 'w', encoding='utf-8'))
+            writer = None
+            if csv_path:
+                csv_file = stack.enter_context(open(csv_path, 'w', newline='', encoding='utf-8-sig'))
+                writer = csv.DictWriter(csv_file, fieldnames=list(tweet_csv_row({}).keys()) + ['num_respuestas_descargadas'])
+                writer.writeheader()
+
+            out.write('{\n')
+            for key in ('query', 'search_type', 'mode'):
+                out.write(f'  {json.dumps(key)}: {json.dumps(header[key], ensure_ascii=False)},\n')
+            out.write('  "tweets": [\n')
+
+            group = []
+
+            def flush(group):
+                nonlocal items_out, replies_out, latest_fetch
+                item = merge_duplicates(group)
+                out.write((',\n' if items_out else '') + json.dumps(item, ensure_ascii=False))
+                if writer:
+                    writer.writerow(dict(tweet_csv_row(item['tweet']), num_respuestas_descargadas=len(item.get('replies', []))))
+                items_out += 1
+                replies_out += len(item.get('replies', []))
+                latest_fetch = max([latest_fetch] + [r['f'] for r in group])
+
+            for record in heapq.merge(*streams, key=lambda r: r['k']):
+                if group and record['k'] != group[0]['k']:
+                    flush(group)
+                    group = []
+                group.append(record)
+            if group:
+                flush(group)
+
+            summary = {
+                'downloaded_at': latest_fetch or datetime.now().isoformat(),
+                'status': 'completed',
+                'total_main_tweets': items_out,
+                'total_replies': replies_out,
+                'total_items': items_out + replies_out,
+                'compacted_at': datetime.now().isoformat(),
+                'compacted_from': [os.path.basename(f) for f in files]
+            }
+            out.write('\n  ],\n')
+            out.write(',\n'.join(f'  {json.dumps(k)}: {json.dumps(v, ensure_ascii=False)}' for k, v in summary.items()))
+            out.write('\n}\n')
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, output_path)
+        build_offset_index(output_path)
+    finally:
+        for run_path in runs:
+            if os.path.exists(run_path):
+                os.remove(run_path)
+        os.rmdir(run_dir)
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return {
+        'files': len(files),
+        'items_in': items_in,
+        'items_out': items_out,
+        'duplicates': items_in - items_out,
+        'runs': len(runs),
+        'bytes_before': sum(os.path.getsize(f) for f in files if os.path.exists(f)),
+        'bytes_after': os.path.getsize(output_path)
+    }
+
+
+def remove_dataset_files(files):
+    """
+    Elimina datasets (con sus respaldos .bakN, su índice .idx y el CSV del mismo nombre)
 
-        # Calcular estadísticas finales
-        total_replies = sum(len(t['replies']) for t in conversation['tweets'])
-        conversation['total_replies'] = total_replies
-        conversation['total_items'] = len(conversation['tweets']) + total_replies
+    Returns:
+        Bytes liberados
+    """
+    freed = 0
+    for filepath in files:
+        stem = os.path.splitext(filepath)[0]
+        related = [filepath, f"{filepath}.idx", f"{stem}.csv"]
+        generation = 1
+        while os.path.exists(f"{filepath}.bak{generation}"):
+            related.append(f"{filepath}.bak{generation}")
+            generation += 1
+        for path in related:
+            if os.path.exists(path):
+                freed += os.path.getsize(path)
+                os.remove(path)
+    return freed
+
+
+def enqueue_backfill(queue, query, since_date, until_date, slice_hours=24, mode='latest', is_hashtag=True):
+    """
+    Encola una tarea 'slice' por cada franja del rango de fechas
 
-        # Solo marcar como completed si no fue interrumpido
-        if not should_stop and 'status' not in conversation:
-            conversation['status'] = 'completed'
-        elif 'status' not in conversation:
-            conversation['status'] = 'in_progress'
+    Returns:
+        Lista de IDs de tarea
+    """
+    return [
+        queue.put('slice', {
+            'query': query,
+            'since_date': slice_since,
+            'until_date': slice_until,
+            'mode': mode,
+            'is_hashtag': is_hashtag
+        })
+        for slice_since, slice_until in split_date_range(since_date, until_date, slice_hours)
+    ]
 
-        # Guardado final (siempre, incluso si incremental_save está activo)
-        if incremental_save:
-            conversation['incremental_saved'] = True
-            conversation['_saved_filename'] = partial_filename  # Marcar el nombre del archivo usado
-            scraping_dir = 'scraping'
-            filepath = os.path.join(scraping_dir, partial_filename)
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(conversation, f, ensure_ascii=False, indent=2)
 
-            if should_stop:
-                print(f"\n💾 Progreso guardado en: {filepath}")
-                print("   Puedes reanudar esta descarga más tarde")
-            else:
-                print(f"\n✓ Guardado final completado: {filepath}")
+def execute_task(scraper, task):
+    """
+    Ejecuta una tarea de la cola con el scraper local
 
-        return conversation
+    Tipos de tarea:
+        'query': download_full_conversation completo (payload = sus argumentos)
+        'slice': una franja de backfill (query, since_date, until_date, mode, is_hashtag)
+        'replies': árbol de respuestas de un tweet (tweet_id, depth)
 
-    def save_to_json(self, data, filename=None):
-        """
-        Guarda los datos en un archivo JSON
+    Returns:
+        Diccionario con el resultado (archivo generado y totales)
+    """
+    kind = task['kind']
+    payload = task['payload']
+
+    if kind == 'query':
+        conversation = scraper.download_full_conversation(**payload)
+        saved_filename = conversation.get('_saved_filename')
+        if saved_filename:
+            filepath = os.path.join('scraping', saved_filename)
+        else:
+            # Sin guardado incremental no hay archivo todavía: se guarda aquí
+            filepath = scraper.save_to_json(conversation)
+        return {
+            'file': filepath,
+            'tweets': conversation['total_main_tweets'],
+            'replies': conversation['total_replies'],
+            'status': conversation['status']
+        }
 
-        Args:
-            data: Datos a guardar
-            filename: Nombre del archivo (opcional)
-        """
-        # Si ya tiene status=completed y fue guardado incrementalmente, devolver el path existente
-        if data.get('status') == 'completed' and data.get('incremental_saved'):
-            saved_filename = data.get('_saved_filename')
-            if saved_filename:
-                filepath_existing = os.path.join('scraping', saved_filename)
-                if os.path.exists(filepath_existing):
-                    return filepath_existing
+    if kind == 'slice':
+        query_clean = query_filename(payload['query'])
+        slice_name = f"{payload['since_date']}_{payload['until_date']}".replace(' ', 'T').replace(':', '')
+        slice_filename = os.path.join('slices', f"{query_clean}_{slice_name}.json")
+        outcome = {}
+        tweets = scraper.search_tweets(payload['query'], payload.get('mode', 'latest'), None,
+                                       payload.get('is_hashtag', True), payload['until_date'], payload['since_date'],
+                                       True, slice_filename, CheckpointPolicy(), outcome=outcome)
+        if outcome['error']:
+            # La tarea falla y vuelve a la cola; el checkpoint parcial queda en in_progress
+            raise RuntimeError(f"Franja incompleta: {outcome['error']}")
+        filepath = scraper._save_checkpoint(slice_filename, {
+            'query': payload['query'],
+            'since_date': payload['since_date'],
+            'until_date': payload['until_date'],
+            'status': 'completed' if outcome['complete'] else 'in_progress',
+            'total_main_tweets': len(tweets),
+            'tweets': [{'tweet': t, 'replies': []} for t in tweets]
+        })
+        return {'file': filepath, 'tweets': len(tweets)}
+
+    if kind == 'replies':
+        tree = scraper.crawl_reply_tree(payload['tweet_id'], payload.get('depth', 1))
+        filepath = scraper._save_checkpoint(os.path.join('replies', f"{payload['tweet_id']}.json"), {
+            'tweet_id': payload['tweet_id'],
+            'replies': list(tree['nodes'].values()),
+            'reply_tree': tree['children']
+        })
+        return {'file': filepath, 'replies': len(tree['nodes'])}
+
+    raise ValueError(f"Tipo de tarea desconocido: {kind}")
+
+
+def run_worker(scraper, queue, worker_id=None, exit_when_idle=False, poll_seconds=5):
+    """
+    Bucle de un worker: toma tareas de la cola, las ejecuta y reporta el resultado
 
-        # Crear carpeta scraping si no existe
-        scraping_dir = 'scraping'
-        if not os.path.exists(scraping_dir):
-            os.makedirs(scraping_dir)
+    Mientras ejecuta una tarea, un hilo renueva el lease periódicamente. Si el
+    proceso muere, el lease caduca y otro worker retoma la tarea.
 
-        if not filename:
-            query = data['query'].replace('#', '').replace(' ', '_')
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"{query}_{timestamp}.json"
+    Args:
+        scraper: TwitterHashtagScraper con las credenciales de este nodo
+        queue: SQLiteWorkQueue o RedisWorkQueue
+        worker_id: Identificador del worker (por defecto host:pid)
+        exit_when_idle: Si True, termina cuando la cola está vacía
+        poll_seconds: Espera entre consultas con la cola vacía
 
-        # Guardar en la carpeta scraping
-        filepath = os.path.join(scraping_dir, filename)
+    Returns:
+        Número de tareas completadas
+    """
+    import socket
 
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    completed = 0
+    print(f"Worker {worker_id} iniciado")
 
-        print(f"\n✓ Datos guardados en: {filepath}")
-        return filepath
+    while not should_stop:
+        task = queue.lease(worker_id)
+        if task is None:
+            if exit_when_idle:
+                break
+            time.sleep(poll_seconds)
+            continue
 
-    def export_to_csv(self, data, csv_filename=None):
-        """
-        Exporta los datos a formato CSV
+        print(f"\n▶ Tarea {task['id']} ({task['kind']}, intento {task['attempts']}): {task['payload']}")
+
+        done = threading.Event()
+
+        def keep_alive():
+            while not done.wait(queue.lease_seconds / 3):
+                progress = {'requests': scraper.request_count, 'at': datetime.now().isoformat(),
+                            'checkpoint': scraper.last_checkpoint}
+                if not queue.heartbeat(task['id'], worker_id, progress):
+                    print(f"⚠️  Lease de la tarea {task['id']} perdido")
+                    return
+
+        heartbeat_thread = threading.Thread(target=keep_alive, daemon=True)
+        heartbeat_thread.start()
 
-        Args:
-            data: Diccionario con los datos
-            csv_filename: Nombre del archivo CSV (opcional)
-        """
         try:
-            import csv
+            result = execute_task(scraper, task)
+        except Exception as e:
+            done.set()
+            print(f"❌ Tarea {task['id']} fallida: {e}")
+            queue.fail(task['id'], worker_id, e)
+            continue
 
-            scraping_dir = 'scraping'
-            if not csv_filename:
-                query = data['query'].replace('#', '').replace(' ', '_')
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                csv_filename = f"{query}_{timestamp}.csv"
+        done.set()
+        heartbeat_thread.join()
 
-            csv_filepath = os.path.join(scraping_dir, csv_filename)
+        if should_stop:
+            # Resultado parcial: la tarea vuelve a la cola (su checkpoint queda en disco)
+            queue.release(task['id'], worker_id)
+            break
 
-            # Preparar datos para CSV
-            rows = []
-            for item in data['tweets']:
-                tweet = item['tweet']
-                rows.append({
-                    'id': tweet.get('id', ''),
-                    'fecha': tweet.get('time_parsed', ''),
-                    'usuario': tweet.get('username', ''),
-                    'nombre': tweet.get('name', ''),
-                    'texto': tweet.get('text', ''),
-                    'likes': tweet.get('likes', 0),
-                    'retweets': tweet.get('retweets', 0),
-                    'respuestas': tweet.get('replies', 0),
-                    'vistas': tweet.get('views', 0),
-                    'es_verificado': tweet.get('is_verified', False),
-                    'url': tweet.get('permanent_url', ''),
-                    'hashtags': ','.join(tweet.get('hashtags', [])) if tweet.get('hashtags') else '',
-                    'num_respuestas_descargadas': len(item.get('replies', []))
-                })
+        if queue.complete(task['id'], worker_id, result):
+            completed += 1
+            print(f"✓ Tarea {task['id']} completada: {result}")
+        else:
+            print(f"⚠️  Tarea {task['id']} terminada sin lease (otro worker la retomó)")
 
-            # Escribir CSV
-            if rows:
-                with open(csv_filepath, 'w', newline='', encoding='utf-8-sig') as f:
-                    writer = csv.DictWriter(f, fieldnames=rows[0].keys())
-                    writer.writeheader()
-                    writer.writerows(rows)
+    print(f"\nWorker {worker_id} detenido. Tareas completadas: {completed}")
+    return completed
 
-                print(f"✓ CSV exportado en: {csv_filepath}")
-                return csv_filepath
-            else:
-                print("⚠️  No hay datos para exportar a CSV")
-                return None
 
-        except Exception as e:
-            print(f"❌ Error al exportar CSV: {e}")
-            return None
+class MultiQueryMonitor:
+    """
+    Monitoreo continuo de varias búsquedas en un solo proceso
+
+    Cada búsqueda tiene su propio planificador (MonitorScheduler), su dataset
+    incremental (DeltaExporter) y una marca de agua con el tweet más reciente
+    exportado: en modo 'latest' solo se piden tweets posteriores a ella o
+    dentro de una ventana de refresco hacia atrás (refresh_hours), así los ya
+    exportados vuelven a aparecer con sus contadores al día. Un
+    EngagementTracker por término guarda la evolución de likes, retweets y
+    respuestas, y las respuestas de un tweet ya visto solo se vuelven a pedir
+    si su contador ha crecido (al dataset solo se añaden las nuevas). Las
+    búsquedas que van tocando se ejecutan en un pool de hilos y todas comparten
+    el scraper, es decir, el mismo pool de API keys (límite de peticiones y
+    cuota) y la misma sesión HTTP. Los arranques se escalonan dentro del primer
+    intervalo para repartir la carga.
+    """
 
-    def apply_filters(self, data, min_likes=None, verified_only=False):
+    def __init__(self, scraper, queries, interval, adaptive=True, rotate_hours=None,
+                 export_csv=True, max_workers=4, duration=None, target_new=20, reply_budget=None,
+                 media_downloader=None, refresh_hours=None, **download_kwargs):
         """
-        Aplica filtros a los tweets
-
         Args:
-            data: Diccionario con los tweets
-            min_likes: Mínimo de likes requeridos
-            verified_only: Solo usuarios verificados
+            scraper: TwitterHashtagScraper compartido
+            queries: Lista de términos a monitorizar
+            interval: Intervalo base entre búsquedas de cada término (segundos)
+            adaptive: Intervalo adaptativo por término (ver MonitorScheduler)
+            rotate_hours: Rotación de los datasets incrementales (ver DeltaExporter)
+            export_csv: Si True, los datasets incluyen también CSV
+            max_workers: Búsquedas simultáneas como máximo
+            duration: Duración total del monitoreo en segundos (None = hasta Ctrl+C)
+            target_new: Tweets nuevos deseados por búsqueda
+            reply_budget: Presupuesto de peticiones de respuestas por búsqueda
+            media_downloader: MediaDownloader para la multimedia de los tweets nuevos (opcional)
+            refresh_hours: Horas hacia atrás que se vuelven a buscar para refrescar hilos
+                (None = MONITOR_REFRESH_HOURS del .env, 24 por defecto; 0 = solo tweets nuevos)
+            **download_kwargs: Parámetros para download_full_conversation (mode, max_tweets, ...)
+        """
+        self.scraper = scraper
+        self.duration = duration
+        self.max_workers = max_workers
+        self.reply_budget = reply_budget
+        self.media_downloader = media_downloader
+        self.download_kwargs = download_kwargs
+        if refresh_hours is None:
+            refresh_hours = float(os.getenv('MONITOR_REFRESH_HOURS', '24'))
+        self.refresh_hours = refresh_hours
+        self.requests_per_poll = None
+        self.entries = []
+
+        for idx, query in enumerate(queries):
+            scheduler = MonitorScheduler(interval, target_new=target_new, adaptive=adaptive,
+                                         key_pool=scraper.key_pool, budget_share=len(queries))
+            # Escalonar los arranques dentro del primer intervalo
+            scheduler.next_fire += idx * interval / len(queries)
+            exporter = DeltaExporter(query, rotate_hours=rotate_hours, csv_enabled=export_csv)
+            engagement_path = f"{exporter.base}.engagement.ndjson"
+            if os.path.exists(f"{exporter.base}_engagement.jsonl") and not os.path.exists(engagement_path):
+                # Nombre anterior: el indexador lo tomaba por un dataset *.jsonl
+                os.replace(f"{exporter.base}_engagement.jsonl", engagement_path)
+            self.entries.append({
+                'query': query,
+                'scheduler': scheduler,
+                'exporter': exporter,
+                # Fuera de los *.jsonl para que el indexador no lo tome por un dataset
+                'tracker': EngagementTracker(engagement_path),
+                'new_tweets': 0,
+                'new_replies': 0,
+                'refreshed_threads': 0,
+                'unchanged_threads': 0,
+                'errors': 0
+            })
 
-        Returns:
-            Diccionario filtrado
+    def since_for(self, entry):
         """
-        original_count = len(data['tweets'])
-        filtered_tweets = []
+        Fecha 'desde' de la próxima búsqueda de un término
 
-        for item in data['tweets']:
-            tweet = item['tweet']
+        Usa la marca de agua (con un minuto de margen, los duplicados se
+        descartan al exportar), ampliada hasta la ventana de refresco para que
+        los hilos recientes ya exportados vuelvan a aparecer, si es posterior
+        a since_date.
+        """
+        since_date = self.download_kwargs.get('since_date')
+        watermark = entry['exporter'].watermark
+        if not watermark or self.download_kwargs.get('mode', 'latest') != 'latest':
+            return since_date
+        since = watermark - 60
+        if self.refresh_hours:
+            since = min(since, time.time() - self.refresh_hours * 3600)
+        if since_date and parse_date_limit(since_date) >= since:
+            return since_date
+        return datetime.fromtimestamp(since).strftime('%Y-%m-%d %H:%M')
+
+    def poll(self, entry):
+        """
+        Ejecuta una búsqueda de un término y añade lo nuevo a su dataset
 
-            # Filtro por likes
-            if min_likes is not None and tweet.get('likes', 0) < min_likes:
-                continue
+        Returns:
+            Tupla (tweets_nuevos, respuestas_nuevas, tweets_descargados)
+        """
+        print(f"\n{'=' * 70}")
+        print(f"ITERACIÓN {entry['scheduler'].polls} [{entry['query']}] - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print(f"{'=' * 70}")
+
+        tracker = entry['tracker']
+        planner = ReplyFetchPlanner(request_budget=self.reply_budget, refresh=tracker)
+        kwargs = dict(self.download_kwargs, since_date=self.since_for(entry), incremental_save=False,
+                      reply_planner=planner, known_reply_ids=entry['exporter'].seen)
+        conversation = self.scraper.download_full_conversation(query=entry['query'], **kwargs)
+
+        main_tweets = [item['tweet'] for item in conversation['tweets']]
+        entry['refreshed_threads'] += sum(1 for t in main_tweets
+                                          if t.get('id') in planner.fetched_ids and t.get('id') in tracker.fetched_replies)
+        entry['unchanged_threads'] += planner.unchanged
+        tracker.record(main_tweets, planner.fetched_ids)
+        new_tweets, new_replies = entry['exporter'].write(conversation)
+        if self.media_downloader:
+            # Las URLs ya descargadas se resuelven por el índice sin tocar la red
+            self.media_downloader.run(conversation)
+        return new_tweets, new_replies, len(conversation['tweets'])
+
+    def _finish(self, entry, future, requests_used):
+        """Registra el resultado de una búsqueda y programa la siguiente"""
+        scheduler = entry['scheduler']
+        try:
+            new_tweets, new_replies, downloaded = future.result()
+        except Exception as e:
+            entry['errors'] += 1
+            print(f"❌ [{entry['query']}] Error en la búsqueda: {e}")
+            new_tweets, new_replies, downloaded = 0, 0, 0
 
-            # Filtro por verificados
-            if verified_only:
-                is_verified = tweet.get('is_verified', False) or tweet.get('is_blue_verified', False)
-                if not is_verified:
-                    continue
+        entry['new_tweets'] += new_tweets
+        entry['new_replies'] += new_replies
 
-            filtered_tweets.append(item)
+        # Con búsquedas simultáneas el contador del scraper es global: se usa la media por búsqueda
+        self.requests_per_poll = requests_used if self.requests_per_poll is None else (self.requests_per_poll + requests_used) / 2
+        max_tweets = self.download_kwargs.get('max_tweets')
+        scheduler.record(new_tweets, requests_used=self.requests_per_poll,
+                         saturated=bool(max_tweets) and downloaded >= max_tweets and new_tweets >= downloaded)
 
-        data['tweets'] = filtered_tweets
-        data['total_main_tweets'] = len(filtered_tweets)
-        data['total_items'] = len(filtered_tweets) + sum(len(t['replies']) for t in filtered_tweets)
+        print(f"✓ [{entry['query']}] Nuevos: {new_tweets} tweets (+{new_replies} respuestas) | "
+              f"Únicos: {len(entry['exporter'].seen)} | "
+              f"Próxima búsqueda en {scheduler.seconds_until_next() / 60:.1f} min")
 
-        filtered_count = len(filtered_tweets)
-        print(f"\n✓ Filtros aplicados: {original_count} tweets → {filtered_count} tweets")
+    def run(self):
+        """
+        Bucle del monitor hasta Ctrl+C o hasta agotar la duración
 
-        return data
+        Returns:
+            Resumen por término (ver summary)
+        """
+        deadline = time.monotonic() + self.duration if self.duration else None
+        running = {}  # future -> índice del término
+        last_count = self.scraper.request_count
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while not interrupted:
+                now = time.monotonic()
+                if deadline and now >= deadline:
+                    print(f"\n✓ Tiempo de monitoreo completado ({self.duration / 3600} horas)")
+                    break
+
+                # Lanzar las búsquedas que tocan (como mucho max_workers a la vez)
+                due = sorted((idx for idx, e in enumerate(self.entries)
+                              if idx not in running.values() and e['scheduler'].next_fire <= now),
+                             key=lambda idx: self.entries[idx]['scheduler'].next_fire)
+                for idx in due[:self.max_workers - len(running)]:
+                    self.entries[idx]['scheduler'].fire()
+                    running[executor.submit(self.poll, self.entries[idx])] = idx
+
+                # Esperar a que termine alguna búsqueda o llegue la siguiente hora programada
+                idle = [e['scheduler'].next_fire for idx, e in enumerate(self.entries) if idx not in running.values()]
+                timeout = min([max(t - time.monotonic(), 0) for t in idle] + [1])
+                if running:
+                    done, _ = wait_futures(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+                else:
+                    done = set()
+                    time.sleep(timeout)
+
+                for future in done:
+                    requests_used = self.scraper.request_count - last_count
+                    last_count = self.scraper.request_count
+                    self._finish(self.entries[running.pop(future)], future, requests_used)
+
+            # Ctrl+C o fin de la duración: las búsquedas en curso terminan y se exportan
+            for future, idx in running.items():
+                self._finish(self.entries[idx], future, 0)
+
+        return self.summary()
+
+    def summary(self):
+        """Resumen por término: búsquedas, elementos nuevos, errores e intervalo actual"""
+        return [
+            {
+                'query': entry['query'],
+                'polls': entry['scheduler'].polls,
+                'new_tweets': entry['new_tweets'],
+                'new_replies': entry['new_replies'],
+                'unique_items': len(entry['exporter'].seen),
+                'refreshed_threads': entry['refreshed_threads'],
+                'unchanged_threads': entry['unchanged_threads'],
+                'errors': entry['errors'],
+                'interval_minutes': round(entry['scheduler'].interval / 60, 1),
+                'skipped_slots': entry['scheduler'].skipped_slots,
+                'dataset': entry['exporter'].current_paths()[0],
+                'engagement': entry['tracker'].path
+            }
+            for entry in self.entries
+        ]
 
 
 def main():
@@ -619,6 +5339,11 @@ def main():
     signal.signal(signal.SIGINT, signal_handler)
 
     scraper = TwitterHashtagScraper()
+    if scraper.profiler:
+        # Se vuelca al salir, también si la ejecución termina por Ctrl+C o en un return temprano
+        atexit.register(scraper.profiler.finish)
+    if scraper.sink:
+        atexit.register(scraper.close_sink)
 
     # Detectar descargas incompletas
     incomplete_downloads = find_incomplete_downloads()
@@ -642,6 +5367,7 @@ def main():
 
         if resume_choice.isdigit() and 1 <= int(resume_choice) <= len(incomplete_downloads):
             resume_data = incomplete_downloads[int(resume_choice) - 1]
+            resume_data['data'], _ = load_dataset(resume_data['filepath'])
             print(f"\n✓ Reanudando descarga de: {resume_data['query']}")
         else:
             print("\n✓ Iniciando nueva búsqueda")
@@ -684,7 +5410,9 @@ def main():
 
         max_tweets = None  # Continuar sin límite
         until_date = None
+        slice_hours = None
         include_replies = True  # Asumir que queremos respuestas
+        reply_depth = 1
 
         print(f"\n📌 Configuración de reanudación:")
         print(f"   Query: {query}")
@@ -696,6 +5424,7 @@ def main():
     else:
         # Separar múltiples términos por comas
         queries = [q.strip() for q in query_input.split(',') if q.strip()]
+        combine_queries = False
 
         if len(queries) == 0:
             print("❌ Error: Debes ingresar al menos un término de búsqueda")
@@ -703,6 +5432,10 @@ def main():
 
         if len(queries) > 1:
             print(f"\n✓ Se buscarán {len(queries)} términos: {', '.join(queries)}")
+            combine_input = input("¿Combinar los términos en búsquedas con OR? Menos peticiones y duplicados (s/n, default=n): ").strip().lower()
+            combine_queries = combine_input == 's'
+            if combine_queries:
+                print("   El límite de tweets se aplicará a cada búsqueda combinada")
         else:
             query = queries[0]
 
@@ -749,6 +5482,7 @@ def main():
 
         until_date = None
         since_date = None
+        slice_hours = None
 
         if date_range_input == 's':
             print("\n   Configura el rango de fechas (formato DD-MM-YYYY)")
@@ -775,9 +5509,21 @@ def main():
                     print("   ⚠️  Formato de fecha 'hasta' incorrecto, se ignorará")
                     until_date = None
 
+            # Backfill paralelo por franjas (solo con rango cerrado)
+            if since_date and until_date:
+                slice_input = input("   - ¿Descargar en paralelo por franjas? Horas por franja (Enter = no): ").strip()
+                if slice_input.isdigit() and int(slice_input) > 0:
+                    slice_hours = int(slice_input)
+
         include_replies_input = input("\n¿Incluir respuestas? (s/n, default=s): ").strip().lower()
         include_replies = include_replies_input != 'n'
 
+        reply_depth = 1
+        if include_replies:
+            depth_input = input("Niveles de respuestas (1 = solo directas, 2+ = respuestas a respuestas, default=1): ").strip()
+            if depth_input.isdigit() and int(depth_input) > 0:
+                reply_depth = int(depth_input)
+
     # Opciones avanzadas
     print("\n" + "=" * 70)
     advanced_input = input("¿Configurar opciones avanzadas? (s/n, default=n): ").strip().lower()
@@ -788,6 +5534,11 @@ def main():
     verified_only = False
     monitor_mode = False
     monitor_duration = None
+    monitor_rotate_hours = None
+    monitor_adaptive = False
+    reply_budget = None
+    download_media = False
+    media_budget = None
 
     if advanced_input == 's':
         print("\n" + "=" * 70)
@@ -808,6 +5559,20 @@ def main():
         verified_input = input("¿Solo usuarios verificados? (s/n, default=n): ").strip().lower()
         verified_only = verified_input == 's'
 
+        # Presupuesto de peticiones de respuestas
+        if include_replies:
+            budget_input = input("Máximo de peticiones de respuestas por búsqueda (Enter = sin límite): ").strip()
+            if budget_input.isdigit():
+                reply_budget = int(budget_input)
+
+        # Descarga de multimedia
+        media_input = input("¿Descargar fotos, vídeos y GIFs? (s/n, default=n): ").strip().lower()
+        download_media = media_input == 's'
+        if download_media:
+            media_budget_input = input("Máximo de MB de multimedia en esta ejecución (Enter = sin límite): ").strip()
+            if media_budget_input.isdigit():
+                media_budget = int(media_budget_input) * 1024 * 1024
+
         # Modo monitoreo
         monitor_input = input("\n¿Activar modo monitoreo continuo? (s/n, default=n): ").strip().lower()
         monitor_mode = monitor_input == 's'
@@ -831,6 +5596,19 @@ def main():
             interval_input = input("Intervalo entre búsquedas en minutos (default=5): ").strip()
             monitor_interval = int(interval_input) * 60 if interval_input else 300  # 5 minutos por defecto
 
+            adaptive_input = input("¿Ajustar el intervalo al volumen de tweets? (s/n, default=s): ").strip().lower()
+            monitor_adaptive = adaptive_input != 'n'
+
+            rotate_input = input("Rotar el dataset cada N horas (Enter = un único archivo): ").strip()
+            if rotate_input.isdigit() and int(rotate_input) > 0:
+                monitor_rotate_hours = int(rotate_input)
+
+    # Los filtros se aplican durante la descarga (antes de pedir respuestas y de guardar)
+    tweet_filter = TweetFilter(min_likes=min_likes, verified_only=verified_only)
+
+    # Un solo descargador por ejecución: el presupuesto de bytes es compartido
+    media_downloader = MediaDownloader(byte_budget=media_budget) if download_media else None
+
     print("\n" + "=" * 50)
     print("Iniciando descarga...")
     print("=" * 50)
@@ -838,6 +5616,66 @@ def main():
     # Configurar manejador de señales para Ctrl+C
     signal.signal(signal.SIGINT, signal_handler)
 
+    # Modo monitoreo (uno o varios términos en el mismo proceso)
+    if monitor_mode:
+        print("\n" + "=" * 70)
+        print("MODO MONITOREO ACTIVADO")
+        print("=" * 70)
+        if len(queries) > 1:
+            print(f"Términos: {len(queries)} ({', '.join(queries)})")
+        if monitor_duration:
+            hours = monitor_duration / 3600
+            print(f"Duración: {hours} horas")
+        else:
+            print("Duración: Hasta detenerlo manualmente (Ctrl+C)")
+        print(f"Intervalo: {monitor_interval / 60} minutos" + (" (adaptativo)" if monitor_adaptive else ""))
+        print("=" * 70)
+
+        monitor = MultiQueryMonitor(
+            scraper,
+            queries,
+            monitor_interval,
+            adaptive=monitor_adaptive,
+            rotate_hours=monitor_rotate_hours,
+            export_csv=export_csv,
+            max_workers=min(len(queries), int(os.getenv('MONITOR_MAX_WORKERS', '4'))),
+            duration=monitor_duration,
+            target_new=max(1, max_tweets // 2) if max_tweets else 20,
+            reply_budget=reply_budget,
+            media_downloader=media_downloader,
+            mode=mode,
+            max_tweets=max_tweets,
+            include_replies=include_replies,
+            is_hashtag=is_hashtag,
+            until_date=until_date,
+            since_date=since_date,
+            slice_hours=slice_hours,
+            reply_depth=reply_depth,
+            tweet_filter=tweet_filter
+        )
+        summary = monitor.run()
+
+        print("\n" + "=" * 70)
+        print("MONITOREO FINALIZADO")
+        print("=" * 70)
+        for idx, result in enumerate(summary, 1):
+            print(f"\n{idx}. {result['query']}")
+            print(f"   Búsquedas: {result['polls']} | Intervalo actual: {result['interval_minutes']} min")
+            print(f"   Nuevos: {result['new_tweets']} tweets, {result['new_replies']} respuestas")
+            print(f"   Elementos únicos monitorizados: {result['unique_items']}")
+            print(f"   Hilos refrescados: {result['refreshed_threads']} | "
+                  f"sin cambios (no se volvieron a pedir): {result['unchanged_threads']}")
+            if result['errors']:
+                print(f"   ⚠️  Búsquedas con error: {result['errors']}")
+            if result['skipped_slots']:
+                print(f"   Búsquedas saltadas por descargas largas: {result['skipped_slots']}")
+            print(f"   Dataset: {result['dataset']}")
+            print(f"   Engagement: {result['engagement']}")
+        print("=" * 70)
+
+        scraper.key_pool.print_usage()
+        return
+
     # Procesar múltiples búsquedas si hay varios términos
     if len(queries) > 1:
         print("\n" + "=" * 70)
@@ -846,29 +5684,45 @@ def main():
 
         all_results = []
 
-        for idx, query in enumerate(queries, 1):
-            print(f"\n{'=' * 70}")
-            print(f"BÚSQUEDA {idx}/{len(queries)}: {query}")
-            print(f"{'=' * 70}")
-
-            # Modo monitoreo no compatible con múltiples términos
-            if monitor_mode:
-                print("⚠️  Modo monitoreo no disponible con múltiples términos")
-                print("   Usando modo de búsqueda única...")
-
-            conversation = scraper.download_full_conversation(
-                query=query,
-                mode=mode,
-                max_tweets=max_tweets,
-                include_replies=include_replies,
-                is_hashtag=is_hashtag,
-                until_date=until_date,
-                since_date=since_date
-            )
+        def run_queries():
+            """Una conversación por término (agrupando en consultas OR si se eligió)"""
+            if combine_queries:
+                yield from scraper.download_combined(
+                    queries,
+                    is_hashtag=is_hashtag,
+                    reply_budget=reply_budget,
+                    mode=mode,
+                    max_tweets=max_tweets,
+                    include_replies=include_replies,
+                    until_date=until_date,
+                    since_date=since_date,
+                    slice_hours=slice_hours,
+                    reply_depth=reply_depth,
+                    tweet_filter=tweet_filter
+                )
+                return
+
+            for idx, query in enumerate(queries, 1):
+                print(f"\n{'=' * 70}")
+                print(f"BÚSQUEDA {idx}/{len(queries)}: {query}")
+                print(f"{'=' * 70}")
+
+                yield scraper.download_full_conversation(
+                    query=query,
+                    mode=mode,
+                    max_tweets=max_tweets,
+                    include_replies=include_replies,
+                    is_hashtag=is_hashtag,
+                    until_date=until_date,
+                    since_date=since_date,
+                    slice_hours=slice_hours,
+                    reply_planner=ReplyFetchPlanner(request_budget=reply_budget),
+                    reply_depth=reply_depth,
+                    tweet_filter=tweet_filter
+                )
 
-            # Aplicar filtros si están configurados
-            if min_likes or verified_only:
-                conversation = scraper.apply_filters(conversation, min_likes, verified_only)
+        for conversation in run_queries():
+            query = conversation['query']
 
             # Guardar resultados
             filename = scraper.save_to_json(conversation)
@@ -877,6 +5731,9 @@ def main():
             if export_csv:
                 scraper.export_to_csv(conversation)
 
+            if media_downloader:
+                media_downloader.run(conversation)
+
             all_results.append({
                 'query': query,
                 'tweets': conversation['total_main_tweets'],
@@ -905,171 +5762,359 @@ def main():
         print(f"Archivos generados: {len(all_results)}")
         print("=" * 70)
 
+        scraper.key_pool.print_usage()
         return
 
     # Procesar búsqueda única
     query = queries[0]
 
-    # Modo monitoreo
-    if monitor_mode:
-        print("\n" + "=" * 70)
-        print("MODO MONITOREO ACTIVADO")
-        print("=" * 70)
-        if monitor_duration:
-            hours = monitor_duration / 3600
-            print(f"Duración: {hours} horas")
-        else:
-            print("Duración: Hasta detenerlo manualmente (Ctrl+C)")
-        print(f"Intervalo: {monitor_interval / 60} minutos")
-        print("=" * 70)
-
-        start_time = time.time()
-        iteration = 0
-        all_tweet_ids = set()  # Para detectar duplicados
-
-        while not interrupted:
-            iteration += 1
-            current_time = time.time()
-
-            # Verificar si se alcanzó el límite de tiempo
-            if monitor_duration and (current_time - start_time) >= monitor_duration:
-                print(f"\n✓ Tiempo de monitoreo completado ({monitor_duration / 3600} horas)")
-                break
-
-            print(f"\n{'=' * 70}")
-            print(f"ITERACIÓN {iteration} - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-            print(f"{'=' * 70}")
-
-            # Descargar conversación
-            conversation = scraper.download_full_conversation(
-                query=query,
-                mode=mode,
-                max_tweets=max_tweets,
-                include_replies=include_replies,
-                is_hashtag=is_hashtag,
-                until_date=until_date,
-                since_date=since_date
-            )
-
-            # Aplicar filtros si están configurados
-            if min_likes or verified_only:
-                conversation = scraper.apply_filters(conversation, min_likes, verified_only)
-
-            # Detectar tweets nuevos
-            new_tweets = 0
-            for item in conversation['tweets']:
-                tweet_id = item['tweet'].get('id')
-                if tweet_id and tweet_id not in all_tweet_ids:
-                    all_tweet_ids.add(tweet_id)
-                    new_tweets += 1
-
-            print(f"\n✓ Tweets nuevos en esta iteración: {new_tweets}")
-            print(f"✓ Total de tweets únicos monitorizados: {len(all_tweet_ids)}")
-
-            # Guardar resultados
-            filename = scraper.save_to_json(conversation)
-
-            # Exportar a CSV si está activado
-            if export_csv:
-                scraper.export_to_csv(conversation)
-
-            # Esperar hasta la próxima iteración
-            if not interrupted:
-                print(f"\n⏳ Esperando {monitor_interval / 60} minutos hasta la próxima búsqueda...")
-                print("   (Presiona Ctrl+C para detener)")
-
-                # Esperar por intervalos de 1 segundo para poder interrumpir rápido
-                for _ in range(monitor_interval):
-                    if interrupted:
-                        break
-                    time.sleep(1)
+    # Modo normal (una sola extracción)
+    conversation = scraper.download_full_conversation(
+        query=query,
+        mode=mode,
+        max_tweets=max_tweets,
+        include_replies=include_replies,
+        is_hashtag=is_hashtag,
+        until_date=until_date,
+        since_date=since_date,
+        slice_hours=slice_hours,
+        reply_planner=ReplyFetchPlanner(request_budget=reply_budget),
+        reply_depth=reply_depth,
+        tweet_filter=tweet_filter
+    )
+
+    # Si estamos reanudando, merge con datos existentes
+    if resume_data:
+        print(f"\n🔄 Combinando tweets nuevos con {len(resume_data['data']['tweets'])} existentes...")
+
+        # Filtrar tweets duplicados
+        new_tweets = []
+        duplicates = 0
+        for item in conversation['tweets']:
+            tweet_id = item['tweet'].get('id')
+            if tweet_id not in existing_tweet_ids:
+                new_tweets.append(item)
+            else:
+                duplicates += 1
+
+        # Combinar: existentes + nuevos
+        all_tweets = resume_data['data']['tweets'] + new_tweets
+
+        conversation['tweets'] = all_tweets
+        conversation['total_main_tweets'] = len(all_tweets)
+        conversation['total_replies'] = sum(len(t['replies']) for t in all_tweets)
+        conversation['total_items'] = conversation['total_main_tweets'] + conversation['total_replies']
+        # El agregador solo vio los tweets de esta ejecución
+        conversation['analytics'] = StreamingAggregator().add_items(all_tweets).summary()
+
+        # Usar el mismo nombre de archivo
+        conversation['_saved_filename'] = resume_data['filename']
+
+        print(f"✓ Tweets nuevos: {len(new_tweets)}")
+        print(f"✓ Duplicados omitidos: {duplicates}")
+        print(f"✓ Total combinado: {conversation['total_main_tweets']} tweets")
+
+    # Verificar si fue interrumpido antes de continuar
+    global should_stop
+    if should_stop:
+        print("\n⚠️  Descarga interrumpida por el usuario")
+        scraper.key_pool.print_usage()
+        return
 
-        print("\n" + "=" * 70)
-        print("MONITOREO FINALIZADO")
-        print("=" * 70)
-        print(f"Iteraciones completadas: {iteration}")
-        print(f"Tweets únicos monitorizados: {len(all_tweet_ids)}")
-        print("=" * 70)
+    # Los tweets nuevos ya vienen filtrados; los del archivo reanudado pueden no estarlo
+    if resume_data and tweet_filter:
+        conversation = scraper.apply_filters(conversation, tweet_filter=tweet_filter)
 
+    # Guardar resultados
+    if resume_data:
+        # Guardar en el mismo archivo
+        filepath = resume_data['filepath']
+        atomic_write_dataset(filepath, normalize_users(conversation) if scraper.normalize_users else conversation,
+                             backups=scraper.checkpoint_backups)
+        filename = filepath
+        print(f"\n✓ Descarga reanudada guardada en: {filepath}")
     else:
-        # Modo normal (una sola extracción)
-        conversation = scraper.download_full_conversation(
-            query=query,
-            mode=mode,
-            max_tweets=max_tweets,
-            include_replies=include_replies,
-            is_hashtag=is_hashtag,
-            until_date=until_date,
-            since_date=since_date
-        )
-
-        # Si estamos reanudando, merge con datos existentes
-        if resume_data:
-            print(f"\n🔄 Combinando tweets nuevos con {len(resume_data['data']['tweets'])} existentes...")
-
-            # Filtrar tweets duplicados
-            new_tweets = []
-            duplicates = 0
-            for item in conversation['tweets']:
-                tweet_id = item['tweet'].get('id')
-                if tweet_id not in existing_tweet_ids:
-                    new_tweets.append(item)
-                else:
-                    duplicates += 1
-
-            # Combinar: existentes + nuevos
-            all_tweets = resume_data['data']['tweets'] + new_tweets
-
-            conversation['tweets'] = all_tweets
-            conversation['total_main_tweets'] = len(all_tweets)
-            conversation['total_replies'] = sum(len(t['replies']) for t in all_tweets)
-            conversation['total_items'] = conversation['total_main_tweets'] + conversation['total_replies']
-
-            # Usar el mismo nombre de archivo
-            conversation['_saved_filename'] = resume_data['filename']
-
-            print(f"✓ Tweets nuevos: {len(new_tweets)}")
-            print(f"✓ Duplicados omitidos: {duplicates}")
-            print(f"✓ Total combinado: {conversation['total_main_tweets']} tweets")
-
-        # Verificar si fue interrumpido antes de continuar
-        global should_stop
-        if should_stop:
-            print("\n⚠️  Descarga interrumpida por el usuario")
+        filename = scraper.save_to_json(conversation)
+
+    # Exportar a CSV si está activado
+    if export_csv and not should_stop:
+        scraper.export_to_csv(conversation)
+
+    # Descargar multimedia si está activado
+    if media_downloader and not should_stop:
+        media_downloader.run(conversation)
+
+    # Mostrar resumen solo si no fue interrumpido
+    if not should_stop:
+        print("\n" + "=" * 50)
+        print("RESUMEN")
+        print("=" * 50)
+        print(f"Búsqueda: {conversation['query']}")
+        print(f"Tipo: {conversation['search_type']}")
+        print(f"Tweets principales: {conversation['total_main_tweets']}")
+        print(f"Total de respuestas: {conversation['total_replies']}")
+        print(f"Total de elementos: {conversation['total_items']}")
+        analytics = conversation.get('analytics')
+        if analytics and analytics['top_hashtags']:
+            print(f"Top hashtags: {', '.join(f'#{tag} ({count})' for tag, count in analytics['top_hashtags'][:5])}")
+        if analytics and analytics['top_users']:
+            print(f"Top usuarios: {', '.join(f'@{user} ({count})' for user, count in analytics['top_users'][:5])}")
+        print(f"Archivo JSON: {filename}")
+        print("=" * 50)
+
+    scraper.key_pool.print_usage()
+
+
+def stop_worker_handler(sig, frame):
+    """Manejador de señales del modo worker: se detiene tras guardar la tarea actual"""
+    global should_stop
+    print("\n⚠️  Deteniendo worker (la tarea en curso vuelve a la cola)...")
+    should_stop = True
+
+
+def open_queue(args):
+    """Crea la cola indicada en los argumentos de línea de comandos"""
+    if args.redis:
+        return RedisWorkQueue(args.redis)
+    return SQLiteWorkQueue(args.queue)
+
+
+def cli(argv):
+    """
+    Subcomandos no interactivos
+
+    Uso:
+        python download_hashtag.py worker [--queue RUTA | --redis URL] [--worker-id ID] [--exit-when-idle]
+        python download_hashtag.py enqueue query|slice|replies OBJETIVO [opciones]
+        python download_hashtag.py queue-stats [--queue RUTA | --redis URL]
+        python download_hashtag.py index [--dir scraping] [--rebuild]
+        python download_hashtag.py search [TEXTO] [--since FECHA] [--until FECHA] [--min-likes N] [opciones]
+        python download_hashtag.py compact QUERY [--dir scraping] [--csv] [--delete-sources]
+        python download_hashtag.py get TWEET_ID [--dir scraping | --file RUTA]
+        python download_hashtag.py archive QUERY [--mode latest] [--since FECHA] [--until FECHA] [--max-pages N]
+        python download_hashtag.py rebuild QUERY [--mode latest] [--min-likes N] [--no-replies] [--output RUTA]
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='download_hashtag.py', description='Twitter/X Scraper - modo no interactivo')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_queue_args(subparser):
+        subparser.add_argument('--queue', default=os.path.join('scraping', 'queue.db'), help='Archivo SQLite de la cola')
+        subparser.add_argument('--redis', help='URL de Redis (sustituye a --queue)')
+
+    worker_parser = subparsers.add_parser('worker', help='Procesar tareas de la cola compartida')
+    add_queue_args(worker_parser)
+    worker_parser.add_argument('--worker-id', help='Identificador del worker (por defecto host:pid)')
+    worker_parser.add_argument('--exit-when-idle', action='store_true', help='Terminar cuando la cola esté vacía')
+
+    enqueue_parser = subparsers.add_parser('enqueue', help='Añadir tareas a la cola')
+    add_queue_args(enqueue_parser)
+    enqueue_parser.add_argument('kind', choices=['query', 'slice', 'replies'])
+    enqueue_parser.add_argument('target', help='Término de búsqueda (query/slice) o ID de tweet (replies)')
+    enqueue_parser.add_argument('--since', help='Fecha inicial YYYY-MM-DD')
+    enqueue_parser.add_argument('--until', help='Fecha final YYYY-MM-DD')
+    enqueue_parser.add_argument('--slice-hours', type=int, default=24, help='Horas por franja (slice)')
+    enqueue_parser.add_argument('--mode', default='latest', choices=['latest', 'top', 'photos', 'videos'])
+    enqueue_parser.add_argument('--text', action='store_true', help='Buscar como texto libre en lugar de hashtag')
+    enqueue_parser.add_argument('--max-tweets', type=int)
+    enqueue_parser.add_argument('--no-replies', action='store_true', help='No descargar respuestas (query)')
+    enqueue_parser.add_argument('--depth', type=int, default=1, help='Niveles de respuestas')
+
+    stats_parser = subparsers.add_parser('queue-stats', help='Mostrar tareas por estado')
+    add_queue_args(stats_parser)
+
+    index_parser = subparsers.add_parser('index', help='Indexar los datasets para búsqueda de texto')
+    index_parser.add_argument('--dir', default='scraping', help='Carpeta con los datasets')
+    index_parser.add_argument('--db', default=os.path.join('scraping', 'index.db'), help='Archivo del índice')
+    index_parser.add_argument('--rebuild', action='store_true', help='Reconstruir el índice desde cero')
+
+    search_parser = subparsers.add_parser('search', help='Buscar en el índice')
+    search_parser.add_argument('text', nargs='?', help='Palabras, "frases", OR, NOT, prefijo*')
+    search_parser.add_argument('--db', default=os.path.join('scraping', 'index.db'), help='Archivo del índice')
+    search_parser.add_argument('--since', help='Fecha inicial YYYY-MM-DD [HH:MM]')
+    search_parser.add_argument('--until', help='Fecha final YYYY-MM-DD [HH:MM] (exclusiva)')
+    search_parser.add_argument('--min-likes', type=int)
+    search_parser.add_argument('--min-retweets', type=int)
+    search_parser.add_argument('--user', help='Usuario exacto')
+    search_parser.add_argument('--hashtag', help='Hashtag')
+    search_parser.add_argument('--kind', choices=['tweet', 'reply'])
+    search_parser.add_argument('--order', default='rank', choices=['rank', 'date', 'likes'])
+    search_parser.add_argument('--limit', type=int, default=20)
+    search_parser.add_argument('--json', action='store_true', help='Resultados en JSON (uno por línea)')
+
+    compact_parser = subparsers.add_parser('compact', help='Fusionar los datasets de una búsqueda en uno solo')
+    compact_parser.add_argument('query', help='Término de búsqueda (nombre de los archivos)')
+    compact_parser.add_argument('--dir', default='scraping', help='Carpeta con los datasets')
+    compact_parser.add_argument('--output', help='Archivo de salida (por defecto {query}_{fecha}.json)')
+    compact_parser.add_argument('--csv', action='store_true', help='Escribir también el CSV fusionado')
+    compact_parser.add_argument('--delete-sources', action='store_true',
+                                help='Eliminar los archivos fusionados (y sus CSV y respaldos)')
+    compact_parser.add_argument('--run-size', type=int, default=5000, help='Elementos por tramo ordenado (memoria)')
+
+    get_parser = subparsers.add_parser('get', help='Mostrar el hilo de un tweet o respuesta por id')
+    get_parser.add_argument('tweet_id')
+    get_parser.add_argument('--dir', default='scraping', help='Carpeta con los datasets')
+    get_parser.add_argument('--file', help='Buscar solo en este dataset')
+    get_parser.add_argument('--migrate', action='store_true',
+                            help='Reescribir los JSON en formato antiguo con un tweet por línea (índice de offsets)')
+
+    def add_archive_args(subparser):
+        subparser.add_argument('query', help='Término de búsqueda')
+        subparser.add_argument('--db', default=os.path.join('scraping', 'pages.db'), help='Archivo de páginas')
+        subparser.add_argument('--mode', default='latest', choices=['latest', 'top', 'photos', 'videos'])
+        subparser.add_argument('--text', action='store_true', help='Buscar como texto libre en lugar de hashtag')
+
+    archive_parser = subparsers.add_parser('archive', help='Descargar páginas de búsqueda crudas al archivo')
+    add_archive_args(archive_parser)
+    archive_parser.add_argument('--since', help='Fecha inicial YYYY-MM-DD')
+    archive_parser.add_argument('--until', help='Fecha final YYYY-MM-DD')
+    archive_parser.add_argument('--max-pages', type=int)
+
+    rebuild_parser = subparsers.add_parser('rebuild', help='Regenerar un dataset desde el archivo de páginas')
+    add_archive_args(rebuild_parser)
+    rebuild_parser.add_argument('--min-likes', type=int)
+    rebuild_parser.add_argument('--min-retweets', type=int)
+    rebuild_parser.add_argument('--no-replies', action='store_true', help='No incluir las respuestas archivadas')
+    rebuild_parser.add_argument('--output', help='Archivo de salida (por defecto scraping/{query}_{fecha}.json)')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'worker':
+        signal.signal(signal.SIGINT, stop_worker_handler)
+        signal.signal(signal.SIGTERM, stop_worker_handler)
+        scraper = TwitterHashtagScraper()
+        if scraper.profiler:
+            atexit.register(scraper.profiler.finish)
+        if scraper.sink:
+            atexit.register(scraper.close_sink)
+        run_worker(scraper, open_queue(args), args.worker_id, args.exit_when_idle)
+
+    elif args.command == 'enqueue':
+        queue = open_queue(args)
+        if args.kind == 'slice':
+            if not (args.since and args.until):
+                parser.error("enqueue slice necesita --since y --until")
+            task_ids = enqueue_backfill(queue, args.target, args.since, args.until, args.slice_hours, args.mode, not args.text)
+        elif args.kind == 'query':
+            task_ids = [queue.put('query', {
+                'query': args.target,
+                'mode': args.mode,
+                'max_tweets': args.max_tweets,
+                'include_replies': not args.no_replies,
+                'is_hashtag': not args.text,
+                'since_date': args.since,
+                'until_date': args.until,
+                'reply_depth': args.depth
+            })]
+        else:
+            task_ids = [queue.put('replies', {'tweet_id': args.target, 'depth': args.depth})]
+        print(f"✓ {len(task_ids)} tarea(s) encolada(s)")
+
+    elif args.command == 'queue-stats':
+        for status, count in sorted(open_queue(args).stats().items()):
+            print(f"{status}: {count}")
+
+    elif args.command == 'index':
+        index = TweetIndex(args.db)
+        start = time.monotonic()
+        files, tweets = index.index_directory(args.dir, rebuild=args.rebuild)
+        stats = index.stats()
+        print(f"✓ {files} archivo(s) indexado(s), {tweets} elementos en {time.monotonic() - start:.1f} s")
+        print(f"Índice: {stats['tweets']} tweets, {stats['replies']} respuestas de {stats['files']} archivos")
+
+    elif args.command == 'compact':
+        files = find_dataset_files(args.query, args.dir)
+        if len(files) < 2 and not args.output:
+            print(f"Nada que fusionar: {len(files)} dataset(s) de '{args.query}' en {args.dir}")
             return
-
-        # Aplicar filtros si están configurados
-        if min_likes or verified_only:
-            conversation = scraper.apply_filters(conversation, min_likes, verified_only)
-
-        # Guardar resultados
-        if resume_data:
-            # Guardar en el mismo archivo
-            filepath = resume_data['filepath']
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(conversation, f, ensure_ascii=False, indent=2)
-            filename = filepath
-            print(f"\n✓ Descarga reanudada guardada en: {filepath}")
+        query_clean = query_filename(args.query)
+        output = args.output or os.path.join(args.dir, f"{query_clean}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        csv_path = f"{os.path.splitext(output)[0]}.csv" if args.csv else None
+
+        print(f"Fusionando {len(files)} dataset(s) de '{args.query}'...")
+        report = compact_datasets(files, output, args.run_size, csv_path)
+        print(f"✓ {report['items_in']} elementos leídos, {report['duplicates']} duplicados, "
+              f"{report['items_out']} en {output}")
+
+        before_mb = report['bytes_before'] / (1024 * 1024)
+        after_mb = report['bytes_after'] / (1024 * 1024)
+        if args.delete_sources:
+            freed = remove_dataset_files([f for f in files if os.path.abspath(f) != os.path.abspath(output)])
+            print(f"💾 Espacio liberado: {(freed - report['bytes_after']) / (1024 * 1024):.2f} MB "
+                  f"({freed / (1024 * 1024):.2f} MB eliminados, {after_mb:.2f} MB nuevos)")
         else:
-            filename = scraper.save_to_json(conversation)
-
-        # Exportar a CSV si está activado
-        if export_csv and not should_stop:
-            scraper.export_to_csv(conversation)
-
-        # Mostrar resumen solo si no fue interrumpido
-        if not should_stop:
-            print("\n" + "=" * 50)
-            print("RESUMEN")
-            print("=" * 50)
-            print(f"Búsqueda: {conversation['query']}")
-            print(f"Tipo: {conversation['search_type']}")
-            print(f"Tweets principales: {conversation['total_main_tweets']}")
-            print(f"Total de respuestas: {conversation['total_replies']}")
-            print(f"Total de elementos: {conversation['total_items']}")
-            print(f"Archivo JSON: {filename}")
-            print("=" * 50)
+            print(f"💾 JSON: {before_mb:.2f} MB → {after_mb:.2f} MB "
+                  f"({before_mb - after_mb:.2f} MB recuperables con --delete-sources)")
+
+    elif args.command == 'archive':
+        signal.signal(signal.SIGINT, signal_handler)
+        scraper = TwitterHashtagScraper(page_archive=PageArchive(args.db))
+        pages = scraper.archive_search(args.query, args.mode, not args.text, args.until, args.since, args.max_pages)
+        stats = scraper.page_archive.stats()
+        print(f"✓ {pages} página(s) archivada(s)")
+        print(f"Archivo: {stats['search_pages']} páginas de búsqueda, {stats['reply_pages']} de respuestas, "
+              f"{stats['raw_bytes'] / (1024 * 1024):.2f} MB → {stats['stored_bytes'] / (1024 * 1024):.2f} MB comprimidos")
+
+    elif args.command == 'rebuild':
+        archive = PageArchive(args.db)
+        tweet_filter = TweetFilter(min_likes=args.min_likes, min_retweets=args.min_retweets)
+        conversation = archive.rebuild(args.query, args.mode, not args.text, tweet_filter or None,
+                                       include_replies=not args.no_replies)
+        if not conversation['tweets']:
+            print(f"❌ No hay páginas archivadas de '{args.query}' (modo {args.mode}) en {args.db}")
+            sys.exit(1)
+        query_clean = query_filename(args.query)
+        output = args.output or os.path.join('scraping', f"{query_clean}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        atomic_write_dataset(output, conversation)
+        print(f"✓ {conversation['total_main_tweets']} tweets y {conversation['total_replies']} respuestas "
+              f"regenerados sin peticiones a la API en: {output}")
+
+    elif args.command == 'get':
+        files = [args.file] if args.file else [
+            os.path.join(args.dir, f) for f in sorted(os.listdir(args.dir)) if f.endswith('.json')
+        ]
+        for filepath in files:
+            try:
+                reader = DatasetReader(filepath, migrate=args.migrate)
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Se omite {filepath}: {e}", file=sys.stderr)
+                continue
+            with reader:
+                if args.tweet_id in reader:
+                    print(f"# {filepath}", file=sys.stderr)
+                    print(json.dumps(reader.get(args.tweet_id), ensure_ascii=False, indent=2))
+                    return
+        print(f"❌ Tweet {args.tweet_id} no encontrado", file=sys.stderr)
+        sys.exit(1)
+
+    elif args.command == 'search':
+        if not os.path.exists(args.db):
+            parser.error(f"No existe el índice {args.db} (ejecuta primero: python download_hashtag.py index)")
+        start = time.monotonic()
+        try:
+            results = TweetIndex(args.db).search(args.text, args.since, args.until, args.min_likes, args.min_retweets,
+                                                 args.user, args.hashtag, args.kind, args.order, args.limit)
+        except sqlite3.OperationalError as e:
+            parser.error(f"Consulta no válida: {e}")
+        elapsed_ms = (time.monotonic() - start) * 1000
+        for result in results:
+            if args.json:
+                print(json.dumps(result, ensure_ascii=False))
+                continue
+            date = datetime.fromtimestamp(result['timestamp']).strftime('%Y-%m-%d %H:%M') if result['timestamp'] else '?'
+            prefix = '↳ ' if result['kind'] == 'reply' else ''
+            text = ' '.join(result['text'].split())
+            print(f"{date} {prefix}@{result['username']} ❤ {result['likes']} 🔁 {result['retweets']} [{result['id']}]")
+            print(f"    {text[:200]}")
+        if not args.json:
+            print(f"\n{len(results)} resultado(s) en {elapsed_ms:.1f} ms")
 
 
 if __name__ == '__main__':
-    main()
+    # Con STREAM_OUTPUT=- la salida estándar queda solo para el NDJSON: los mensajes van a stderr
+    with redirect_stdout(sys.stderr) if os.getenv('STREAM_OUTPUT') == '-' else nullcontext():
+        if len(sys.argv) > 1:
+            cli(sys.argv[1:])
+        else:
+            main()
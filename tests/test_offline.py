@@ -0,0 +1,1815 @@
+"""
+Tests offline (sin peticiones reales a la API)
+Las respuestas HTTP se simulan con unittest.mock, por lo que no consumen requests
+"""
+
+import unittest
+import io
+import re
+import csv
+import os
+import json
+import time
+import shutil
+import tempfile
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from contextlib import redirect_stdout, redirect_stderr
+
+# Agregar el directorio padre al path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import download_hashtag
+from download_hashtag import (
+    TwitterHashtagScraper,
+    CheckpointPolicy,
+    ReplyFetchPlanner,
+    TweetFilter,
+    HeavyHitters,
+    StreamingAggregator,
+    SQLiteWorkQueue,
+    enqueue_backfill,
+    run_worker,
+    ApiKeyPool,
+    TokenBucket,
+    DeltaExporter,
+    MonitorScheduler,
+    MultiQueryMonitor,
+    batch_queries,
+    query_filename,
+    MAX_FILENAME_QUERY_BYTES,
+    combine_terms,
+    term_matcher,
+    normalize_users,
+    denormalize_users,
+    load_dataset,
+    MediaDownloader,
+    media_urls,
+    TweetIndex,
+    compact_datasets,
+    find_dataset_files,
+    DatasetReader,
+    build_offset_index,
+    atomic_write_dataset,
+    PhaseProfiler,
+    CallbackSink,
+    BufferedSink,
+    NDJSONSink,
+    UnixSocketSink,
+    EngagementTracker,
+    SeenSet,
+    PageArchive,
+    extract_cursor,
+    parse_date_limit,
+    split_date_range,
+    atomic_write_json,
+    find_incomplete_downloads,
+)
+
+
+def make_tweet(tweet_id, timestamp=1759690321, **fields):
+    """Construye un tweet con la estructura que devuelve la API"""
+    tweet = {
+        'id': str(tweet_id),
+        'conversation_id': str(tweet_id),
+        'text': f'tweet {tweet_id}',
+        'username': 'usuario',
+        'name': 'Usuario',
+        'user_id': '1',
+        'likes': 0,
+        'retweets': 0,
+        'replies': 0,
+        'views': 0,
+        'hashtags': [],
+        'timestamp': timestamp,
+        'time_parsed': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp)),
+    }
+    tweet.update(fields)
+    return tweet
+
+
+def fake_response(payload, status_code=200, headers=None):
+    """Simula un requests.Response con el payload JSON indicado"""
+    body = json.dumps(payload).encode('utf-8')
+    response = mock.Mock()
+    response.status_code = status_code
+    response.content = body
+    response.text = body.decode('utf-8')
+    response.headers = headers or {}
+    response.json.side_effect = lambda: json.loads(body)
+    if status_code >= 400:
+        response.raise_for_status.side_effect = download_hashtag.requests.exceptions.HTTPError(f"{status_code} Error")
+    else:
+        response.raise_for_status.return_value = None
+    return response
+
+
+class FakeAPI:
+    """
+    API simulada: páginas de búsqueda por cursor y respuestas por tweet
+
+    Args:
+        pages: Lista de listas de tweets (una por página de búsqueda)
+        replies: Diccionario tweet_id -> lista de respuestas
+    """
+
+    def __init__(self, pages=None, replies=None):
+        self.pages = pages or []
+        self.replies = replies or {}
+        self.calls = []
+
+    def __call__(self, url, headers=None, params=None, **kwargs):
+        params = params or {}
+        self.calls.append((url, dict(params)))
+
+        if url.endswith('/search/tweets'):
+            index = int(params.get('cursor', 0))
+            tweets = self.pages[index] if index < len(self.pages) else []
+            cursor = str(index + 1) if index + 1 < len(self.pages) else None
+            # Como la API real, respeta los operadores since_time:/since: del query
+            query = params.get('query', '')
+            since = re.search(r'since_time:(\d+)', query) or re.search(r'since:(\S+)', query)
+            if since:
+                limit = parse_date_limit(since.group(1)) if '-' in since.group(1) else int(since.group(1))
+                tweets = [t for t in tweets if t.get('timestamp', 0) >= limit]
+            return fake_response({'status': 'success', 'data': {'cursor': cursor, 'tweets': tweets}})
+
+        tweet_id = url.rstrip('/').split('/')[-2]
+        return fake_response({'tweets': self.replies.get(tweet_id, []), 'cursor': None})
+
+    def count(self, fragment):
+        """Número de peticiones cuya URL contiene fragment"""
+        return sum(1 for url, _ in self.calls if fragment in url)
+
+
+class OfflineTestCase(unittest.TestCase):
+    """Base: directorio temporal con carpeta scraping/ y credenciales ficticias"""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.original_dir = os.getcwd()
+        os.chdir(self.test_dir)
+        os.makedirs('scraping', exist_ok=True)
+
+        self.env = mock.patch.dict(os.environ, {
+            'RAPIDAPI_KEY': 'clave_de_prueba_1234',
+            'RAPIDAPI_HOST': 'api.example.com'
+        })
+        self.env.start()
+        download_hashtag.should_stop = False
+        download_hashtag.interrupted = False
+
+        self.sleep = mock.patch('download_hashtag.time.sleep')
+        self.sleep.start()
+
+    def tearDown(self):
+        self.sleep.stop()
+        self.env.stop()
+        os.chdir(self.original_dir)
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def make_scraper(self, **kwargs):
+        with mock.patch('builtins.print'):
+            return TwitterHashtagScraper(**kwargs)
+
+    def run_quiet(self, func, *args, **kwargs):
+        """Ejecuta func silenciando la salida por consola"""
+        with mock.patch('builtins.print'):
+            return func(*args, **kwargs)
+
+
+class TestAtomicCheckpoints(OfflineTestCase):
+    """Escritura atómica de checkpoints"""
+
+    def test_failed_write_keeps_previous_version(self):
+        """Un fallo a mitad de escritura no trunca el archivo existente"""
+        filepath = os.path.join('scraping', 'q.json')
+        atomic_write_json(filepath, {'status': 'in_progress', 'tweets': []})
+
+        with self.assertRaises(TypeError):
+            atomic_write_json(filepath, {'status': 'completed', 'bad': object()})
+
+        with open(filepath, 'r', encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['status'], 'in_progress')
+        self.assertEqual([n for n in os.listdir('scraping') if n.endswith('.tmp')], [])
+
+    def test_rolling_backups_and_recovery(self):
+        """Se rotan respaldos y se recupera uno si el principal está corrupto"""
+        filepath = os.path.join('scraping', 'q.json')
+        for total in range(3):
+            atomic_write_json(filepath, {'query': 'q', 'status': 'in_progress', 'total_main_tweets': total, 'tweets': []}, backups=2)
+
+        self.assertTrue(os.path.exists(filepath + '.bak1'))
+        self.assertTrue(os.path.exists(filepath + '.bak2'))
+        self.assertFalse(os.path.exists(filepath + '.bak3'))
+
+        with open(filepath, 'w', encoding='utf-8') as f:
+            f.write('{"query": "q", "tweets": [')
+
+        with mock.patch('builtins.print'):
+            incomplete = find_incomplete_downloads()
+
+        self.assertEqual(len(incomplete), 1)
+        self.assertEqual(incomplete[0]['total_tweets'], 1)
+
+
+class TestCheckpointPolicy(OfflineTestCase):
+    """Política de checkpoints configurable"""
+
+    def test_triggers(self):
+        """Cada umbral dispara por separado y mark() reinicia los contadores"""
+        policy = CheckpointPolicy(every_items=10, every_mb=1)
+        policy.record(items=9)
+        self.assertFalse(policy.due())
+        policy.record(items=1)
+        self.assertTrue(policy.due())
+        policy.mark(0.5, 2048)
+        self.assertFalse(policy.due())
+        policy.record(items=1, nbytes=2 * 1024 * 1024)
+        self.assertTrue(policy.due())
+
+        with mock.patch('download_hashtag.time.monotonic', return_value=policy.last_checkpoint + 61):
+            timed = CheckpointPolicy(every_seconds=60)
+            timed.last_checkpoint -= 61
+            timed.record(items=1)
+            self.assertTrue(timed.due())
+
+        self.assertEqual(policy.summary()['checkpoints'], 1)
+
+    def test_download_respects_item_policy(self):
+        """Con every_items alto solo se escriben los checkpoints necesarios"""
+        pages = [[make_tweet(p * 20 + n) for n in range(20)] for p in range(4)]
+        api = FakeAPI(pages=pages)
+        scraper = self.make_scraper()
+        policy = CheckpointPolicy(every_items=50)
+
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=api):
+            conversation = self.run_quiet(
+                scraper.download_full_conversation, 'q', include_replies=False, checkpoint_policy=policy
+            )
+
+        # 80 tweets: un checkpoint al pasar de 50 (página 3) y otro con los 20 pendientes
+        self.assertEqual(conversation['checkpoint_stats']['checkpoints'], 2)
+        self.assertEqual(conversation['total_main_tweets'], 80)
+        saved = os.path.join('scraping', conversation['_saved_filename'])
+        with open(saved, 'r', encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['status'], 'completed')
+
+
+class TestDateOperators(OfflineTestCase):
+    """Rango de fechas enviado a la API"""
+
+    def test_query_includes_operators(self):
+        """since:/until: se añaden al query y el filtro local descarta lo que sobre"""
+        inside = make_tweet(1, timestamp=1727827200)   # 2024-10-02
+        newer = make_tweet(2, timestamp=1729209600)    # 2024-10-18
+        api = FakeAPI(pages=[[newer, inside]])
+        scraper = self.make_scraper()
+
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=api):
+            tweets = self.run_quiet(
+                scraper.search_tweets, 'Python', since_date='2024-10-01', until_date='2024-10-15'
+            )
+
+        self.assertEqual(api.calls[0][1]['query'], '#Python since:2024-10-01 until:2024-10-15')
+        self.assertEqual([t['id'] for t in tweets], ['1'])
+
+    def test_operators_can_be_disabled(self):
+        """Con date_operators=False el query queda como antes"""
+        scraper = self.make_scraper(date_operators=False)
+        self.assertEqual(scraper._build_search_query('Python', True, '2024-10-15', '2024-10-01'), '#Python')
+
+
+class TestPartitionedBackfill(OfflineTestCase):
+    """Backfill paralelo por franjas de tiempo"""
+
+    def test_split_date_range(self):
+        """Franjas diarias con formato de día y franjas horarias con hora"""
+        self.assertEqual(split_date_range('2024-10-01', '2024-10-03'),
+                         [('2024-10-02', '2024-10-03'), ('2024-10-01', '2024-10-02')])
+        hourly = split_date_range('2024-10-01', '2024-10-02', slice_hours=6)
+        self.assertEqual(len(hourly), 4)
+        self.assertEqual(hourly[-1], ('2024-10-01 00:00', '2024-10-01 06:00'))
+
+    def test_slices_are_merged_without_duplicates(self):
+        """Cada franja pide solo su ventana y el resultado se combina ordenado"""
+        day = 24 * 3600
+        base = parse_date_limit('2024-10-01')
+        tweets = [make_tweet(n, timestamp=base + n * day // 2 + 60) for n in range(6)]
+
+        def fake_get(url, headers=None, params=None, **kwargs):
+            terms = dict(t.split(':', 1) for t in params['query'].split() if ':' in t)
+            since, until = parse_date_limit(terms['since']), parse_date_limit(terms['until'])
+            page = [t for t in tweets if since <= t['timestamp'] < until]
+            # La franja vecina devuelve también un duplicado del primer tweet
+            if since > base:
+                page.append(tweets[0])
+            return fake_response({'data': {'cursor': None, 'tweets': page}})
+
+        scraper = self.make_scraper(date_operators=True)
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=fake_get) as get:
+            merged = self.run_quiet(scraper.search_tweets_partitioned, 'q', '2024-10-01', '2024-10-04', max_workers=3)
+
+        self.assertEqual(get.call_count, 3)
+        self.assertEqual([t['id'] for t in merged], ['5', '4', '3', '2', '1', '0'])
+        self.assertEqual(os.listdir(os.path.join('scraping', 'slices')), [])
+
+    def test_slice_cut_by_error_is_not_completed(self):
+        """Una franja que termina por un 429 no se marca completada y se vuelve a pedir al relanzar"""
+        base = parse_date_limit('2024-10-01')
+        tweets = [make_tweet(n, timestamp=base + n * 24 * 3600 + 60) for n in range(3)]
+        rate_limited = [True]
+
+        def fake_get(url, headers=None, params=None, **kwargs):
+            terms = dict(t.split(':', 1) for t in params['query'].split() if ':' in t)
+            since, until = parse_date_limit(terms['since']), parse_date_limit(terms['until'])
+            if terms['since'] == '2024-10-02' and rate_limited[0]:
+                return fake_response({'message': 'Too Many Requests'}, status_code=429, headers={'Retry-After': '0'})
+            return fake_response({'data': {'cursor': None,
+                                           'tweets': [t for t in tweets if since <= t['timestamp'] < until]}})
+
+        scraper = self.make_scraper(date_operators=True)
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=fake_get):
+            partial = self.run_quiet(scraper.search_tweets_partitioned, 'q', '2024-10-01', '2024-10-04', max_workers=3)
+        self.assertEqual(sorted(t['id'] for t in partial), ['0', '2'])
+        # Solo las franjas completas quedan guardadas como tales
+        saved = [f for f in os.listdir(os.path.join('scraping', 'slices')) if f.endswith('.json')]
+        self.assertEqual(len(saved), 2)
+
+        rate_limited[0] = False
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=fake_get) as get:
+            merged = self.run_quiet(scraper.search_tweets_partitioned, 'q', '2024-10-01', '2024-10-04', max_workers=3)
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual([t['id'] for t in merged], ['2', '1', '0'])
+        self.assertEqual(os.listdir(os.path.join('scraping', 'slices')), [])
+
+    def test_token_bucket(self):
+        """El limitador permite la ráfaga inicial y luego frena"""
+        bucket = TokenBucket(rate=2, capacity=2)
+        self.assertTrue(bucket.try_acquire())
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+
+
+class TestReplyFetchPlanner(OfflineTestCase):
+    """Planificación de la descarga de respuestas"""
+
+    def test_plan_thresholds(self):
+        """Omite tweets con 0 respuestas y aplica min_likes y top-K"""
+        tweets = [
+            make_tweet(1, replies=0, likes=50),
+            make_tweet(2, replies=3, likes=1),
+            make_tweet(3, replies=10, likes=20),
+            make_tweet(4, replies=None, likes=40),
+        ]
+        self.assertEqual(ReplyFetchPlanner().plan(tweets), {'2', '3', '4'})
+        self.assertEqual(ReplyFetchPlanner(min_likes=10).plan(tweets), {'3', '4'})
+        self.assertEqual(ReplyFetchPlanner(top_k=1).plan(tweets), {'4'})
+
+    def test_download_skips_zero_reply_tweets_and_respects_budget(self):
+        """Solo se hacen peticiones de respuestas para tweets seleccionados y con presupuesto"""
+        tweets = [make_tweet(n, replies=(n % 2) * 5) for n in range(6)]
+        api = FakeAPI(pages=[tweets], replies={'1': [make_tweet(100)], '3': [make_tweet(101)]})
+        scraper = self.make_scraper()
+        planner = ReplyFetchPlanner(request_budget=2)
+
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=api):
+            conversation = self.run_quiet(scraper.download_full_conversation, 'q', reply_planner=planner)
+
+        self.assertEqual(api.count('/replies'), 2)
+        self.assertEqual(conversation['total_replies'], 2)
+        self.assertEqual(conversation['reply_plan']['skipped'], 4)
+
+
+class TestReplyTree(OfflineTestCase):
+    """Reconstrucción del árbol de respuestas"""
+
+    def test_crawl_builds_parent_children_index(self):
+        """Recorre por niveles, enlaza por in_reply_to_status_id y no repite IDs"""
+        replies = {
+            '1': [make_tweet(10, replies=2, in_reply_to_status_id='1'),
+                  make_tweet(11, replies=0, in_reply_to_status_id='1')],
+            '10': [make_tweet(20, replies=1, in_reply_to_status_id='10'),
+                   make_tweet(21, replies=0, in_reply_to_status_id='10'),
+                   make_tweet(11, replies=0, in_reply_to_status_id='1')],
+            '20': [make_tweet(30, replies=0, in_reply_to_status_id='20')],
+        }
+        api = FakeAPI(replies=replies)
+        scraper = self.make_scraper()
+
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=api):
+            tree = self.run_quiet(scraper.crawl_reply_tree, '1', max_depth=2)
+
+        self.assertEqual(tree['children'], {'1': ['10', '11'], '10': ['20', '21']})
+        self.assertEqual(list(tree['nodes']), ['10', '11', '20', '21'])
+        # Solo se piden '1' y '10' ('11' tiene 0 respuestas; '20' está fuera de profundidad)
+        self.assertEqual(api.count('/replies'), 2)
+
+    def test_crawl_stops_at_budget(self):
+        """El presupuesto compartido detiene el recorrido"""
+        replies = {'1': [make_tweet(10, replies=1, in_reply_to_status_id='1')],
+                   '10': [make_tweet(20, replies=1, in_reply_to_status_id='10')]}
+        api = FakeAPI(replies=replies)
+        scraper = self.make_scraper()
+
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=api):
+            tree = self.run_quiet(scraper.crawl_reply_tree, '1', max_depth=5,
+                                  planner=ReplyFetchPlanner(request_budget=1))
+
+        self.assertEqual(list(tree['nodes']), ['10'])
+        self.assertEqual(api.count('/replies'), 1)
+
+
+class TestTweetFilter(OfflineTestCase):
+    """Filtros componibles en cortocircuito"""
+
+    def sample(self):
+        return [
+            make_tweet(1, likes=5, retweets=1, views=100, lang='es', text='Hola Python'),
+            make_tweet(2, likes=50, retweets=9, views=900, lang='en', is_blue_verified=True,
+                       photos=[{'url': 'https://example.com/a.jpg'}]),
+            make_tweet(3, likes=20, retweets=0, views=None, lang='es', is_verified=True, text='python rocks'),
+        ]
+
+    def check_filters(self):
+        tweets = self.sample()
+        ids = lambda f: [t['id'] for t in f.apply(tweets)]
+        self.assertEqual(ids(TweetFilter(min_likes=10)), ['2', '3'])
+        self.assertEqual(ids(TweetFilter(min_likes=10) & TweetFilter(lang='es')), ['3'])
+        self.assertEqual(ids(TweetFilter(has_media=True)), ['2'])
+        self.assertEqual(ids(TweetFilter(text_regex=r'\bpython\b', verified_only=True)), ['3'])
+        self.assertEqual(ids(TweetFilter(min_views=50, min_retweets=1)), ['1', '2'])
+
+    def test_filters(self):
+        """Cada condición y su combinación con &"""
+        self.check_filters()
+
+    def test_cheapest_condition_first(self):
+        """La regex solo se evalúa sobre los tweets que pasan los contadores"""
+        pattern = mock.Mock(wraps=re.compile('python', re.IGNORECASE))
+        tweet_filter = TweetFilter(min_likes=10)
+        tweet_filter.conditions.insert(0, ('text', 'regex', pattern))
+        self.assertEqual([t['id'] for t in tweet_filter.apply(self.sample())], ['3'])
+        self.assertEqual(pattern.search.call_count, 2)
+
+    def test_not_slower_than_plain_loop(self):
+        """Benchmark: apply_filters no es más lento que el bucle original por tweet"""
+        items = [{'tweet': make_tweet(n, likes=n % 100, is_verified=n % 3 == 0), 'replies': []}
+                 for n in range(100000)]
+
+        def plain_loop():
+            kept = []
+            for item in items:
+                tweet = item['tweet']
+                if tweet.get('likes', 0) < 50:
+                    continue
+                if not (tweet.get('is_verified', False) or tweet.get('is_blue_verified', False)):
+                    continue
+                kept.append(item)
+            return kept
+
+        def best_of(function, runs=5):
+            timings = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                result = function()
+                timings.append(time.perf_counter() - start)
+            return min(timings), result
+
+        scraper = self.make_scraper()
+        baseline, expected = best_of(plain_loop)
+        new, data = best_of(lambda: self.run_quiet(scraper.apply_filters, {'tweets': items},
+                                                   min_likes=50, verified_only=True))
+        self.assertEqual(data['tweets'], expected)
+        # Margen para el ruido de la máquina: en local ambos tardan lo mismo (±5%)
+        self.assertLess(new, baseline * 1.5)
+
+    def test_apply_filters_updates_totals(self):
+        """apply_filters recalcula totales de tweets y respuestas"""
+        items = [{'tweet': t, 'replies': [make_tweet(100 + n)] * n} for n, t in enumerate(self.sample())]
+        data = {'tweets': items}
+        scraper = self.make_scraper()
+        self.run_quiet(scraper.apply_filters, data, min_likes=10, tweet_filter=TweetFilter(lang='es'))
+        self.assertEqual(data['total_main_tweets'], 1)
+        self.assertEqual(data['total_replies'], 2)
+        self.assertEqual(data['total_items'], 3)
+
+
+class TestFilterPushdown(OfflineTestCase):
+    """Filtros aplicados antes de pedir respuestas y de guardar"""
+
+    def test_filtered_tweets_never_fetch_replies(self):
+        """Solo los tweets que pasan el filtro generan peticiones de respuestas y se guardan"""
+        tweets = [make_tweet(n, likes=n * 10, replies=1) for n in range(5)]
+        api = FakeAPI(pages=[tweets], replies={'3': [make_tweet(30)], '4': [make_tweet(40)]})
+        scraper = self.make_scraper()
+
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=api):
+            conversation = self.run_quiet(scraper.download_full_conversation, 'q',
+                                          tweet_filter=TweetFilter(min_likes=30))
+
+        self.assertEqual([item['tweet']['id'] for item in conversation['tweets']], ['3', '4'])
+        self.assertEqual(api.count('/replies'), 2)
+        with open(os.path.join('scraping', conversation['_saved_filename']), 'r', encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['total_main_tweets'], 2)
+
+
+class TestStreamingAggregator(OfflineTestCase):
+    """Estadísticas incrementales con memoria acotada"""
+
+    def test_heavy_hitters_keep_frequent_keys(self):
+        """Las claves frecuentes sobreviven aunque haya muchas claves raras"""
+        hitters = HeavyHitters(capacity=5)
+        for n in range(1000):
+            hitters.add('popular')
+            hitters.add(f'rara{n}')
+        self.assertEqual(len(hitters.counts), 5)
+        self.assertEqual(hitters.top(1)[0][0], 'popular')
+
+    def test_heavy_hitters_space_saving_bounds(self):
+        """Conteos que nunca subestiman y claves con frecuencia > N/capacidad siempre presentes"""
+        import random
+
+        rng = random.Random(7)
+        stream = [f'k{min(int(rng.paretovariate(1.2)), 300)}' for _ in range(20000)]
+        hitters = HeavyHitters(capacity=50)
+        exact = {}
+        for key in stream:
+            hitters.add(key)
+            exact[key] = exact.get(key, 0) + 1
+
+        self.assertEqual(sum(hitters.counts.values()), len(stream))
+        self.assertLessEqual(len(hitters._heap), 2 * 50 + 16)
+        for key, count in exact.items():
+            if count > len(stream) / 50:
+                self.assertGreaterEqual(hitters.counts[key], count)
+
+    def test_download_writes_analytics(self):
+        """El dataset incluye las estadísticas calculadas durante la descarga"""
+        tweets = [make_tweet(n, timestamp=1759690321 + n * 1800, username=f'u{n % 2}', likes=n,
+                             hashtags=['Python', 'AI'] if n % 2 else ['python'], replies=1 if n == 0 else 0)
+                  for n in range(4)]
+        api = FakeAPI(pages=[tweets], replies={'0': [make_tweet(10, username='u9')]})
+        scraper = self.make_scraper()
+
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=api):
+            conversation = self.run_quiet(scraper.download_full_conversation, 'q')
+
+        analytics = conversation['analytics']
+        self.assertEqual(analytics['totals']['tweets'], 4)
+        self.assertEqual(analytics['totals']['replies'], 1)
+        self.assertEqual(analytics['totals']['likes'], 6)
+        self.assertEqual(analytics['top_hashtags'][0], ('python', 4))
+        self.assertEqual(sum(analytics['volume_per_hour'].values()), 5)
+
+    def test_resume_analytics_cover_merged_and_filtered_tweets(self):
+        """Al reanudar, las estadísticas describen los tweets combinados que quedan tras los filtros"""
+        path = os.path.join('scraping', 'python_20250101_000000.json')
+        atomic_write_dataset(path, {
+            'query': '#python', 'search_type': 'hashtag', 'mode': 'latest', 'status': 'in_progress',
+            'tweets': [{'tweet': make_tweet(1, username='antiguo', likes=50), 'replies': []},
+                       {'tweet': make_tweet(2, username='antiguo', likes=1), 'replies': []}],
+            'analytics': {}
+        })
+        api = FakeAPI(pages=[[make_tweet(3, username='nuevo', likes=20), make_tweet(4, username='nuevo', likes=2)]])
+        answers = {'¿Reanudar': '1', '¿Configurar opciones avanzadas': 's', 'Filtrar tweets con mínimo de likes': '10'}
+
+        def fake_input(prompt):
+            return next((answer for start, answer in answers.items() if prompt.startswith(start)), '')
+
+        with mock.patch('builtins.input', side_effect=fake_input), \
+                mock.patch('download_hashtag.signal.signal'), \
+                mock.patch('download_hashtag.requests.Session.get', side_effect=api):
+            self.run_quiet(download_hashtag.main)
+
+        data, _ = load_dataset(path)
+        analytics = data['analytics']
+        self.assertEqual([item['tweet']['id'] for item in data['tweets']], ['1', '3'])
+        self.assertEqual(analytics['totals']['tweets'], 2)
+        self.assertEqual(analytics['totals']['likes'], 70)
+        self.assertEqual(dict(analytics['top_users']), {'antiguo': 1, 'nuevo': 1})
+
+
+class TestWorkQueue(OfflineTestCase):
+    """Cola de tareas compartida con leases"""
+
+    def test_lease_complete_and_expiry(self):
+        """Un lease caducado vuelve a la cola y el worker original ya no puede completarla"""
+        queue = SQLiteWorkQueue(os.path.join('scraping', 'queue.db'), lease_seconds=60, max_attempts=2)
+        task_id = queue.put('replies', {'tweet_id': '1'})
+
+        task = queue.lease('w1')
+        self.assertEqual(task['id'], task_id)
+        self.assertIsNone(queue.lease('w2'))
+
+        # El worker w1 "muere": su lease caduca
+        with mock.patch('download_hashtag.time.time', return_value=download_hashtag.time.time() + 120):
+            retaken = queue.lease('w2')
+        self.assertEqual(retaken['attempts'], 2)
+        self.assertFalse(queue.complete(task_id, 'w1', {}))
+        self.assertTrue(queue.complete(task_id, 'w2', {'replies': 0}))
+        self.assertEqual(queue.stats(), {'done': 1})
+
+    @unittest.skipUnless(os.getenv('REDIS_URL'), 'define REDIS_URL para probar RedisWorkQueue')
+    def test_redis_stale_worker_cannot_touch_released_lease(self):
+        """En Redis, un worker con el lease caducado no completa, falla ni libera la tarea de otro"""
+        queue = download_hashtag.RedisWorkQueue(os.getenv('REDIS_URL'), name=f'test_{os.getpid()}',
+                                                lease_seconds=60, max_attempts=3)
+        self.addCleanup(queue.redis.delete, *(queue._key(k) for k in ('tasks', 'pending', 'leases', 'next_id')))
+        task_id = queue.put('replies', {'tweet_id': '1'})
+        queue.lease('w1')
+        with mock.patch('download_hashtag.time.time', return_value=download_hashtag.time.time() + 120):
+            self.assertEqual(queue.lease('w2')['id'], task_id)
+
+        self.assertFalse(queue.heartbeat(task_id, 'w1', {'progreso': 1}))
+        self.assertFalse(queue.complete(task_id, 'w1', {}))
+        queue.fail(task_id, 'w1', 'tarde')
+        queue.release(task_id, 'w1')
+        self.assertEqual(queue.redis.llen(queue._key('pending')), 0)
+        self.assertEqual(queue.redis.zcard(queue._key('leases')), 1)
+
+        self.assertTrue(queue.heartbeat(task_id, 'w2', {'progreso': 1}))
+        self.assertTrue(queue.complete(task_id, 'w2', {'replies': 0}))
+        self.assertEqual(queue.stats(), {'done': 1})
+        self.assertEqual(queue.redis.zcard(queue._key('leases')), 0)
+
+    def test_worker_processes_slices(self):
+        """El worker ejecuta las franjas encoladas y reporta el archivo generado"""
+        queue = SQLiteWorkQueue(os.path.join('scraping', 'queue.db'))
+        enqueue_backfill(queue, 'q', '2024-10-01', '2024-10-03')
+        api = FakeAPI(pages=[[]])
+        scraper = self.make_scraper()
+
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=api):
+            completed = self.run_quiet(run_worker, scraper, queue, 'w1', exit_when_idle=True)
+
+        self.assertEqual(completed, 2)
+        self.assertEqual(queue.stats(), {'done': 2})
+        self.assertEqual(len([f for f in os.listdir(os.path.join('scraping', 'slices')) if f.endswith('.json')]), 2)
+
+    def test_query_task_without_incremental_save(self):
+        """Una tarea 'query' sin guardado incremental guarda al final y completa su lease"""
+        queue = SQLiteWorkQueue(os.path.join('scraping', 'queue.db'))
+        queue.put('query', {'query': 'q', 'include_replies': False, 'incremental_save': False})
+        api = FakeAPI(pages=[[make_tweet(1)]])
+        scraper = self.make_scraper()
+
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=api):
+            completed = self.run_quiet(run_worker, scraper, queue, 'w1', exit_when_idle=True)
+
+        self.assertEqual(completed, 1)
+        self.assertEqual(queue.stats(), {'done': 1})
+        with queue._connect() as conn:
+            result = json.loads(conn.execute("SELECT result FROM tasks").fetchone()[0])
+        self.assertTrue(os.path.exists(result['file']))
+        self.assertEqual(result['tweets'], 1)
+
+    def test_heartbeat_reports_checkpoint_progress(self):
+        """Los heartbeats incluyen el último checkpoint guardado por la tarea"""
+        queue = SQLiteWorkQueue(os.path.join('scraping', 'queue.db'), lease_seconds=0.06)
+        enqueue_backfill(queue, 'q', '2024-10-01', '2024-10-02')
+        api = FakeAPI(pages=[[make_tweet(1, timestamp=1727740800 + 60)], [make_tweet(2, timestamp=1727740800 + 30)]])
+        scraper = self.make_scraper()
+        progress = []
+        original = queue.heartbeat
+
+        def record_heartbeat(task_id, worker_id, data=None):
+            progress.append(data)
+            return original(task_id, worker_id, data)
+
+        def slow_get(url, headers=None, params=None, **kwargs):
+            threading.Event().wait(0.1)
+            return api(url, headers, params)
+
+        with mock.patch.object(queue, 'heartbeat', side_effect=record_heartbeat), \
+                mock.patch('download_hashtag.requests.Session.get', side_effect=slow_get):
+            self.run_quiet(run_worker, scraper, queue, 'w1', exit_when_idle=True)
+
+        checkpoints = [p['checkpoint'] for p in progress if p.get('checkpoint')]
+        self.assertTrue(checkpoints)
+        self.assertIn('slices', checkpoints[-1]['file'])
+        self.assertGreaterEqual(checkpoints[-1]['items'], 1)
+
+
+class TestApiKeyPool(OfflineTestCase):
+    """Pool de API keys con failover"""
+
+    def test_exhausted_keys_wait_is_interruptible(self):
+        """Con todas las keys en pausa se avisa una vez y Ctrl+C corta la espera"""
+        pool = ApiKeyPool(['clave_a', 'clave_b'])
+        for state in pool.keys:
+            state.update(status='cooldown', cooldown_until=download_hashtag.time.time() + 3600)
+        sleeps = []
+
+        def fake_sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) == 3:
+                download_hashtag.should_stop = True
+
+        download_hashtag.time.sleep.side_effect = fake_sleep
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.assertIsNone(pool.acquire())
+
+        self.assertEqual(len(sleeps), 3)
+        self.assertTrue(all(seconds <= 0.5 for seconds in sleeps))
+        self.assertEqual(output.getvalue().count('Todas las API keys en pausa'), 1)
+
+        # El scraper termina la búsqueda en lugar de quedarse esperando
+        scraper = self.make_scraper()
+        scraper.key_pool = pool
+        download_hashtag.should_stop = False
+        sleeps.clear()
+        with mock.patch('download_hashtag.requests.Session.get') as get:
+            tweets = self.run_quiet(scraper.search_tweets, 'q')
+        self.assertEqual(tweets, [])
+        get.assert_not_called()
+
+    def test_failover_on_rate_limit(self):
+        """Un 429 pausa la key y la petición se repite con otra"""
+        os.environ['RAPIDAPI_KEYS'] = 'clave_aaaa_1111,clave_bbbb_2222'
+        scraper = self.make_scraper()
+        used = []
+
+        def fake_get(url, headers=None, params=None, **kwargs):
+            used.append(headers['X-RapidAPI-Key'])
+            if headers['X-RapidAPI-Key'] == 'clave_aaaa_1111':
+                return fake_response({}, status_code=429, headers={'Retry-After': '30'})
+            return fake_response({'data': {'tweets': [make_tweet(1)], 'cursor': None}},
+                                 headers={'X-RateLimit-Requests-Remaining': '99', 'X-RateLimit-Requests-Limit': '100'})
+
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=fake_get):
+            tweets = self.run_quiet(scraper.search_tweets, 'q')
+            self.run_quiet(scraper.search_tweets, 'q')
+
+        self.assertEqual(len(tweets), 1)
+        self.assertEqual(used, ['clave_aaaa_1111', 'clave_bbbb_2222', 'clave_bbbb_2222'])
+        usage = {u['key']: u for u in scraper.key_pool.usage_report()}
+        self.assertEqual(usage['clave_...1111']['status'], 'cooldown')
+        self.assertEqual(usage['clave_...2222']['quota_remaining'], 99)
+
+    def test_prefers_key_with_more_quota(self):
+        """Se elige la key sana con más cuota restante"""
+        pool = ApiKeyPool(['a', 'b'])
+        pool.keys[0]['quota_remaining'] = 5
+        pool.keys[1]['quota_remaining'] = 50
+        self.assertEqual(pool.acquire()['key'], 'b')
+        pool.report(pool.keys[1], fake_response({}, status_code=403))
+        self.assertEqual(pool.acquire()['key'], 'a')
+
+
+class TestDeltaExporter(OfflineTestCase):
+    """Exportación incremental del modo monitoreo"""
+
+    def conversation(self, ids, replies=()):
+        items = [{'tweet': make_tweet(i), 'replies': []} for i in ids]
+        items[0]['replies'] = [make_tweet(r) for r in replies]
+        return {'query': '#python', 'tweets': items}
+
+    def test_appends_only_new_rows(self):
+        """Cada iteración añade solo los tweets y respuestas no vistos"""
+        exporter = DeltaExporter('#python')
+        self.assertEqual(exporter.write(self.conversation([1, 2], replies=[10])), (2, 1))
+        self.assertEqual(exporter.write(self.conversation([3, 2, 1], replies=[10, 11])), (1, 1))
+        self.assertEqual(exporter.write(self.conversation([3])), (0, 0))
+
+        jsonl_path, csv_path = exporter.current_paths()
+        with open(jsonl_path, encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([r['id'] for r in records], ['1', '10', '2', '3', '11'])
+        self.assertEqual(records[1]['_type'], 'reply')
+        self.assertEqual(records[1]['_parent_id'], '1')
+
+        with open(csv_path, encoding='utf-8-sig') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[0].startswith('tipo,id_padre,id,'))
+
+    def test_seen_ids_survive_restart(self):
+        """Un monitor reiniciado no vuelve a escribir lo ya exportado"""
+        DeltaExporter('#python', csv_enabled=False).write(self.conversation([1, 2]))
+        exporter = DeltaExporter('#python', csv_enabled=False)
+        self.assertEqual(exporter.write(self.conversation([1, 2, 3])), (1, 0))
+        self.assertFalse(os.path.exists(exporter.current_paths()[1]))
+
+    def test_rotation_suffix(self):
+        """Con rotate_hours el nombre del archivo incluye el inicio del periodo"""
+        exporter = DeltaExporter('#python', rotate_hours=6)
+        jsonl_path, _ = exporter.current_paths()
+        self.assertRegex(os.path.basename(jsonl_path), r'^python_stream_\d{8}_\d{4}\.jsonl$')
+
+    def test_legacy_state_is_migrated(self):
+        """Un .state con la lista completa de IDs se carga en el SeenSet"""
+        atomic_write_json(os.path.join('scraping', 'python_stream.state'),
+                          {'ids': ['1', '2'], 'watermark': 1759690321})
+        exporter = DeltaExporter('#python', csv_enabled=False)
+        self.assertIn('2', exporter.seen)
+        self.assertEqual(exporter.write(self.conversation([1, 2, 3])), (1, 0))
+        with open(exporter.state_path, encoding='utf-8') as f:
+            self.assertIn('seen', json.load(f))
+
+
+class TestMonitorScheduler(OfflineTestCase):
+    """Planificador del modo monitoreo"""
+
+    def setUp(self):
+        super().setUp()
+        self.clock = [1000.0]
+        self.monotonic = mock.patch('download_hashtag.time.monotonic', side_effect=lambda: self.clock[0])
+        self.monotonic.start()
+
+    def tearDown(self):
+        self.monotonic.stop()
+        super().tearDown()
+
+    def poll(self, scheduler, new_tweets, duration=0, **kwargs):
+        """Simula una búsqueda que tarda `duration` segundos"""
+        self.clock[0] = max(self.clock[0], scheduler.next_fire)
+        scheduler.fire()
+        self.clock[0] += duration
+        return scheduler.record(new_tweets, **kwargs)
+
+    def test_fixed_cadence_without_drift(self):
+        """La duración de la descarga no desplaza la rejilla de búsquedas"""
+        scheduler = MonitorScheduler(300, adaptive=False)
+        fires = []
+        for _ in range(4):
+            self.poll(scheduler, 5, duration=40)
+            fires.append(scheduler.fired_at)
+        self.assertEqual([f - fires[0] for f in fires], [0, 300, 600, 900])
+
+    def test_long_download_skips_missed_slots(self):
+        """Una descarga más larga que el intervalo salta huecos en vez de encadenar"""
+        scheduler = MonitorScheduler(100, adaptive=False)
+        self.poll(scheduler, 5, duration=250)
+        self.assertEqual(scheduler.next_fire, 1300)
+        self.assertEqual(scheduler.skipped_slots, 2)
+
+    def test_adapts_to_rate(self):
+        """Acorta el intervalo en picos y lo alarga de forma gradual en calma"""
+        scheduler = MonitorScheduler(300, target_new=20)
+        self.poll(scheduler, 500)                 # Histórico inicial: no se usa
+        self.assertEqual(scheduler.interval, 300)
+        self.poll(scheduler, 300)                 # 1 tweet/s -> 20 s, limitado al mínimo
+        self.assertEqual(scheduler.interval, 75)
+        self.poll(scheduler, 0)
+        self.poll(scheduler, 0)
+        self.poll(scheduler, 0)
+        self.assertGreater(scheduler.interval, 75)
+        self.assertLessEqual(scheduler.interval, 1200)
+
+    def test_saturated_poll_halves_interval(self):
+        """Si se llega al límite de tweets se pregunta antes"""
+        scheduler = MonitorScheduler(300, target_new=20)
+        self.poll(scheduler, 5)
+        self.poll(scheduler, 40, saturated=True)
+        self.assertEqual(scheduler.interval, 150)
+
+    def test_respects_quota_budget(self):
+        """El intervalo no baja de lo que permite la cuota restante"""
+        pool = ApiKeyPool(['clave'])
+        pool.report(pool.keys[0], fake_response({}, headers={
+            'X-RateLimit-Requests-Remaining': '10', 'X-RateLimit-Requests-Reset': '3600'}))
+        scheduler = MonitorScheduler(60, key_pool=pool, adaptive=False)
+        interval = self.poll(scheduler, 5, requests_used=5)
+        # 5 peticiones por búsqueda con 10 restantes en una hora -> 1800 s
+        self.assertAlmostEqual(interval, 1800, delta=5)
+
+
+class TestMultiQueryMonitor(OfflineTestCase):
+    """Monitoreo de varios términos en un proceso"""
+
+    def setUp(self):
+        super().setUp()
+        self.clock = [1000.0]
+        self.monotonic = mock.patch('download_hashtag.time.monotonic', side_effect=lambda: self.clock[0])
+        self.monotonic.start()
+        # El tiempo simulado avanza con cada espera del monitor
+        download_hashtag.time.sleep.side_effect = lambda seconds: self.clock.__setitem__(0, self.clock[0] + seconds)
+
+    def tearDown(self):
+        self.monotonic.stop()
+        super().tearDown()
+
+    def test_interleaves_queries_with_own_datasets(self):
+        """Cada término tiene su cadencia, su dataset y su marca de agua"""
+        scraper = self.make_scraper()
+        api = FakeAPI(pages=[[make_tweet(1), make_tweet(2)]])
+        monitor = MultiQueryMonitor(scraper, ['python', 'rust'], 60, adaptive=False, export_csv=False,
+                                    max_workers=2, duration=150, mode='latest', include_replies=False)
+
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=api):
+            summary = self.run_quiet(monitor.run)
+
+        by_query = {result['query']: result for result in summary}
+        # Arranques escalonados: python en 0, 60, 120; rust en 30, 90
+        self.assertEqual(by_query['python']['polls'], 3)
+        self.assertEqual(by_query['rust']['polls'], 2)
+        self.assertEqual(by_query['python']['new_tweets'], 2)
+        self.assertEqual(by_query['rust']['new_tweets'], 2)
+        self.assertTrue(os.path.exists(os.path.join('scraping', 'python_stream.jsonl')))
+        self.assertTrue(os.path.exists(os.path.join('scraping', 'rust_stream.jsonl')))
+
+        # Tras la primera búsqueda solo se piden tweets posteriores a la marca de agua
+        queries = [params['query'] for _, params in api.calls]
+        self.assertNotIn('since_time:', queries[0])
+        self.assertIn('since_time:', queries[-1])
+
+    def test_failed_poll_does_not_stop_monitor(self):
+        """Un error en un término se registra y el resto sigue"""
+        scraper = self.make_scraper()
+        monitor = MultiQueryMonitor(scraper, ['python'], 60, adaptive=False, export_csv=False,
+                                    max_workers=1, duration=100, include_replies=False)
+
+        with mock.patch.object(scraper, 'download_full_conversation', side_effect=RuntimeError('caída')):
+            summary = self.run_quiet(monitor.run)
+
+        self.assertEqual(summary[0]['polls'], 2)
+        self.assertEqual(summary[0]['errors'], 2)
+
+    def test_refetches_only_threads_whose_reply_count_grew(self):
+        """Los hilos sin respuestas nuevas no se vuelven a pedir; del que crece solo se añade el delta"""
+        scraper = self.make_scraper()
+        api = FakeAPI(pages=[[make_tweet(1, replies=1, likes=1), make_tweet(2)]],
+                      replies={'1': [make_tweet(10)]})
+
+        def fake_get(url, headers=None, params=None, **kwargs):
+            if url.endswith('/search/tweets') and api.count('/search/tweets') == 2:
+                api.pages = [[make_tweet(1, replies=2, likes=5), make_tweet(2)]]
+                api.replies = {'1': [make_tweet(10), make_tweet(11)]}
+            return api(url, headers, params)
+
+        monitor = MultiQueryMonitor(scraper, ['python'], 60, adaptive=False, export_csv=False,
+                                    max_workers=1, duration=150)
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=fake_get):
+            summary = self.run_quiet(monitor.run)
+
+        self.assertEqual(summary[0]['polls'], 3)
+        self.assertEqual(api.count('/replies'), 2)
+        self.assertEqual(summary[0]['new_replies'], 2)
+        self.assertEqual(summary[0]['refreshed_threads'], 1)
+        self.assertEqual(summary[0]['unchanged_threads'], 1)
+
+        with open(os.path.join('scraping', 'python_stream.jsonl'), encoding='utf-8') as f:
+            self.assertEqual([json.loads(line)['id'] for line in f], ['1', '10', '2', '11'])
+
+        series = EngagementTracker(summary[0]['engagement']).series()
+        self.assertEqual([point['likes'] for point in series['1']], [1, 5])
+        self.assertEqual([point['fetched'] for point in series['1']], [1, 1])
+        self.assertEqual(len(series['2']), 1)
+
+    def test_refresh_window_reaches_threads_behind_watermark(self):
+        """Un hilo anterior a la marca de agua recibe sus respuestas nuevas dentro de la ventana de refresco"""
+        now = int(time.time())
+
+        def run_monitor(query, refresh_hours):
+            api = FakeAPI(pages=[[make_tweet(1, timestamp=now - 7200, replies=1)]],
+                          replies={'1': [make_tweet(10, timestamp=now - 7000)]})
+
+            def fake_get(url, headers=None, params=None, **kwargs):
+                searches = api.count('/search/tweets')
+                if url.endswith('/search/tweets') and searches == 1:
+                    # Un tweet nuevo adelanta la marca de agua más allá del hilo antiguo
+                    api.pages = [[make_tweet(2, timestamp=now - 60), make_tweet(1, timestamp=now - 7200, replies=1)]]
+                elif url.endswith('/search/tweets') and searches == 2:
+                    api.pages = [[make_tweet(2, timestamp=now - 60), make_tweet(1, timestamp=now - 7200, replies=2)]]
+                    api.replies = {'1': [make_tweet(10, timestamp=now - 7000), make_tweet(11, timestamp=now - 30)]}
+                return api(url, headers, params)
+
+            monitor = MultiQueryMonitor(self.make_scraper(), [query], 60, adaptive=False, export_csv=False,
+                                        max_workers=1, duration=150, refresh_hours=refresh_hours)
+            with mock.patch('download_hashtag.requests.Session.get', side_effect=fake_get):
+                return self.run_quiet(monitor.run)[0]
+
+        # Sin ventana solo se piden tweets posteriores a la marca de agua: el hilo no vuelve
+        self.assertEqual(run_monitor('python', 0)['new_replies'], 1)
+
+        summary = run_monitor('rust', 24)
+        self.assertEqual(summary['polls'], 3)
+        self.assertEqual(summary['new_tweets'], 2)
+        self.assertEqual(summary['new_replies'], 2)
+        self.assertEqual(summary['refreshed_threads'], 1)
+
+    def test_monitor_output_can_be_indexed(self):
+        """index_directory indexa los datasets del monitor sin tropezar con el archivo de engagement"""
+        scraper = self.make_scraper()
+        api = FakeAPI(pages=[[make_tweet(1, replies=1), make_tweet(2)]], replies={'1': [make_tweet(10)]})
+        monitor = MultiQueryMonitor(scraper, ['python'], 60, adaptive=False, export_csv=False,
+                                    max_workers=1, duration=30)
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=api):
+            summary = self.run_quiet(monitor.run)
+        self.assertTrue(os.path.exists(summary[0]['engagement']))
+        # Líneas que no son tweets exportados (p. ej. instantáneas de un archivo antiguo) se ignoran
+        with open(os.path.join('scraping', 'python_stream_engagement.jsonl'), 'w', encoding='utf-8') as f:
+            f.write(json.dumps(['1', 1000, 0, 0, 1, 0, 1]) + '\n' + json.dumps({'id': '5'}) + '\n')
+
+        files, tweets = self.run_quiet(TweetIndex().index_directory, 'scraping')
+        self.assertEqual((files, tweets), (2, 3))
+
+
+class TestCombinedQueries(OfflineTestCase):
+    """Búsquedas combinadas con OR y reparto por término"""
+
+    def test_combine_and_batch(self):
+        """Los términos se unen con OR sin superar la longitud máxima"""
+        self.assertEqual(combine_terms(['python', '#rust']), '(#python OR #rust)')
+        self.assertEqual(combine_terms(['machine learning', '"deep learning"'], is_hashtag=False),
+                         '((machine learning) OR "deep learning")')
+        self.assertEqual(combine_terms(['python']), '#python')
+
+        terms = [f'tag{i:02d}' for i in range(30)]
+        batches = batch_queries(terms, max_length=100)
+        self.assertEqual(sum(batches, []), terms)
+        self.assertTrue(all(len(combine_terms(batch)) <= 100 for batch in batches))
+        self.assertGreater(len(batches), 1)
+
+    def test_term_matcher(self):
+        """Coincidencia por hashtags, frase exacta o todas las palabras"""
+        self.assertTrue(term_matcher('Python')(make_tweet(1, hashtags=['python'])))
+        self.assertTrue(term_matcher('python')(make_tweet(1, text='Me gusta #Python!')))
+        self.assertFalse(term_matcher('python')(make_tweet(1, text='#pythonista')))
+        self.assertTrue(term_matcher('Elon Musk', is_hashtag=False)(make_tweet(1, text='musk dijo algo, elon')))
+        self.assertFalse(term_matcher('"Elon Musk"', is_hashtag=False)(make_tweet(1, text='musk dijo algo, elon')))
+
+    def test_download_combined_demuxes(self):
+        """Una sola paginación para el lote y un dataset por término"""
+        scraper = self.make_scraper()
+        shared = make_tweet(1, hashtags=['python', 'rust'], replies=2)
+        api = FakeAPI(
+            pages=[[shared, make_tweet(2, hashtags=['python'])],
+                   [make_tweet(3, hashtags=['rust']), make_tweet(4, text='sin hashtag')]],
+            replies={'1': [make_tweet(10), make_tweet(11)]}
+        )
+
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=api):
+            conversations = self.run_quiet(lambda: list(scraper.download_combined(['python', 'rust', 'go'])))
+
+        self.assertEqual(api.count('/search/tweets'), 2)
+        self.assertEqual(api.count('/replies'), 1)
+        self.assertEqual(api.calls[0][1]['query'], '(#python OR #rust OR #go)')
+
+        by_query = {c['query']: c for c in conversations}
+        self.assertEqual([i['tweet']['id'] for i in by_query['python']['tweets']], ['1', '2'])
+        self.assertEqual([i['tweet']['id'] for i in by_query['rust']['tweets']], ['1', '3'])
+        self.assertEqual(by_query['go']['total_main_tweets'], 0)
+        self.assertEqual(by_query['python']['total_replies'], 2)
+        self.assertEqual(by_query['rust']['batched_query'], '(#python OR #rust OR #go)')
+        # El tweet que no corresponde a ningún término se conserva con la consulta combinada
+        self.assertEqual(by_query['(#python OR #rust OR #go)']['total_main_tweets'], 1)
+        # El archivo de la consulta combinada se elimina al terminar el lote
+        self.assertEqual([f for f in os.listdir('scraping') if f.endswith('.json')], [])
+
+    def test_full_length_batch_has_short_filenames(self):
+        """Un lote de 450 caracteres guarda checkpoints y datasets con nombres cortos y estables"""
+        terms = [f'etiqueta_larga_{i:04d}' for i in range(40)]
+        batches = batch_queries(terms)
+        combined = combine_terms(batches[0])
+        self.assertGreater(len(combined), 400)
+        self.assertEqual(query_filename(combined), query_filename(combined))
+        self.assertTrue(query_filename(combined).startswith('etiqueta_larga_0000_OR_'))
+        self.assertLessEqual(len(query_filename('x' * 300).encode('utf-8')), MAX_FILENAME_QUERY_BYTES)
+
+        scraper = self.make_scraper()
+        api = FakeAPI(pages=[[make_tweet(1, hashtags=[terms[0]])], [make_tweet(2, text='sin etiqueta')]])
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=api):
+            conversations = self.run_quiet(lambda: list(scraper.download_combined(terms[:len(batches[0])])))
+
+        self.assertEqual(api.count('/search/tweets'), 2)
+        unmatched = next(c for c in conversations if c['query'] == combined)
+        filepath = self.run_quiet(scraper.save_to_json, unmatched)
+        self.assertLess(len(os.path.basename(filepath)), 100)
+        self.assertTrue(all(len(f) < 100 for f in os.listdir('scraping')))
+
+
+class TestNormalizedUsers(OfflineTestCase):
+    """Autores guardados una vez en el mapa 'users'"""
+
+    def dataset(self):
+        return {
+            'query': '#python',
+            'tweets': [
+                {'tweet': make_tweet(1, user_id='7', username='ana', name='Ana'),
+                 'replies': [make_tweet(10, user_id='8', username='bob', name='Bob'),
+                             make_tweet(11, user_id='7', username='ana', name='Ana R.')]},
+                {'tweet': make_tweet(2, user_id='7', username='ana', name='Ana'), 'replies': []},
+            ]
+        }
+
+    def test_round_trip(self):
+        """La vista original se reconstruye exactamente, incluso con nombres cambiados"""
+        data = self.dataset()
+        normalized = normalize_users(data)
+
+        self.assertEqual(set(normalized['users']), {'7', '8'})
+        self.assertEqual(normalized['users']['7']['username'], 'ana')
+        self.assertNotIn('username', normalized['tweets'][1]['tweet'])
+        # Un campo distinto del guardado en el mapa se conserva en el tweet
+        self.assertEqual(normalized['tweets'][0]['replies'][1]['name'], 'Ana R.')
+        self.assertEqual(denormalize_users(normalized), data)
+        # normalize_users no modifica el dataset original
+        self.assertIn('username', data['tweets'][0]['tweet'])
+
+    def test_round_trip_mixed_fields(self):
+        """Campos ausentes en algunos tweets o con valores distintos no pasan al mapa"""
+        without_name = make_tweet(10, user_id='7', username='ana')
+        del without_name['name']
+        without_id = make_tweet(13, username='anonimo')
+        del without_id['user_id']
+        data = {
+            'query': '#python',
+            'tweets': [
+                {'tweet': make_tweet(1, user_id='7', username='ana', name='Ana'),
+                 'replies': [without_name,
+                             make_tweet(11, user_id='8', username='bob', name='Bob'),
+                             make_tweet(12, user_id='8', username='bob', name='Roberto'),
+                             without_id]},
+                {'tweet': make_tweet(2, user_id='9', username='eva', name='Eva'), 'replies': []},
+            ]
+        }
+        normalized = normalize_users(data)
+
+        self.assertEqual(normalized['users']['7'], {'username': 'ana'})
+        self.assertEqual(normalized['users']['8'], {'username': 'bob'})
+        self.assertEqual(normalized['users']['9'], {'username': 'eva', 'name': 'Eva'})
+        self.assertEqual(normalized['tweets'][0]['tweet']['name'], 'Ana')
+        self.assertNotIn('name', normalized['tweets'][0]['replies'][0])
+        self.assertEqual(denormalize_users(normalized), data)
+
+    def test_scraper_writes_normalized_and_reads_inline(self):
+        """save_to_json guarda normalizado; load_dataset y export_to_csv lo resuelven"""
+        scraper = self.make_scraper(normalize_users=True)
+        data = self.dataset()
+        filepath = self.run_quiet(scraper.save_to_json, data, 'normalizado.json')
+
+        with open(filepath, encoding='utf-8') as f:
+            self.assertIn('users', json.load(f))
+        loaded, _ = load_dataset(filepath)
+        self.assertEqual(loaded['tweets'], data['tweets'])
+
+        stored, _ = load_dataset(filepath, inline=False)
+        csv_path = self.run_quiet(scraper.export_to_csv, stored, 'normalizado.csv')
+        with open(csv_path, encoding='utf-8-sig') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([row['usuario'] for row in rows], ['ana', 'ana'])
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """Servidor multimedia local con soporte de Range (archivos en server.files)"""
+
+    def do_GET(self):
+        body = self.server.files.get(self.path.split('?')[0])
+        self.server.requests.append((self.path, self.headers.get('Range')))
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        start = 0
+        if self.headers.get('Range'):
+            start = int(self.headers['Range'].split('=')[1].split('-')[0])
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+        self.wfile.write(body[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+class TestMediaDownloader(OfflineTestCase):
+    """Descarga de multimedia contra un servidor HTTP local"""
+
+    def setUp(self):
+        super().setUp()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), MediaHandler)
+        self.server.files = {
+            '/a.jpg': b'A' * 5000,
+            '/repost.jpg': b'A' * 5000,
+            '/b.mp4': bytes(range(256)) * 40,
+        }
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def conversation(self):
+        return {'tweets': [
+            {'tweet': make_tweet(1, photos=[{'id': '1', 'url': f'{self.base}/a.jpg'}]),
+             'replies': [make_tweet(10, photos=[{'id': '2', 'url': f'{self.base}/repost.jpg'}])]},
+            {'tweet': make_tweet(2, videos=[{'id': '3', 'url': f'{self.base}/b.mp4?tag=21', 'hls_url': 'x.m3u8'}],
+                                 photos=[{'id': '1', 'url': f'{self.base}/a.jpg'}]),
+             'replies': []},
+        ]}
+
+    def objects(self):
+        found = []
+        for root, _, files in os.walk(os.path.join('scraping', 'media', 'objects')):
+            found.extend(files)
+        return sorted(found)
+
+    def test_urls_are_unique(self):
+        """Cada URL se descarga una vez aunque aparezca en varios tweets"""
+        urls = media_urls(self.conversation())
+        self.assertEqual([kind for kind, _ in urls], ['photos', 'photos', 'videos'])
+        self.assertEqual(len(media_urls(self.conversation(), include_replies=False)), 2)
+
+    def test_content_addressed_dedupe_and_cache(self):
+        """El mismo contenido en dos URLs se guarda una vez; la segunda ejecución no descarga"""
+        summary = self.run_quiet(MediaDownloader(max_workers=3).run, self.conversation())
+        self.assertEqual((summary['downloaded'], summary['duplicate']), (2, 1))
+        self.assertEqual(len(self.objects()), 2)
+        self.assertTrue(any(name.endswith('.mp4') for name in self.objects()))
+
+        requests_before = len(self.server.requests)
+        summary = self.run_quiet(MediaDownloader().run, self.conversation())
+        self.assertEqual(summary['cached'], 3)
+        self.assertEqual(len(self.server.requests), requests_before)
+
+    def test_budget_and_resume(self):
+        """Con el presupuesto agotado queda un parcial que se reanuda con Range"""
+        conversation = {'tweets': [{'tweet': make_tweet(2, videos=[{'url': f'{self.base}/b.mp4'}]), 'replies': []}]}
+        downloader = MediaDownloader(byte_budget=4096, chunk_size=1024)
+        summary = self.run_quiet(downloader.run, conversation)
+        self.assertTrue(summary['budget_exhausted'])
+        self.assertEqual(summary['partial'], 1)
+        self.assertEqual(self.objects(), [])
+
+        summary = self.run_quiet(MediaDownloader(chunk_size=1024).run, conversation)
+        self.assertEqual(summary['downloaded'], 1)
+        self.assertEqual(summary['bytes_downloaded'], 10240 - 4096)
+        self.assertEqual(self.server.requests[-1][1], 'bytes=4096-')
+
+        with open(os.path.join('scraping', 'media', 'objects', self.objects()[0][:2], self.objects()[0]), 'rb') as f:
+            self.assertEqual(f.read(), self.server.files['/b.mp4'])
+
+
+class TestTweetIndex(OfflineTestCase):
+    """Índice de texto completo sobre los datasets"""
+
+    def dataset(self, likes=5):
+        return {
+            'query': '#python',
+            'tweets': [
+                {'tweet': make_tweet(1, timestamp=1700000000, text='Aprendiendo Python con ejemplos',
+                                     hashtags=['python'], username='ana', likes=likes),
+                 'replies': [make_tweet(10, timestamp=1700000500, text='Los ejemplos están genial', username='bob')]},
+                {'tweet': make_tweet(2, timestamp=1710000000, text='Rust también mola', hashtags=['rust'],
+                                     username='carla', likes=50),
+                 'replies': []},
+            ]
+        }
+
+    def ids(self, results):
+        return [result['id'] for result in results]
+
+    def test_search_filters(self):
+        """Texto, hashtag, usuario, tipo, fechas y engagement"""
+        index = TweetIndex()
+        self.assertEqual(index.add_dataset(self.dataset(), 'a.json'), 3)
+
+        self.assertEqual(self.ids(index.search('ejemplos', order='date')), ['10', '1'])
+        self.assertEqual(self.ids(index.search('ejemplo*', kind='reply')), ['10'])
+        self.assertEqual(self.ids(index.search(hashtag='#rust')), ['2'])
+        self.assertEqual(self.ids(index.search(username='@ANA')), ['1'])
+        self.assertEqual(self.ids(index.search(min_likes=10)), ['2'])
+        self.assertEqual(self.ids(index.search('python OR rust', since_date='2024-01-01')), ['2'])
+        self.assertEqual(index.search('ejemplos', kind='reply')[0]['parent_id'], '1')
+
+    def test_reindex_updates_metrics_without_duplicates(self):
+        """Un tweet reindexado actualiza sus métricas y no se duplica"""
+        index = TweetIndex()
+        index.add_dataset(self.dataset(likes=5))
+        index.add_dataset(self.dataset(likes=500))
+        self.assertEqual(index.stats()['tweets'], 2)
+        self.assertEqual(index.search('python')[0]['likes'], 500)
+
+    def test_save_to_json_updates_index_incrementally(self):
+        """save_to_json indexa lo guardado; index_directory omite archivos sin cambios"""
+        index = TweetIndex()
+        scraper = self.make_scraper(search_index=index, normalize_users=True)
+        self.run_quiet(scraper.save_to_json, self.dataset(), 'python.json')
+        self.assertEqual(self.ids(index.search(username='carla')), ['2'])
+
+        self.assertEqual(self.run_quiet(index.index_directory, 'scraping'), (0, 0))
+        with open(os.path.join('scraping', 'otro_stream.jsonl'), 'w', encoding='utf-8') as f:
+            f.write(json.dumps(dict(make_tweet(3, text='monitor en directo'), _type='tweet', _parent_id='')) + '\n')
+        self.assertEqual(self.run_quiet(index.index_directory, 'scraping'), (1, 1))
+        self.assertEqual(self.ids(index.search('directo')), ['3'])
+
+
+class TestCompaction(OfflineTestCase):
+    """Fusión de datasets de una misma búsqueda"""
+
+    def write_dataset(self, name, downloaded_at, items, status='completed'):
+        path = os.path.join('scraping', name)
+        atomic_write_json(path, {'query': '#python', 'search_type': 'hashtag', 'mode': 'latest',
+                                 'downloaded_at': downloaded_at, 'status': status, 'tweets': items})
+        return path
+
+    def item(self, tweet_id, timestamp, likes=0, replies=()):
+        return {'tweet': make_tweet(tweet_id, timestamp=timestamp, likes=likes),
+                'replies': [make_tweet(r) for r in replies]}
+
+    def test_merge_dedupes_and_orders(self):
+        """Sin duplicados, por fecha descendente, métricas más recientes y más respuestas"""
+        self.write_dataset('python_20250101_100000.json', '2025-01-01T10:00:00', [
+            self.item(1, 100, likes=1, replies=[10, 11]), self.item(2, 200, likes=2), self.item(3, 300)])
+        self.write_dataset('python_20250102_100000.json', '2025-01-02T10:00:00', [
+            self.item(1, 100, likes=50, replies=[10]), self.item(4, 400), self.item(3, 300, likes=7)])
+        self.write_dataset('python_20250103_100000.json', '2025-01-03T10:00:00', [self.item(5, 250)],
+                           status='in_progress')
+        self.write_dataset('otra_20250101_100000.json', '2025-01-01T10:00:00', [self.item(9, 900)])
+
+        files = self.run_quiet(find_dataset_files, '#python')
+        self.assertEqual([os.path.basename(f) for f in files],
+                         ['python_20250101_100000.json', 'python_20250102_100000.json'])
+
+        output = os.path.join('scraping', 'python_merged.json')
+        report = compact_datasets(files, output, run_size=2, csv_path=os.path.join('scraping', 'python_merged.csv'))
+        self.assertEqual((report['items_in'], report['items_out'], report['duplicates']), (6, 4, 2))
+        self.assertEqual(report['runs'], 4)
+
+        with open(output, encoding='utf-8') as f:
+            merged = json.load(f)
+        self.assertEqual([i['tweet']['id'] for i in merged['tweets']], ['4', '3', '2', '1'])
+        tweet_1 = merged['tweets'][3]
+        self.assertEqual(tweet_1['tweet']['likes'], 50)
+        self.assertEqual(len(tweet_1['replies']), 2)
+        self.assertEqual(merged['tweets'][1]['tweet']['likes'], 7)
+        self.assertEqual(merged['total_main_tweets'], 4)
+        self.assertEqual(merged['total_replies'], 2)
+        self.assertEqual(merged['downloaded_at'], '2025-01-02T10:00:00')
+        self.assertEqual(os.listdir('scraping').count('python_merged.csv'), 1)
+        # Sin restos de los tramos temporales
+        self.assertFalse([f for f in os.listdir('scraping') if f.startswith('compact_') or f.endswith('.tmp')])
+
+
+    def test_find_reads_status_without_loading_datasets(self):
+        """find_dataset_files usa el índice o la cabecera y el final del archivo, no json.load"""
+        # Formato de save_to_json: status después de la lista de tweets
+        with open(os.path.join('scraping', 'python_20250101_100000.json'), 'w', encoding='utf-8') as f:
+            json.dump({'query': '#python', 'tweets': [self.item(1, 100, replies=[10])],
+                       'status': 'in_progress'}, f, ensure_ascii=False, indent=2)
+        with open(os.path.join('scraping', 'python_20250102_100000.json'), 'w', encoding='utf-8') as f:
+            json.dump({'query': '#python', 'tweets': [self.item(2, 200)], 'status': 'completed'},
+                      f, ensure_ascii=False, indent=2)
+        atomic_write_dataset(os.path.join('scraping', 'python_20250103_100000.json'),
+                             {'query': '#python', 'status': 'in_progress', 'tweets': [self.item(3, 300)]})
+        atomic_write_dataset(os.path.join('scraping', 'python_20250104_100000.json'),
+                             {'query': '#python', 'status': 'completed', 'tweets': []})
+
+        with mock.patch('download_hashtag.load_checkpoint', side_effect=AssertionError('json.load')):
+            files = self.run_quiet(find_dataset_files, '#python')
+        self.assertEqual([os.path.basename(f) for f in files],
+                         ['python_20250102_100000.json', 'python_20250104_100000.json'])
+
+    def test_cli_deletes_sources(self):
+        """compact --delete-sources deja un único dataset"""
+        for day in (1, 2, 3):
+            self.write_dataset(f'python_2025010{day}_100000.json', f'2025-01-0{day}', [self.item(day, day), self.item(7, 7)])
+        self.run_quiet(download_hashtag.cli, ['compact', 'python', '--delete-sources'])
+
+        remaining = [f for f in os.listdir('scraping') if f.endswith('.json')]
+        self.assertEqual(len(remaining), 1)
+        data, _ = load_dataset(os.path.join('scraping', remaining[0]))
+        self.assertEqual(data['total_main_tweets'], 4)
+
+
+class TestOffsetIndex(OfflineTestCase):
+    """Índice de offsets y acceso aleatorio con mmap"""
+
+    def dataset(self):
+        return {
+            'query': '#python', 'search_type': 'hashtag', 'mode': 'latest', 'status': 'in_progress',
+            'tweets': [
+                {'tweet': make_tweet(1, text='ñandú ✓'), 'replies': [make_tweet(10), make_tweet(11)]},
+                {'tweet': make_tweet(2, timestamp=1600000000), 'replies': []},
+            ],
+            'total_main_tweets': 2
+        }
+
+    def test_write_and_random_access(self):
+        """Cada tweet se lee por su rango de bytes; las respuestas llevan a su hilo"""
+        path = os.path.join('scraping', 'python_20250101_000000.json')
+        atomic_write_dataset(path, self.dataset())
+
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['tweets'], self.dataset()['tweets'])
+        self.assertTrue(os.path.exists(path + '.idx'))
+
+        with DatasetReader(path) as reader:
+            self.assertEqual(len(reader), 2)
+            self.assertIn('11', reader)
+            self.assertNotIn('99', reader)
+            self.assertEqual(reader.get('1')['tweet']['text'], 'ñandú ✓')
+            self.assertEqual(reader.get('11')['tweet']['id'], '1')
+            self.assertEqual(reader.get_tweet('11')['id'], '11')
+            self.assertIsNone(reader.get('99'))
+            self.assertEqual(reader.header()['query'], '#python')
+            self.assertEqual(reader.meta['oldest_date'], make_tweet(2, timestamp=1600000000)['time_parsed'])
+
+    def test_incomplete_downloads_use_index_metadata(self):
+        """find_incomplete_downloads no necesita cargar el dataset si hay índice"""
+        path = os.path.join('scraping', 'python_20250101_000000.json')
+        atomic_write_dataset(path, self.dataset())
+
+        with mock.patch('download_hashtag.load_checkpoint', side_effect=AssertionError('carga completa')):
+            incomplete = self.run_quiet(find_incomplete_downloads)
+        self.assertEqual(incomplete[0]['total_tweets'], 2)
+        self.assertEqual(incomplete[0]['query'], '#python')
+
+    def test_rebuilds_stale_index_and_reads_legacy_files(self):
+        """Un índice desfasado se reconstruye; un JSON antiguo se lee sin reescribirlo"""
+        legacy = os.path.join('scraping', 'antiguo.json')
+        atomic_write_json(legacy, self.dataset())
+        with open(legacy, 'rb') as f:
+            original = f.read()
+        with DatasetReader(legacy) as reader:
+            self.assertEqual(reader.get('10')['tweet']['id'], '1')
+            self.assertEqual(reader.ids(), ['1', '2'])
+            self.assertEqual(reader.header()['query'], '#python')
+            self.assertEqual(reader.meta['status'], 'in_progress')
+        with redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+            download_hashtag.cli(['get', '99', '--dir', 'scraping'])
+        with open(legacy, 'rb') as f:
+            self.assertEqual(f.read(), original)
+        self.assertEqual(os.listdir('scraping'), ['antiguo.json'])
+
+        # Solo con migrate se reescribe con un tweet por línea
+        with redirect_stdout(io.StringIO()), DatasetReader(legacy, migrate=True) as reader:
+            self.assertEqual(reader.get('10')['tweet']['id'], '1')
+        self.assertTrue(os.path.exists(legacy + '.idx'))
+
+        empty = os.path.join('scraping', 'vacio.json')
+        atomic_write_dataset(empty, {'query': '#python', 'tweets': []})
+        os.remove(empty + '.idx')
+        self.assertEqual(build_offset_index(empty)['items'], {})
+
+        compacted = os.path.join('scraping', 'python_merged.json')
+        compact_datasets([legacy], compacted)
+        os.remove(compacted + '.idx')
+        with DatasetReader(compacted) as reader:
+            self.assertEqual(reader.ids(), ['1', '2'])
+            self.assertEqual(reader.meta['status'], 'completed')
+
+    def test_normalized_dataset_is_inlined(self):
+        """Con autores normalizados, get() devuelve la vista en línea"""
+        scraper = self.make_scraper(normalize_users=True)
+        path = self.run_quiet(scraper.save_to_json, self.dataset(), 'norm.json')
+        with DatasetReader(path) as reader:
+            self.assertEqual(reader.get('2')['tweet']['username'], 'usuario')
+
+
+class TestPhaseProfiler(OfflineTestCase):
+    """Perfilado por fases con cProfile y tracemalloc"""
+
+    def test_phases_are_measured_and_dumped(self):
+        """Cada fase acumula llamadas y tiempos y se vuelca en scraping/profile_*"""
+        profiler = PhaseProfiler(cpu=True, memory=True, top=5)
+        scraper = self.make_scraper(profiler=profiler)
+        api = FakeAPI(
+            pages=[[make_tweet(1, replies=1), make_tweet(2)]],
+            replies={'1': [make_tweet(10)]}
+        )
+        try:
+            with mock.patch('download_hashtag.requests.Session.get', side_effect=api):
+                conversation = self.run_quiet(scraper.download_full_conversation, 'q')
+            self.run_quiet(scraper.apply_filters, conversation, min_likes=0)
+            self.run_quiet(scraper.export_to_csv, conversation)
+            directory = self.run_quiet(profiler.finish)
+        finally:
+            if profiler._started_tracing:
+                download_hashtag.tracemalloc.stop()
+
+        stats = profiler.summary()
+        self.assertEqual(stats['network']['calls'], len(api.calls))
+        self.assertEqual(stats['search_page']['calls'], 1)
+        self.assertEqual(stats['replies']['calls'], 1)
+        self.assertEqual(stats['filters']['calls'], 1)
+        self.assertEqual(stats['export']['calls'], 1)
+        self.assertGreaterEqual(stats['checkpoint']['calls'], 1)
+        self.assertGreater(stats['search_page']['allocated_bytes'], 0)
+
+        self.assertTrue(directory.startswith(os.path.join('scraping', 'profile_')))
+        with open(os.path.join(directory, 'summary.json'), encoding='utf-8') as f:
+            report = json.load(f)
+        self.assertEqual(report['phases']['replies']['calls'], 1)
+        self.assertIn('peak_bytes', report['traced_memory'])
+        self.assertTrue(os.path.exists(os.path.join(directory, 'allocations.txt')))
+        self.assertFalse(download_hashtag.tracemalloc.is_tracing())
+
+    def test_nested_phase_pauses_outer_profile(self):
+        """El perfil de la fase externa no incluye lo ejecutado en la interna"""
+        profiler = PhaseProfiler(cpu=True)
+
+        def inner_work():
+            return sum(range(1000))
+
+        with profiler.phase('outer'):
+            with profiler.phase('inner'):
+                inner_work()
+
+        directory = profiler.dump(os.path.join('scraping', 'perfil'))
+        outer = download_hashtag.pstats.Stats(os.path.join(directory, 'outer.prof'))
+        inner = download_hashtag.pstats.Stats(os.path.join(directory, 'inner.prof'))
+        self.assertFalse(any(func[2] == 'inner_work' for func in outer.stats))
+        self.assertTrue(any(func[2] == 'inner_work' for func in inner.stats))
+        self.assertGreaterEqual(profiler.stats['outer']['wall_seconds'], profiler.stats['inner']['wall_seconds'])
+
+    def test_disabled_by_default(self):
+        """Sin PROFILE en el entorno el scraper no crea perfilador"""
+        self.assertIsNone(self.make_scraper().profiler)
+        with mock.patch.dict(os.environ, {'PROFILE': 'cpu,memory'}):
+            profiler = PhaseProfiler.from_env()
+        try:
+            self.assertTrue(profiler.cpu and profiler.memory)
+        finally:
+            profiler.finish()
+
+
+class TestStreamingSinks(OfflineTestCase):
+    """Salida en streaming de tweets y respuestas"""
+
+    def test_records_are_emitted_as_they_arrive(self):
+        """Cada página y cada lote de respuestas se emite antes del guardado final"""
+        records = []
+        saved_when_emitted = []
+
+        def consume(record):
+            records.append(record)
+            saved_when_emitted.append(any(f.endswith('.json') for f in os.listdir('scraping')))
+
+        scraper = self.make_scraper(sink=CallbackSink(consume))
+        api = FakeAPI(
+            pages=[[make_tweet(1, replies=1)], [make_tweet(2)]],
+            replies={'1': [make_tweet(10)]}
+        )
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=api):
+            self.run_quiet(scraper.download_full_conversation, '#python', incremental_save=False)
+
+        self.assertEqual([(r['id'], r['_type'], r['_parent_id']) for r in records],
+                         [('1', 'tweet', ''), ('2', 'tweet', ''), ('10', 'reply', '1')])
+        self.assertEqual({r['_query'] for r in records}, {'#python'})
+        self.assertFalse(any(saved_when_emitted))
+        self.assertEqual(scraper.sink.summary(), {'emitted': 3, 'dropped': 0})
+
+    def test_buffered_sink_backpressure(self):
+        """block=True no pierde registros con un consumidor lento; block=False descarta"""
+        release = threading.Event()
+        received = []
+
+        def slow(record):
+            release.wait(5)
+            received.append(record['id'])
+
+        blocking = BufferedSink(CallbackSink(slow), maxsize=2, block=True)
+        producer = threading.Thread(target=lambda: [blocking.emit({'id': str(i)}) for i in range(6)])
+        producer.start()
+        producer.join(0.3)
+        self.assertTrue(producer.is_alive())
+        release.set()
+        producer.join(5)
+        blocking.close()
+        self.assertEqual(received, [str(i) for i in range(6)])
+
+        gate = threading.Event()
+        dropping = BufferedSink(CallbackSink(lambda record: gate.wait(5)), maxsize=1, block=False)
+        for i in range(5):
+            dropping.emit({'id': str(i)})
+        gate.set()
+        dropping.close()
+        summary = dropping.summary()
+        self.assertGreater(summary['queue_dropped'], 0)
+        self.assertEqual(summary['queued'] + summary['queue_dropped'], 5)
+
+    def test_closed_pipe_does_not_stop_download(self):
+        """Si el lector cierra la tubería, los registros se descartan sin error"""
+        read_fd, write_fd = os.pipe()
+        os.close(read_fd)
+        sink = NDJSONSink(os.fdopen(write_fd, 'w'), close_stream=True)
+        self.run_quiet(sink.emit, {'id': '1'})
+        sink.emit({'id': '2'})
+        sink.close()
+        self.assertEqual(sink.summary(), {'emitted': 0, 'dropped': 2})
+
+    @unittest.skipIf(sys.platform == 'win32', 'requiere sockets Unix')
+    def test_unix_socket_sink(self):
+        """El consumidor escucha en un socket Unix y recibe una línea por registro"""
+        import socket
+
+        path = os.path.join(self.test_dir, 'stream.sock')
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(1)
+        try:
+            sink = UnixSocketSink(path)
+            conn, _ = server.accept()
+            sink.emit({'id': '1', 'text': 'ñ'})
+            sink.emit({'id': '2'})
+            sink.close()
+            data = b''
+            while True:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+            conn.close()
+        finally:
+            server.close()
+        lines = [json.loads(line) for line in data.decode('utf-8').splitlines()]
+        self.assertEqual(lines, [{'id': '1', 'text': 'ñ'}, {'id': '2'}])
+
+
+class TestEngagementTracker(OfflineTestCase):
+    """Serie temporal de engagement y decisión de refresco"""
+
+    def test_snapshots_only_on_change_and_reload(self):
+        """Solo se guarda una instantánea cuando cambia algún contador; el estado sobrevive al reinicio"""
+        path = os.path.join('scraping', 'q_engagement.jsonl')
+        tracker = EngagementTracker(path)
+        tweet = make_tweet(1, replies=3, likes=10, views='100')
+
+        self.assertTrue(tracker.needs_refetch(tweet))
+        self.assertEqual(tracker.record([tweet], {'1'}, timestamp=1000), 1)
+        self.assertEqual(tracker.record([tweet], timestamp=1100), 0)
+        self.assertFalse(tracker.needs_refetch(tweet))
+        self.assertEqual(tracker.record([make_tweet(1, replies=3, likes=50, views='900')], timestamp=1200), 1)
+
+        reloaded = EngagementTracker(path)
+        self.assertFalse(reloaded.needs_refetch(make_tweet(1, replies=3)))
+        self.assertTrue(reloaded.needs_refetch(make_tweet(1, replies=4)))
+        self.assertEqual(reloaded.series('1')['1'][-1], {
+            't': 1200, 'likes': 50, 'retweets': 0, 'replies': 3, 'views': 900, 'fetched': 0
+        })
+
+    def test_top_growth(self):
+        """El crecimiento se mide desde la última instantánea anterior a la ventana"""
+        tracker = EngagementTracker(os.path.join('scraping', 'q_engagement.jsonl'))
+        tracker.record([make_tweet(1, likes=10), make_tweet(2, likes=10)], timestamp=0)
+        tracker.record([make_tweet(1, likes=15), make_tweet(2, likes=100)], timestamp=3000)
+        tracker.record([make_tweet(1, likes=40)], timestamp=4000)
+
+        self.assertEqual(tracker.top_growth('likes', window_seconds=3600, now=4000), [('2', 90), ('1', 30)])
+        self.assertEqual(tracker.top_growth('likes', window_seconds=500, now=4000), [('1', 25)])
+
+    def test_window_cap_and_compaction(self):
+        """Los tweets sin actividad en la ventana se olvidan y el archivo se compacta al arrancar"""
+        path = os.path.join('scraping', 'q.engagement.ndjson')
+        tracker = EngagementTracker(path, window_hours=1, max_items=2)
+        tracker.record([make_tweet(1, replies=1)], {'1'}, timestamp=0)
+        tracker.record([make_tweet(2, likes=1), make_tweet(3, likes=1)], timestamp=100)
+        self.assertEqual(set(tracker.latest), {'2', '3'})  # techo: se olvida el de actividad más antigua
+
+        tracker = EngagementTracker(path, window_hours=1)
+        tracker.record([make_tweet(1, replies=1, likes=5)], timestamp=3700)
+        tracker.record([make_tweet(1, replies=1, likes=6)], timestamp=7000)
+        self.assertEqual(set(tracker.latest), {'1'})
+
+        reloaded = EngagementTracker(path, window_hours=1)
+        self.assertEqual(set(reloaded.latest), {'1'})
+        self.assertFalse(reloaded.needs_refetch(make_tweet(1, replies=1)))
+        with open(path, encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f]
+        # Solo el tweet vivo: su descarga anterior a la ventana y sus instantáneas recientes
+        self.assertEqual([(row[0], row[1]) for row in rows], [('1', 0), ('1', 3700), ('1', 7000)])
+
+    def test_planner_skips_unchanged_threads(self):
+        """ReplyFetchPlanner con refresh omite los hilos ya descargados sin respuestas nuevas"""
+        tracker = EngagementTracker(os.path.join('scraping', 'q_engagement.jsonl'))
+        tracker.record([make_tweet(1, replies=2), make_tweet(2, replies=2)], {'1', '2'})
+        planner = ReplyFetchPlanner(refresh=tracker)
+
+        selected = planner.plan([make_tweet(1, replies=2), make_tweet(2, replies=5), make_tweet(3, replies=1)])
+        self.assertEqual(selected, {'2', '3'})
+        self.assertEqual(planner.summary()['unchanged'], 1)
+
+
+class TestSeenSet(OfflineTestCase):
+    """Deduplicación con memoria acotada por ventana de tiempo"""
+
+    def test_window_expiry(self):
+        """Los IDs fuera de la ventana se olvidan y lo anterior al horizonte se da por visto"""
+        seen = SeenSet(window_seconds=800, buckets=8)
+        self.assertTrue(seen.add('1', 1000))
+        self.assertFalse(seen.add('1', 1000))
+        self.assertTrue(seen.add('2', 1500))
+        self.assertEqual(len(seen), 2)
+
+        self.assertTrue(seen.add('3', 2000))
+        self.assertNotIn('1', seen)
+        self.assertIn('2', seen)
+        self.assertEqual(seen.expired, 1)
+        # Anterior al horizonte: no se vuelve a emitir
+        self.assertFalse(seen.add('4', 1000))
+
+    def test_memory_ceiling(self):
+        """Con max_items se descartan los cubos más antiguos al superar el techo"""
+        seen = SeenSet(window_seconds=10 ** 9, max_items=1000, buckets=1000)
+        for i in range(5000):
+            seen.add(str(10 ** 18 + i), 1000000 * (i // 100 + 1))
+        self.assertLessEqual(len(seen), 1000)
+        self.assertIn(str(10 ** 18 + 4999), seen)
+        self.assertNotIn(str(10 ** 18), seen)
+        self.assertFalse(seen.add(str(10 ** 18), 1000000))
+
+    def test_round_trip(self):
+        """to_dict/from_dict conserva IDs numéricos y no numéricos y el horizonte"""
+        seen = SeenSet(window_seconds=3600)
+        for i in range(5000):
+            seen.add(str(1790000000000000000 + i), 1000 + i // 2)
+        seen.add('abc', 1000)
+        restored = SeenSet.from_dict(json.loads(json.dumps(seen.to_dict())))
+        self.assertEqual(len(restored), len(seen))
+        self.assertIn('1790000000000000123', restored)
+        self.assertIn('abc', restored)
+        self.assertNotIn('1', restored)
+        self.assertEqual(restored.horizon, seen.horizon)
+        self.assertLess(seen.memory_bytes(), 16 * len(seen))
+
+
+class TestPageArchive(OfflineTestCase):
+    """Archivo de respuestas crudas y regeneración sin API"""
+
+    def test_rebuild_without_api_calls(self):
+        """Lo archivado durante una descarga basta para regenerar el dataset con otros filtros"""
+        archive = PageArchive()
+        scraper = self.make_scraper(page_archive=archive)
+        api = FakeAPI(
+            pages=[[make_tweet(1, replies=1, likes=100)], [make_tweet(2, likes=3)]],
+            replies={'1': [make_tweet(10)]}
+        )
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=api):
+            conversation = self.run_quiet(scraper.download_full_conversation, 'python', incremental_save=False)
+
+        stats = archive.stats()
+        self.assertEqual((stats['search_pages'], stats['reply_pages']), (2, 1))
+        page = next(archive.pages('search', 'python'))
+        self.assertEqual(page.next_cursor, '1')
+        self.assertIsNone(page._body)
+
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=AssertionError('sin API')):
+            rebuilt = archive.rebuild('python', 'latest')
+            filtered = archive.rebuild('python', 'latest', tweet_filter=TweetFilter(min_likes=50))
+        self.assertEqual(rebuilt['tweets'], conversation['tweets'])
+        self.assertEqual([item['tweet']['id'] for item in filtered['tweets']], ['1'])
+        self.assertEqual(filtered['total_replies'], 1)
+
+    def test_stored_pages_match_what_was_processed(self):
+        """Cada página archivada guarda los bytes recibidos y se parsea al mismo JSON que procesó la descarga"""
+        api = FakeAPI(pages=[[make_tweet(1, replies=1, text='ñandú ✓')], [make_tweet(2)]],
+                      replies={'1': [make_tweet(10)]})
+        bodies = []
+
+        def fake_get(url, headers=None, params=None, **kwargs):
+            response = api(url, headers, params)
+            bodies.append(response.content)
+            return response
+
+        archive = PageArchive()
+        scraper = self.make_scraper(page_archive=archive)
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=fake_get):
+            self.run_quiet(scraper.download_full_conversation, 'python', incremental_save=False)
+
+        stored = list(archive.pages('search', 'python')) + list(archive.pages('replies', '1'))
+        self.assertEqual([page.body for page in stored], bodies)
+        self.assertEqual([page.json() for page in stored], [json.loads(body) for body in bodies])
+        self.assertEqual([t['text'] for t in archive.tweets('python')], ['ñandú ✓', 'tweet 2'])
+
+    def test_archive_search_does_not_parse(self):
+        """archive_search sigue los cursores leyendo el cuerpo crudo, sin response.json()"""
+        api = FakeAPI(pages=[[make_tweet(1)], [make_tweet(2)], [make_tweet(3)]])
+        responses = []
+
+        def fake_get(url, headers=None, params=None, **kwargs):
+            responses.append(api(url, headers, params))
+            return responses[-1]
+
+        scraper = self.make_scraper(page_archive=PageArchive())
+        with mock.patch('download_hashtag.requests.Session.get', side_effect=fake_get):
+            pages = self.run_quiet(scraper.archive_search, 'python')
+
+        self.assertEqual(pages, 3)
+        self.assertEqual([params.get('cursor') for _, params in api.calls], [None, '1', '2'])
+        self.assertFalse(any(response.json.called for response in responses))
+        self.assertEqual([t['id'] for t in scraper.page_archive.tweets('python')], ['1', '2', '3'])
+
+    def test_extract_cursor(self):
+        """El cursor se lee del JSON crudo, con escapes y sin confundirlo con texto de los tweets"""
+        body = json.dumps({'data': {'tweets': [{'text': 'el "cursor": "falso"'}], 'cursor': 'DAAC\\"x/=='}})
+        self.assertEqual(extract_cursor(body.encode('utf-8')), 'DAAC\\"x/==')
+        self.assertIsNone(extract_cursor(b'{"tweets": [], "cursor": null}'))
+        self.assertIsNone(extract_cursor(b'{"tweets": []}'))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)